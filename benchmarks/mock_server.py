@@ -0,0 +1,694 @@
+"""A local stand-in for the Salesforce Bulk API, used by the benchmarks and the offline tests.
+
+It implements enough of the ``/services/async/{version}`` XML API for
+``SalesforceBulkipy`` to create jobs, post batches, poll them and download
+(multi-file) results, and of the Bulk API 2.0 ``/services/data/vXX.X/jobs``
+API for ``SalesforceBulkipyV2`` (ingest jobs and locator paged queries), plus
+COUNT() and MIN/MAX queries of the REST query resource and the limits resource.
+Latency and batch processing delays are configurable so polling and network
+overhead can be measured without a real org::
+
+    with MockBulkServer(processing_delay=0.5, result_files=3) as server:
+        bulk = SalesforceBulkipy(session_id=server.session_id, host=server.host)
+        ...
+"""
+from __future__ import absolute_import
+from future.standard_library import install_aliases
+install_aliases()
+
+import csv
+import itertools
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from io import StringIO
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs
+import xml.etree.ElementTree as ET
+
+from salesforce_bulkipy.soql import parse_datetime
+
+JOB_NS = 'http://www.force.com/2009/06/asyncapi/dataload'
+
+DATETIME_FIELDS = ('createddate', 'systemmodstamp', 'lastmodifieddate')
+
+# comparisons of datetime fields the mock applies to queries, all ANDed together
+_DATETIME_CONDITION = re.compile(
+    r'\b(CreatedDate|SystemModstamp|LastModifiedDate)\s*(>=|<=|>|<|=)\s*'
+    r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?(?:Z|[+-]\d\d:?\d\d))', re.I)
+
+
+def record_time(n):
+    """CreatedDate/SystemModstamp of the ``n``-th record: one record per minute from 2020-01-01"""
+    return datetime(2020, 1, 1) + timedelta(minutes=n)
+
+
+def format_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+
+
+def default_record_factory(fields, n):
+    """Builds the values of the ``n``-th query result row"""
+    values = []
+    for field in fields:
+        if field.lower() == 'id':
+            values.append('001%012dAAA' % n)
+        elif field.lower() in DATETIME_FIELDS:
+            values.append(format_time(record_time(n)))
+        elif field.lower() == 'isdeleted':
+            values.append('false')
+        else:
+            values.append('%s %d' % (field, n))
+    return values
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockBulkServer(object):
+    """In-process Bulk API server listening on 127.0.0.1
+
+    Args:
+        latency (float): seconds added to every request
+        queued_delay (float): seconds a new batch stays Queued
+        processing_delay (float): seconds a batch stays InProgress after that
+        result_files (int): number of result files each query batch is split into
+        query_rows (int): number of records every object holds; record ``n`` was
+            created at ``record_time(n)`` and queries filter on comparisons of
+            CreatedDate/SystemModstamp with datetime literals
+        record_factory (callable): builds the values of a query result row from
+            the selected fields and the row number
+        session_id (str): the only session id the server accepts
+        api_version (str): the API version in the service path
+    """
+
+    def __init__(self, latency=0.0, queued_delay=0.0, processing_delay=0.0,
+                 result_files=1, query_rows=1000, record_factory=default_record_factory,
+                 session_id='mock-session-id', api_version='29.0'):
+        self.latency = latency
+        self.queued_delay = queued_delay
+        self.processing_delay = processing_delay
+        self.result_files = result_files
+        self.query_rows = query_rows
+        self.record_factory = record_factory
+        self.session_id = session_id
+        self.api_version = api_version
+
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.batches = {}
+        self.v2_jobs = {}
+        self.modstamps = {}  # record number => SystemModstamp, for updated records
+        self.deleted = set()
+        self.request_counts = defaultdict(int)
+        self.in_flight = 0
+        self.max_in_flight = 0  # most requests handled at once
+        self.throttled = 0  # number of coming requests answered with 429 Too Many Requests
+        self.limits = {
+            'DailyApiRequests': {'Max': 15000, 'Remaining': 14000},
+            'DailyBulkApiBatches': {'Max': 15000, 'Remaining': 14500},
+        }
+        self._ids = itertools.count(1)
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def host(self):
+        return 'http://127.0.0.1:%d' % self._httpd.server_address[1]
+
+    def start(self):
+        handler = type('Handler', (_MockBulkHandler,), {'mock': self})
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self.lock:
+            self.request_counts.clear()
+            self.max_in_flight = self.in_flight
+
+    def new_id(self, prefix):
+        # 18 char ids like the real thing, 750 is the job key prefix, 751 the batch one
+        return '%s%012dAAA' % (prefix, next(self._ids))
+
+    # State of the fake server
+
+    def create_job(self, info, pk_chunking=None):
+        job_id = self.new_id('750')
+        job = {
+            'id': job_id,
+            'operation': info.get('operation'),
+            'object': info.get('object'),
+            'contentType': info.get('contentType') or 'CSV',
+            'concurrencyMode': info.get('concurrencyMode') or 'Parallel',
+            'state': 'Open',
+            'batches': [],
+            'pkChunking': None,
+        }
+        if pk_chunking:
+            match = re.search(r'chunkSize=(\d+)', pk_chunking)
+            job['pkChunking'] = int(match.group(1)) if match else 100000
+        with self.lock:
+            self.jobs[job_id] = job
+        return job
+
+    def create_batch(self, job, body):
+        batch = {
+            'id': self.new_id('751'),
+            'jobId': job['id'],
+            'created': time.time(),
+            'state': None,
+            'stateMessage': None,
+        }
+        as_json = job['contentType'] == 'JSON'
+        if job['operation'] in ('query', 'queryAll') and job['pkChunking']:
+            # like Salesforce, replace the batch with one batch per chunk of ids
+            batch['soql'] = body.decode('utf-8')
+            batch['state'] = 'Not Processed'
+            batch['results'] = []
+            batch['records'] = 0
+            rows = self.matching_rows(batch['soql'], job['operation'] == 'queryAll')
+            for start in range(0, len(rows), job['pkChunking']):
+                self.add_batch(job, {
+                    'id': self.new_id('751'), 'jobId': job['id'], 'created': time.time(),
+                    'state': None, 'stateMessage': None, 'soql': batch['soql'],
+                    'results': self.query_results(batch['soql'], as_json,
+                                                  rows[start:start + job['pkChunking']]),
+                    'records': len(rows[start:start + job['pkChunking']])})
+        elif job['operation'] in ('query', 'queryAll'):
+            batch['soql'] = body.decode('utf-8')
+            rows = self.matching_rows(batch['soql'], job['operation'] == 'queryAll')
+            batch['results'] = self.query_results(batch['soql'], as_json, rows)
+            batch['records'] = len(rows)
+        elif as_json:
+            rows = json.loads(body.decode('utf-8'))
+            batch['records'] = len(rows)
+            batch['results'] = [self.upload_results(rows, as_json)]
+        else:
+            rows = list(csv.reader(StringIO(body.decode('utf-8'))))[1:]
+            batch['records'] = len(rows)
+            batch['results'] = [self.upload_results(rows)]
+        self.add_batch(job, batch)
+        return batch
+
+    def add_batch(self, job, batch):
+        with self.lock:
+            self.batches[batch['id']] = batch
+            job['batches'].append(batch['id'])
+
+    def batch_state(self, batch):
+        if batch['state'] is not None:
+            return batch['state']
+        elapsed = time.time() - batch['created']
+        if elapsed < self.queued_delay:
+            return 'Queued'
+        if elapsed < self.queued_delay + self.processing_delay:
+            return 'InProgress'
+        return 'Completed'
+
+    @staticmethod
+    def query_fields(soql):
+        match = re.search(r'select\s+(.*?)\s+from\s+(\w+)', soql, re.I | re.S)
+        return [f.strip() for f in match.group(1).split(',')]
+
+    def update_record(self, n, when=None):
+        """Bumps the SystemModstamp of record ``n``, by default to just after the newest record"""
+        self.modstamps[n] = when or record_time(self.query_rows)
+
+    def delete_record(self, n, when=None):
+        """Deletes record ``n``, it is then only returned by queryAll, with IsDeleted true"""
+        self.update_record(n, when)
+        self.deleted.add(n)
+
+    def field_time(self, field, n):
+        if field.lower() == 'createddate':
+            return record_time(n)
+        return self.modstamps.get(n, record_time(n))
+
+    def record_values(self, fields, n):
+        values = list(self.record_factory(fields, n))
+        for i, field in enumerate(fields):
+            if field.lower() in ('systemmodstamp', 'lastmodifieddate') and n in self.modstamps:
+                values[i] = format_time(self.modstamps[n])
+            elif field.lower() == 'isdeleted':
+                values[i] = 'true' if n in self.deleted else 'false'
+        return values
+
+    def matching_rows(self, soql, include_deleted=False):
+        """Numbers of the records soql selects, applying its datetime comparisons, LIMIT and OFFSET"""
+        checks = []
+        for field, op, value in _DATETIME_CONDITION.findall(soql):
+            value = parse_datetime(value)
+            checks.append((field, {
+                '>=': lambda t, v=value: t >= v, '<=': lambda t, v=value: t <= v,
+                '>': lambda t, v=value: t > v, '<': lambda t, v=value: t < v,
+                '=': lambda t, v=value: t == v}[op]))
+        rows = [n for n in range(self.query_rows)
+                if (include_deleted or n not in self.deleted)
+                and all(check(self.field_time(field, n)) for field, check in checks)]
+        offset = re.search(r'\bOFFSET\s+(\d+)', soql, re.I)
+        limit = re.search(r'\bLIMIT\s+(\d+)', soql, re.I)
+        rows = rows[int(offset.group(1)):] if offset else rows
+        return rows[:int(limit.group(1))] if limit else rows
+
+    def query_csv(self, fields, rows):
+        buf = StringIO()
+        writer = csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(fields)
+        for n in rows:
+            writer.writerow(self.record_values(fields, n))
+        return buf.getvalue().encode('utf-8')
+
+    def query_json(self, fields, rows):
+        return json.dumps([dict(zip(fields, self.record_values(fields, n)))
+                           for n in rows]).encode('utf-8')
+
+    def query_results(self, soql, as_json=False, rows=None):
+        fields = self.query_fields(soql)
+        rows = self.matching_rows(soql) if rows is None else rows
+        build = self.query_json if as_json else self.query_csv
+        per_file = -(-len(rows) // max(self.result_files, 1)) or 1
+        return [build(fields, rows[start:start + per_file])
+                for start in range(0, max(len(rows), 1), per_file)]
+
+    def rest_query(self, soql):
+        """Answers COUNT() and MIN/MAX(datetime field) queries like the REST query resource"""
+        rows = self.matching_rows(soql)
+        if re.match(r'\s*select\s+count\(\)', soql, re.I):
+            return {'totalSize': len(rows), 'done': True, 'records': []}
+        record = {}
+        for func, field, alias in re.findall(r'\b(min|max)\((\w+)\)\s+(\w+)', soql, re.I):
+            times = [self.field_time(field, n) for n in rows]
+            value = (min if func.lower() == 'min' else max)(times) if times else None
+            record[alias] = format_time(value) if value else None
+        return {'totalSize': 1, 'done': True, 'records': [record]}
+
+    def upload_results(self, rows, as_json=False):
+        if as_json:
+            return json.dumps([{'id': self.new_id('001'), 'success': True, 'created': True, 'errors': []}
+                               for _ in rows]).encode('utf-8')
+        buf = StringIO()
+        writer = csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(['Id', 'Success', 'Created', 'Error'])
+        for _ in rows:
+            writer.writerow([self.new_id('001'), 'true', 'true', ''])
+        return buf.getvalue().encode('utf-8')
+
+    # Bulk API 2.0 jobs, a job is its own batch so the batch_state timing applies
+
+    def create_v2_job(self, job_type, info):
+        job = {
+            'id': self.new_id('750'),
+            'object': info.get('object'),
+            'operation': info.get('operation'),
+            'contentType': info.get('contentType') or 'CSV',
+            'lineEnding': info.get('lineEnding') or 'LF',
+            'jobType': job_type,
+            'created': time.time(),
+            'state': 'Open',
+            'stateMessage': None,
+            'records': 0,
+            'data': b'',
+        }
+        if job_type == 'query':
+            job['soql'] = info['query']
+            job['object'] = re.search(r'from\s+(\w+)', info['query'], re.I).group(1)
+            job['rows'] = self.matching_rows(info['query'], info.get('operation') == 'queryAll')
+            job['records'] = len(job['rows'])
+            job['state'] = None
+        with self.lock:
+            self.v2_jobs[job['id']] = job
+        return job
+
+    def v2_state(self, job):
+        state = self.batch_state(job)
+        return {'Queued': 'UploadComplete', 'Completed': 'JobComplete'}.get(state, state)
+
+    def v2_job_info(self, job):
+        state = self.v2_state(job)
+        info = dict((key, job[key]) for key in ('id', 'object', 'operation', 'contentType', 'lineEnding'))
+        info['state'] = state
+        info['numberRecordsProcessed'] = job['records'] if state == 'JobComplete' else 0
+        info['numberRecordsFailed'] = 0
+        if job['jobType'] == 'ingest':
+            info['totalProcessingTime'] = int(self.processing_delay * 1000) if state == 'JobComplete' else 0
+        return info
+
+
+def _xml(root_tag, values):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<%s xmlns="%s">' % (root_tag, JOB_NS)]
+    for key, value in values:
+        if value is None:
+            parts.append('<%s/>' % key)
+        else:
+            parts.append('<%s>%s</%s>' % (key, value, key))
+    parts.append('</%s>' % root_tag)
+    return ''.join(parts).encode('utf-8')
+
+
+def _job_info(job):
+    return _xml('jobInfo', [(key, job[key]) for key in
+                            ('id', 'operation', 'object', 'state', 'concurrencyMode', 'contentType')])
+
+
+def _batch_values(mock, batch):
+    state = mock.batch_state(batch)
+    done = state == 'Completed'
+    return [
+        ('id', batch['id']),
+        ('jobId', batch['jobId']),
+        ('state', state),
+        ('stateMessage', batch['stateMessage']),
+        ('numberRecordsProcessed', batch['records'] if done else 0),
+        ('numberRecordsFailed', 0),
+        ('totalProcessingTime', int(mock.processing_delay * 1000) if done else 0),
+    ]
+
+
+class _MockBulkHandler(BaseHTTPRequestHandler):
+    mock = None
+    protocol_version = 'HTTP/1.1'
+
+    v2_routes = [
+        ('POST', r'/jobs/(ingest)$', 'v2_create_job'),
+        ('POST', r'/jobs/(query)$', 'v2_create_job'),
+        ('GET', r'/jobs/(?:ingest|query)/(\w+)$', 'v2_get_job'),
+        ('PATCH', r'/jobs/(?:ingest|query)/(\w+)$', 'v2_update_job'),
+        ('PUT', r'/jobs/ingest/(\w+)/batches$', 'v2_upload'),
+        ('GET', r'/jobs/ingest/(\w+)/(successfulResults|failedResults|unprocessedrecords)/?$',
+         'v2_ingest_results'),
+        ('GET', r'/jobs/query/(\w+)/results$', 'v2_query_results'),
+    ]
+
+    routes = [
+        ('POST', r'/job$', 'create_job'),
+        ('POST', r'/job/(\w+)$', 'update_job'),
+        ('GET', r'/job/(\w+)$', 'get_job'),
+        ('POST', r'/job/(\w+)/batch$', 'create_batch'),
+        ('GET', r'/job/(\w+)/batch$', 'list_batches'),
+        ('GET', r'/job/(\w+)/batch/(\w+)$', 'get_batch'),
+        ('GET', r'/job/(\w+)/batch/(\w+)/result$', 'list_results'),
+        ('GET', r'/job/(\w+)/batch/(\w+)/result/(\w+)$', 'get_result'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def dispatch(self, method):
+        body = self.read_body()
+        with self.mock.lock:
+            self.mock.in_flight += 1
+            self.mock.max_in_flight = max(self.mock.max_in_flight, self.mock.in_flight)
+        try:
+            if self.mock.latency:
+                time.sleep(self.mock.latency)
+            self.route(method, body)
+        finally:
+            with self.mock.lock:
+                self.mock.in_flight -= 1
+
+    def route(self, method, body):
+        with self.mock.lock:
+            throttled = self.mock.throttled > 0
+            if throttled:
+                self.mock.throttled -= 1
+        if throttled:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        prefix = '/services/async/%s' % self.mock.api_version
+        path, _, query = self.path.partition('?')
+        self.query = dict((k, v[0]) for k, v in parse_qs(query).items())
+        v2 = re.match(r'/services/data/v[\d.]+(/jobs/.*)$', path)
+        rest = re.match(r'/services/data/v[\d.]+/query/?$', path)
+        limits = re.match(r'/services/data/v[\d.]+/limits/?$', path)
+        if rest or v2 or limits:
+            if self.headers.get('Authorization') != 'Bearer %s' % self.mock.session_id:
+                return self.send_json(401, [{'errorCode': 'INVALID_SESSION_ID',
+                                             'message': 'Session expired or invalid'}])
+        if rest:
+            with self.mock.lock:
+                self.mock.request_counts['rest_query'] += 1
+            return self.send_json(200, self.mock.rest_query(self.query['q']))
+        if limits:
+            with self.mock.lock:
+                self.mock.request_counts['limits'] += 1
+            return self.send_json(200, self.mock.limits)
+        if v2:
+            path = v2.group(1)
+            routes = self.v2_routes
+        elif path.startswith(prefix):
+            path = path[len(prefix):]
+            if self.headers.get('X-SFDC-Session') != self.mock.session_id:
+                return self.send_error_doc(400, 'InvalidSessionId', 'Invalid session id')
+            routes = self.routes
+        else:
+            return self.send_error_doc(404, 'NotFound', 'Unknown path %s' % path)
+
+        for route_method, pattern, name in routes:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                with self.mock.lock:
+                    self.mock.request_counts[name] += 1
+                return getattr(self, name)(body, *match.groups())
+        self.send_error_doc(404, 'NotFound', 'Unknown path %s' % path)
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def send_body(self, status, body, content_type='application/xml'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, value):
+        self.send_body(status, json.dumps(value).encode('utf-8'), 'application/json')
+
+    def send_error_doc(self, status, code, message):
+        root = '<?xml version="1.0" encoding="UTF-8"?><error xmlns="%s">' \
+               '<exceptionCode>%s</exceptionCode><exceptionMessage>%s</exceptionMessage></error>'
+        self.send_body(status, (root % (JOB_NS, code, message)).encode('utf-8'))
+
+    def find_job(self, job_id):
+        job = self.mock.jobs.get(job_id)
+        if job is None:
+            self.send_error_doc(400, 'InvalidJob', 'Unable to find job %s' % job_id)
+        return job
+
+    def find_batch(self, job_id, batch_id):
+        batch = self.mock.batches.get(batch_id)
+        if batch is None or batch['jobId'] != job_id:
+            self.send_error_doc(400, 'InvalidBatch', 'Unable to find batch %s' % batch_id)
+            return None
+        return batch
+
+    def create_job(self, body):
+        tree = ET.fromstring(body)
+        info = dict((re.sub('{.*?}', '', child.tag), child.text) for child in tree)
+        job = self.mock.create_job(info, self.headers.get('Sforce-Enable-PKChunking'))
+        self.send_body(201, _job_info(job))
+
+    def update_job(self, body, job_id):
+        job = self.find_job(job_id)
+        if job is None:
+            return
+        tree = ET.fromstring(body)
+        job['state'] = tree.findtext('{%s}state' % JOB_NS) or job['state']
+        self.send_body(200, _job_info(job))
+
+    def get_job(self, body, job_id):
+        job = self.find_job(job_id)
+        if job is not None:
+            self.send_body(200, _job_info(job))
+
+    def create_batch(self, body, job_id):
+        job = self.find_job(job_id)
+        if job is None:
+            return
+        if job['state'] != 'Open':
+            return self.send_error_doc(400, 'InvalidJobState', 'Job %s is not open' % job_id)
+        batch = self.mock.create_batch(job, body)
+        self.send_batch_info(201, job, batch)
+
+    def list_batches(self, body, job_id):
+        job = self.find_job(job_id)
+        if job is None:
+            return
+        if job['contentType'] == 'JSON':
+            return self.send_json(200, {'batchInfo': [dict(_batch_values(self.mock, self.mock.batches[b]))
+                                                      for b in job['batches']]})
+        parts = []
+        for batch_id in job['batches']:
+            values = _batch_values(self.mock, self.mock.batches[batch_id])
+            parts.append('<batchInfo>%s</batchInfo>' % ''.join(
+                '<%s>%s</%s>' % (k, '' if v is None else v, k) for k, v in values))
+        body = '<?xml version="1.0" encoding="UTF-8"?><batchInfoList xmlns="%s">%s</batchInfoList>' % (
+            JOB_NS, ''.join(parts))
+        self.send_body(200, body.encode('utf-8'))
+
+    def send_batch_info(self, status, job, batch):
+        values = _batch_values(self.mock, batch)
+        if job['contentType'] == 'JSON':
+            return self.send_json(status, dict(values))
+        self.send_body(status, _xml('batchInfo', values))
+
+    def get_batch(self, body, job_id, batch_id):
+        batch = self.find_batch(job_id, batch_id)
+        if batch is not None:
+            self.send_batch_info(200, self.mock.jobs[job_id], batch)
+
+    def list_results(self, body, job_id, batch_id):
+        batch = self.find_batch(job_id, batch_id)
+        if batch is None:
+            return
+        if self.mock.batch_state(batch) != 'Completed':
+            return self.send_error_doc(400, 'InvalidBatch', 'Batch not completed')
+        as_json = self.mock.jobs[job_id]['contentType'] == 'JSON'
+        if 'soql' not in batch:
+            return self.send_body(200, batch['results'][0], 'application/json' if as_json else 'text/csv')
+        result_ids = ['752%012dAAA' % i for i in range(len(batch['results']))]
+        if as_json:
+            return self.send_json(200, result_ids)
+        body = '<?xml version="1.0" encoding="UTF-8"?><result-list xmlns="%s">%s</result-list>' % (
+            JOB_NS, ''.join('<result>%s</result>' % r for r in result_ids))
+        self.send_body(200, body.encode('utf-8'))
+
+    def get_result(self, body, job_id, batch_id, result_id):
+        batch = self.find_batch(job_id, batch_id)
+        if batch is None:
+            return
+        index = int(result_id[3:15])
+        if 'soql' not in batch or index >= len(batch['results']):
+            return self.send_error_doc(404, 'InvalidResult', 'Unknown result %s' % result_id)
+        as_json = self.mock.jobs[job_id]['contentType'] == 'JSON'
+        self.send_body(200, batch['results'][index], 'application/json' if as_json else 'text/csv')
+
+    # Bulk API 2.0
+
+    def find_v2_job(self, job_id):
+        job = self.mock.v2_jobs.get(job_id)
+        if job is None:
+            self.send_json(404, [{'errorCode': 'NOT_FOUND', 'message': 'Unknown job %s' % job_id}])
+        return job
+
+    def v2_create_job(self, body, job_type):
+        job = self.mock.create_v2_job(job_type, json.loads(body.decode('utf-8')))
+        self.send_json(200, self.mock.v2_job_info(job))
+
+    def v2_get_job(self, body, job_id):
+        job = self.find_v2_job(job_id)
+        if job is not None:
+            self.send_json(200, self.mock.v2_job_info(job))
+
+    def v2_update_job(self, body, job_id):
+        job = self.find_v2_job(job_id)
+        if job is None:
+            return
+        state = json.loads(body.decode('utf-8'))['state']
+        if state == 'UploadComplete':
+            if job['state'] != 'Open':
+                return self.send_json(400, [{'errorCode': 'INVALIDJOBSTATE',
+                                             'message': 'Job is not open'}])
+            job['records'] = max(len(list(csv.reader(StringIO(job['data'].decode('utf-8'))))) - 1, 0)
+            job['created'] = time.time()
+            job['state'] = None
+        else:
+            job['state'] = state
+        self.send_json(200, self.mock.v2_job_info(job))
+
+    def v2_upload(self, body, job_id):
+        job = self.find_v2_job(job_id)
+        if job is None:
+            return
+        if job['state'] != 'Open' or job['data']:
+            return self.send_json(400, [{'errorCode': 'INVALIDJOBSTATE',
+                                         'message': 'Data was already uploaded for this job'}])
+        job['data'] = body
+        self.send_body(201, b'', 'text/plain')
+
+    def v2_ingest_results(self, body, job_id, result):
+        job = self.find_v2_job(job_id)
+        if job is None:
+            return
+        rows = list(csv.reader(StringIO(job['data'].decode('utf-8'))))
+        buf = StringIO()
+        writer = csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        if result == 'successfulResults':
+            writer.writerow(['sf__Id', 'sf__Created'] + rows[0])
+            for row in rows[1:]:
+                writer.writerow([self.mock.new_id('001'), 'true'] + row)
+        elif result == 'failedResults':
+            writer.writerow(['sf__Id', 'sf__Error'] + rows[0])
+        else:
+            writer.writerow(rows[0])
+        self.send_body(200, buf.getvalue().encode('utf-8'), 'text/csv')
+
+    def v2_query_results(self, body, job_id):
+        job = self.find_v2_job(job_id)
+        if job is None:
+            return
+        if self.mock.v2_state(job) != 'JobComplete':
+            return self.send_json(400, [{'errorCode': 'INVALIDJOBSTATE', 'message': 'Job not complete'}])
+        start = int(self.query.get('locator') or 0)
+        rows = job['rows']
+        max_records = int(self.query.get('maxRecords') or 0) or max(len(rows), 1)
+        stop = min(start + max_records, len(rows))
+        page = self.mock.query_csv(self.mock.query_fields(job['soql']), rows[start:stop])
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(page)))
+        self.send_header('Sforce-Locator', str(stop) if stop < len(rows) else 'null')
+        self.send_header('Sforce-NumberOfRecords', str(stop - start))
+        self.end_headers()
+        self.wfile.write(page)
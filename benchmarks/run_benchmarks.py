@@ -0,0 +1,345 @@
+"""Benchmarks for salesforce_bulkipy, run against the local mock Bulk API server.
+
+Usage::
+
+    python -m benchmarks.run_benchmarks [--rows N] [--output results.json] [--compare old.json]
+
+Every benchmark reports its own rates plus the wall time and the peak Python
+memory allocated while it ran. The results are written as JSON so runs of
+different versions can be compared with ``--compare``.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+import salesforce_bulkipy
+from salesforce_bulkipy import SalesforceBulkipy, SalesforceBulkipyV2
+
+from .mock_server import MockBulkServer
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def make_csv(rows, columns=5):
+    header = ','.join('Field%d' % c for c in range(columns))
+    lines = [header]
+    for n in range(rows):
+        lines.append(','.join('"value %d, %d"' % (n, c) for c in range(columns)))
+    return '\n'.join(lines)
+
+
+def measure(options, func):
+    """Times one run of func, then runs it again under tracemalloc for its peak memory
+
+    tracemalloc slows Python code down a lot, so the rates reported by func
+    come from the first run only.
+    """
+    start = time.time()
+    result = func()
+    result['seconds'] = time.time() - start
+    if tracemalloc and options.memory:
+        tracemalloc.start()
+        func()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def client(server):
+    return SalesforceBulkipy(session_id=server.session_id, host=server.host)
+
+
+@benchmark
+def split_csv(options):
+    data = make_csv(options.rows)
+    bulk = SalesforceBulkipy(session_id='unused', host='localhost')
+
+    def run():
+        start = time.time()
+        batches = bulk.split_csv(data, options.batch_size)
+        elapsed = time.time() - start
+        return {'rows': options.rows, 'batches': len(batches),
+                'rows_per_second': options.rows / elapsed}
+    return measure(options, run)
+
+
+@benchmark
+def upload_throughput(options):
+    data = make_csv(options.rows)
+    with MockBulkServer(latency=options.latency) as server:
+        bulk = client(server)
+
+        def run():
+            job_id = bulk.create_insert_job('Contact')
+            start = time.time()
+            batch_ids = bulk.bulk_csv_upload(job_id, data, batch_size=options.batch_size)
+            elapsed = time.time() - start
+            bulk.close_job(job_id)
+            return {'rows': options.rows, 'batches': len(batch_ids),
+                    'rows_per_second': options.rows / elapsed,
+                    'megabytes_per_second': len(data) / elapsed / 1e6}
+        return measure(options, run)
+
+
+@benchmark
+def file_upload_throughput(options):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'upload.csv')
+    with open(path, 'wb') as f:
+        f.write(make_csv(options.rows).encode('utf-8'))
+    try:
+        with MockBulkServer(latency=options.latency) as server:
+            bulk = client(server)
+
+            def run():
+                if os.path.exists(path + '.offsets.json'):
+                    os.remove(path + '.offsets.json')
+                job_id = bulk.create_insert_job('Contact')
+                start = time.time()
+                batch_ids = bulk.bulk_csv_file_upload(job_id, path, batch_size=options.batch_size)
+                elapsed = time.time() - start
+                bulk.close_job(job_id)
+                return {'rows': options.rows, 'batches': len(batch_ids),
+                        'rows_per_second': options.rows / elapsed,
+                        'megabytes_per_second': os.path.getsize(path) / elapsed / 1e6}
+            return measure(options, run)
+    finally:
+        shutil.rmtree(directory)
+
+
+@benchmark
+def upload_throughput_v2(options):
+    data = make_csv(options.rows)
+    with MockBulkServer(latency=options.latency) as server:
+        bulk = SalesforceBulkipyV2(session_id=server.session_id, host=server.host)
+
+        def run():
+            job_id = bulk.create_insert_job('Contact')
+            start = time.time()
+            bulk.bulk_csv_upload(job_id, data)
+            elapsed = time.time() - start
+            return {'rows': options.rows,
+                    'rows_per_second': options.rows / elapsed,
+                    'megabytes_per_second': len(data) / elapsed / 1e6}
+        return measure(options, run)
+
+
+@benchmark
+def polling_overhead(options):
+    processing_delay = 1.0
+    with MockBulkServer(latency=options.latency, queued_delay=0.2,
+                        processing_delay=processing_delay, query_rows=10) as server:
+        bulk = client(server)
+
+        def run():
+            job_id = bulk.create_query_job('Contact')
+            batch_id = bulk.query(job_id, 'Select Id, Name from Contact')
+            server.reset_counts()
+            start = time.time()
+            bulk.wait_for_batch(job_id, batch_id, sleep_interval=options.sleep_interval)
+            elapsed = time.time() - start
+            bulk.close_job(job_id)
+            server_time = server.queued_delay + processing_delay
+            return {'polls': server.request_counts['get_batch'],
+                    'server_seconds': server_time,
+                    'overhead_seconds': elapsed - server_time}
+        return measure(options, run)
+
+
+def _query_batch(bulk, server, content_type='CSV'):
+    job_id = bulk.create_query_job('Contact', contentType=content_type)
+    batch_id = bulk.query(job_id, 'Select Id, Name, Email, Description, Phone from Contact')
+    bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+    bulk.close_job(job_id)
+    return job_id, batch_id
+
+
+@benchmark
+def result_download(options):
+    with MockBulkServer(latency=options.latency, query_rows=options.rows,
+                        result_files=options.result_files) as server:
+        bulk = client(server)
+        job_id, batch_id = _query_batch(bulk, server)
+
+        def run():
+            start = time.time()
+            size = 0
+            for result in bulk.get_all_results_for_batch(batch_id, job_id):
+                for line in result:
+                    size += len(line)
+            elapsed = time.time() - start
+            return {'rows': options.rows, 'rows_per_second': options.rows / elapsed,
+                    'megabytes_per_second': size / elapsed / 1e6}
+        return measure(options, run)
+
+
+@benchmark
+def result_download_to(options):
+    with MockBulkServer(latency=options.latency, query_rows=options.rows,
+                        result_files=options.result_files) as server:
+        bulk = client(server)
+        job_id, batch_id = _query_batch(bulk, server)
+
+        def run():
+            out = BytesIO()
+            start = time.time()
+            bulk.download_results_to(batch_id, out, job_id=job_id)
+            elapsed = time.time() - start
+            return {'rows': options.rows, 'rows_per_second': options.rows / elapsed,
+                    'megabytes_per_second': len(out.getvalue()) / elapsed / 1e6}
+        return measure(options, run)
+
+
+@benchmark
+def result_csv_parse(options):
+    with MockBulkServer(latency=options.latency, query_rows=options.rows,
+                        result_files=options.result_files) as server:
+        bulk = client(server)
+        job_id, batch_id = _query_batch(bulk, server)
+
+        def run():
+            start = time.time()
+            rows = 0
+            for result in bulk.get_all_results_for_batch(batch_id, job_id, parse_csv=True):
+                for _ in result:
+                    rows += 1
+            elapsed = time.time() - start
+            return {'rows': rows, 'rows_per_second': rows / elapsed}
+        return measure(options, run)
+
+
+@benchmark
+def result_csv_parse_parallel(options):
+    with MockBulkServer(latency=options.latency, query_rows=options.rows,
+                        result_files=options.result_files) as server:
+        bulk = client(server)
+        job_id, batch_id = _query_batch(bulk, server)
+
+        def run():
+            start = time.time()
+            rows = 0
+            for _ in bulk.get_batch_results_parallel(batch_id, job_id, chunk_size=1024 * 1024):
+                rows += 1
+            elapsed = time.time() - start
+            return {'rows': rows, 'rows_per_second': rows / elapsed}
+        return measure(options, run)
+
+
+@benchmark
+def result_json_parse(options):
+    with MockBulkServer(latency=options.latency, query_rows=options.rows,
+                        result_files=options.result_files) as server:
+        bulk = client(server)
+        job_id, batch_id = _query_batch(bulk, server, 'JSON')
+
+        def run():
+            start = time.time()
+            rows = 0
+            for result in bulk.get_all_results_for_batch(batch_id, job_id):
+                for _ in result:
+                    rows += 1
+            elapsed = time.time() - start
+            return {'rows': rows, 'rows_per_second': rows / elapsed}
+        return measure(options, run)
+
+
+@benchmark
+def json_upload_throughput(options):
+    records = [dict(('Field%d' % c, 'value %d, %d' % (n, c)) for c in range(5))
+               for n in range(options.rows)]
+    with MockBulkServer(latency=options.latency) as server:
+        bulk = client(server)
+
+        def run():
+            job_id = bulk.create_insert_job('Contact', contentType='JSON')
+            start = time.time()
+            batch_ids = bulk.bulk_json_upload(job_id, iter(records), batch_size=options.batch_size)
+            elapsed = time.time() - start
+            bulk.close_job(job_id)
+            return {'rows': options.rows, 'batches': len(batch_ids),
+                    'rows_per_second': options.rows / elapsed}
+        return measure(options, run)
+
+
+def run_benchmarks(options):
+    results = {}
+    for func in BENCHMARKS:
+        if options.only and func.__name__ not in options.only:
+            continue
+        print('Running %s...' % func.__name__, file=sys.stderr)
+        results[func.__name__] = func(options)
+    return {
+        'version': salesforce_bulkipy.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'options': dict((k, v) for k, v in vars(options).items()
+                        if k not in ('output', 'compare')),
+        'results': results,
+    }
+
+
+def compare(old, new):
+    """Prints the ratio new/old of every numeric metric of both runs"""
+    for name, metrics in sorted(new['results'].items()):
+        previous = old['results'].get(name)
+        if not previous:
+            continue
+        print(name)
+        for key, value in sorted(metrics.items()):
+            before = previous.get(key)
+            if isinstance(value, (int, float)) and before:
+                print('  %-24s %14.2f -> %14.2f  (x%.2f)' % (key, before, value, float(value) / before))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--result-files', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the mock server adds to every request')
+    parser.add_argument('--sleep-interval', type=float, default=0.1,
+                        help='wait_for_batch sleep interval for the polling benchmark')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the peak memory measurements')
+    parser.add_argument('--only', action='append',
+                        help='only run the given benchmark, can be repeated')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    options = parser.parse_args(argv)
+
+    report = run_benchmarks(options)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
 from __future__ import absolute_import
 from .salesforce_bulkipy import SalesforceBulkipy
+from .bulk2 import SalesforceBulkipyV2
 from .csv_adapter import CsvDictsAdapter
+from .json_adapter import JsonDictsAdapter
+from .instrumentation import Instrumentation, MetricsCollector
+from .snapshot import SqliteSnapshot
 
 __version__ = '1.0'
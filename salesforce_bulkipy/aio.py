@@ -0,0 +1,504 @@
+"""
+An asyncio client for the Bulk API, built on aiohttp.
+
+Requests, uploads, polls and downloads are awaited instead of blocking a
+thread, so a single event loop can drive hundreds of jobs at once. Requires
+Python 3.7+ and aiohttp (``pip install salesforce-bulkipy[async]``).
+"""
+from __future__ import absolute_import
+
+import asyncio
+import json
+import time
+import urllib.parse as urlparse
+
+import aiohttp
+
+from . import bulk_states
+from . import soql as soql_utils
+from .csv_offsets import RecordBlocks
+from .governor import DEFAULT_CONCURRENCY, KIND_POOLS
+from .json_adapter import JsonArrayParser, dumps
+from .parallel_csv import parse_rows
+from .salesforce_bulkipy import SalesforceBulkipy, BulkBatchFailed
+
+
+class AsyncResponse(object):
+    """
+    An aiohttp response with the attributes of a requests.Response the client
+    reads. The body is read into content, except for streamed successful
+    responses, which hold their connection and slot until released.
+    """
+
+    def __init__(self, resp, slot=None):
+        self.raw = resp
+        self.status_code = resp.status
+        self.headers = resp.headers
+        self.url = str(resp.url)
+        self.content = None
+        self._slot = slot
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def release(self):
+        self.raw.release()
+        if self._slot is not None:
+            self._slot.release()
+            self._slot = None
+
+
+# methods of SalesforceBulkipy that block and have no awaitable counterpart here
+SYNC_ONLY_METHODS = (
+    'bulk_delete',
+    'bulk_csv_file_upload',
+    'shard_conditions',
+    'extract',
+    'sync',
+    'download_results_to',
+    'get_batch_results_parallel',
+    'get_batch_result_iter',
+)
+
+
+def _sync_only(name):
+    def method(self, *args, **kwargs):
+        raise TypeError('{0}.{1} blocks and is not available, use SalesforceBulkipy'.format(
+            type(self).__name__, name))
+    method.__name__ = name
+    return method
+
+
+async def _aiter(iterable):
+    """Generates the items of a sync or async iterable"""
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+class AsyncSalesforceBulkipy(SalesforceBulkipy):
+    """
+    A Bulk API client whose calls are coroutines. It takes the arguments of
+    SalesforceBulkipy, and:
+
+    - concurrency (dict): pool => most requests in flight at once, for the
+      'upload', 'poll' and 'download' pools of the BulkGovernor (defaults to
+      the governor's), None for no limit. A governor cannot be used, it blocks
+      threads.
+    - session (aiohttp.ClientSession): the session to send requests with,
+      by default one is opened on the first request and closed by close()
+
+    These methods are coroutines: create_job and the create_*_job methods,
+    close_job, abort_job, query, post_bulk_batch, bulk_csv_upload,
+    bulk_json_upload, job_status, job_state, batch_status, batch_state,
+    is_batch_done, wait_for_batch, get_job_batches, get_batch_result_ids,
+    get_upload_results, rest_query, limits and count.
+    iter_completed_batches, get_all_results_for_batch and get_batch_results
+    are async generators. The methods of SYNC_ONLY_METHODS raise TypeError.
+
+    Logging in with a username and password is blocking, pass a session_cache
+    to skip it, or a session_id and host.
+    """
+
+    def __init__(self, *args, concurrency=None, session=None, **kwargs):
+        super(AsyncSalesforceBulkipy, self).__init__(*args, **kwargs)
+        if self.governor is not None:
+            raise ValueError('A governor blocks threads, limit the requests with concurrency instead')
+        self.concurrency = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        self.session = session
+        self._own_session = session is None
+        self._semaphores = {}
+        self._login_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Closes the aiohttp session, unless it was given to the constructor"""
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _client_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    def _semaphore(self, kind):
+        """The semaphore limiting the requests of the kind's pool, None if they are not limited"""
+        pool = KIND_POOLS.get(kind, 'poll')
+        if self.concurrency.get(pool) is None:
+            return None
+        semaphore = self._semaphores.get(pool)
+        if semaphore is None:
+            semaphore = self._semaphores[pool] = asyncio.Semaphore(self.concurrency[pool])
+        return semaphore
+
+    async def _request(self, kind, method, url, job_id=None, data=None, headers=None, params=None,
+                       stream=False):
+        """ Sends an HTTP request to the Bulk API once a slot of its pool is free and reports
+        it to the instrumentation. Logs in again and resends it once if the session expired.
+
+        Args:
+            kind (str): the kind of call (job, upload, poll, result_list, download, rest)
+            method (str): the HTTP method
+            url (str): the url to call
+            job_id (str): the job the call belongs to, if any
+            data: the body, bytes, a string or a sync or async iterable of chunks
+            headers (dict): the request headers
+            params (dict): the query string parameters
+            stream (bool): leave the body of a successful response unread
+
+        Returns:
+            an AsyncResponse, to release once read when stream is set
+        """
+
+        resp = await self._send(kind, method, url, job_id, data, headers, params, stream)
+        if self._is_invalid_session(resp) and self.username and self._can_resend(data):
+            self.instrumentation.retry(kind, method, url, 1, 'invalid session', job_id=job_id)
+            old_session_id = self._session_in(headers)
+            if self._login_lock is None:
+                self._login_lock = asyncio.Lock()
+            async with self._login_lock:
+                # concurrent requests rejected with the same session log in once
+                if self.sessionId == old_session_id:
+                    if self.session_cache:
+                        self.session_cache.invalidate(self.username, self.sandbox)
+                    loop = asyncio.get_running_loop()
+                    self.sessionId = (await loop.run_in_executor(None, self._login))[0]
+            headers = self._renew_session_headers(headers, old_session_id)
+            resp = await self._send(kind, method, url, job_id, data, headers, params, stream)
+        return resp
+
+    async def _send(self, kind, method, url, job_id, data, headers, params, stream):
+        counter = None
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if data is not None and not isinstance(data, (bytes, bytearray)):
+            counter = [0]
+            data = self._counting_body(data, counter)
+
+        slot = self._semaphore(kind)
+        if slot is not None:
+            await slot.acquire()
+        start = time.time()
+        try:
+            raw = await self._client_session().request(method, url, data=data, headers=headers,
+                                                       params=params)
+        except BaseException:
+            if slot is not None:
+                slot.release()
+            raise
+        resp = AsyncResponse(raw, slot)
+        if not stream or resp.status_code >= 400:
+            try:
+                resp.content = await raw.read()
+            finally:
+                resp.release()
+
+        if self.instrumentation.enabled:
+            bytes_sent = counter[0] if counter is not None else len(data or b'')
+            bytes_received = len(resp.content) if resp.content is not None else 0
+            self.instrumentation.request(kind, method, url, resp.status_code, time.time() - start,
+                                         bytes_sent, bytes_received, job_id=job_id)
+        return resp
+
+    @staticmethod
+    async def _counting_body(data, counter):
+        """Generates the chunks of a request body as bytes, counting them"""
+        async for chunk in _aiter(data):
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            counter[0] += len(chunk)
+            yield chunk
+
+    async def _iter_content(self, kind, resp, job_id=None, chunk_size=64 * 1024):
+        """ Generates the chunks of a streamed response, reporting the body size
+        to the instrumentation once the stream is consumed
+        """
+        start = time.time()
+        size = 0
+        try:
+            async for chunk in resp.raw.content.iter_chunked(chunk_size):
+                size += len(chunk)
+                yield chunk
+        finally:
+            if self.instrumentation.enabled:
+                self.instrumentation.transfer(kind, resp.url, size, time.time() - start, job_id=job_id)
+
+    @staticmethod
+    async def _iter_records(chunks):
+        """Regroups the chunks of a CSV stream into blocks of complete records"""
+        blocks = RecordBlocks()
+        async for chunk in chunks:
+            block = blocks.feed(chunk)
+            if block:
+                yield block
+        rest = blocks.close()
+        if rest:
+            yield rest
+
+    async def create_job(self, object_name=None, operation=None, contentType='CSV',
+                         concurrency=None, external_id_name=None, pk_chunking=None):
+        """
+        Creates a job and returns its id. pk_chunking enables PK chunking for
+        query jobs: True for the default chunk size, or the chunk size.
+        """
+        assert (object_name is not None)
+        assert (operation is not None)
+
+        url, headers, doc = self._create_job_request(object_name, operation, contentType,
+                                                     concurrency, external_id_name, pk_chunking)
+        resp = await self._request('job', 'POST', url, headers=headers, data=doc)
+        return self._job_created(resp, contentType)
+
+    async def close_job(self, job_id):
+        await self._update_job(job_id, self.create_close_job_doc())
+
+    async def abort_job(self, job_id):
+        """Abort a given bulk job"""
+        await self._update_job(job_id, self.create_abort_job_doc())
+
+    async def _update_job(self, job_id, doc):
+        url = self.endpoint + "/job/%s" % job_id
+        resp = await self._request('job', 'POST', url, job_id=job_id, headers=self.headers(), data=doc)
+        self.check_status(resp, resp.content)
+        self.job_statuses[job_id] = self._parse_status(resp.content)
+
+    async def query(self, job_id, soql):
+        """Adds a query batch to the job, creating a query job if job_id is None, returns the batch id"""
+        if job_id is None:
+            job_id = await self.create_job(soql_utils.object_name(soql), "query")
+
+        uri = self.endpoint + "/job/%s/batch" % job_id
+        resp = await self._request('upload', 'POST', uri, job_id=job_id, headers=self.batch_headers(job_id),
+                                   data=soql)
+        self.check_status(resp, resp.content)
+        return self._batch_created(resp, job_id)
+
+    async def post_bulk_batch(self, job_id, data):
+        """
+        Uploads a batch to the job and returns the batch id. data is the whole
+        batch as bytes or a string, or a sync or async iterable of its chunks,
+        e.g. a CsvDictsAdapter or an async generator, streamed while it is read.
+        """
+        uri = self.endpoint + "/job/%s/batch" % job_id
+        resp = await self._request('upload', 'POST', uri, job_id=job_id, data=data,
+                                   headers=self.batch_headers(job_id))
+        return self._batch_created(resp, job_id)
+
+    async def bulk_csv_upload(self, job_id, csv, batch_size=2500):
+        """Splits a CSV string into batches of batch_size records, uploads them concurrently, returns their ids"""
+        batches = self.split_csv(csv, batch_size)
+        return list(await asyncio.gather(*[self.post_bulk_batch(job_id, batch) for batch in batches]))
+
+    async def bulk_json_upload(self, job_id, records, batch_size=2500):
+        """
+        Streams the dicts of a sync or async iterable to the job as JSON batches
+        of at most batch_size records each, returns the batch ids
+        """
+        records = _aiter(records)
+        batch_ids = []
+        while True:
+            try:
+                first = await records.__anext__()
+            except StopAsyncIteration:
+                break
+            batch_ids.append(await self.post_bulk_batch(job_id, self._json_batch(first, records, batch_size)))
+        return batch_ids
+
+    @staticmethod
+    async def _json_batch(first, records, batch_size):
+        """Generates the chunks of a JSON array of first and the next batch_size - 1 records"""
+        yield b'[' + dumps(first)
+        for _ in range(batch_size - 1):
+            try:
+                record = await records.__anext__()
+            except StopAsyncIteration:
+                break
+            yield b',' + dumps(record)
+        yield b']'
+
+    async def job_status(self, job_id=None, reload=True):
+        if not reload:
+            cached = self.job_statuses.get(job_id)
+            if cached is not None:
+                return cached
+
+        uri = urlparse.urljoin(self.endpoint + "/", 'job/{0}'.format(job_id))
+        resp = await self._request('job', 'GET', uri, job_id=job_id, headers=self.headers())
+        if resp.status_code != 200:
+            self.raise_error(resp.content, resp.status_code)
+        result = self._parse_status(resp.content)
+
+        self.instrumentation.job_status(job_id, result)
+        self.job_statuses[job_id] = result
+        return result
+
+    async def job_state(self, job_id):
+        status = await self.job_status(job_id)
+        return status.get('state')
+
+    async def batch_status(self, job_id=None, batch_id=None, reload=False):
+        if not reload:
+            cached = self.batch_statuses.get(batch_id)
+            if cached is not None:
+                return cached
+
+        job_id = job_id or self.lookup_job_id(batch_id)
+        uri = self.endpoint + "/job/%s/batch/%s" % (job_id, batch_id)
+        resp = await self._request('poll', 'GET', uri, job_id=job_id, headers=self.headers())
+        self.check_status(resp, resp.content)
+        result = self._parse_info(resp)
+
+        self.instrumentation.batch_status(job_id, batch_id, result)
+        self.batch_statuses[batch_id] = result
+        return result
+
+    async def batch_state(self, job_id, batch_id, reload=False):
+        status = await self.batch_status(job_id, batch_id, reload=reload)
+        return status.get('state')
+
+    async def is_batch_done(self, job_id, batch_id):
+        batch_state = await self.batch_state(job_id, batch_id, reload=True)
+        self.instrumentation.poll(job_id, batch_id, batch_state)
+        if batch_state in bulk_states.ERROR_STATES:
+            status = await self.batch_status(job_id, batch_id)
+            raise BulkBatchFailed(job_id, batch_id, status['stateMessage'])
+        return batch_state == bulk_states.COMPLETED
+
+    async def wait_for_batch(self, job_id, batch_id, timeout=60 * 10, sleep_interval=10):
+        """Waits for the batch to complete, at most timeout seconds, sleeping without blocking the loop"""
+        waited = 0
+        while not await self.is_batch_done(job_id, batch_id) and waited < timeout:
+            await asyncio.sleep(sleep_interval)
+            waited += sleep_interval
+
+    async def iter_completed_batches(self, job_id, batch_ids, timeout=60 * 10, sleep_interval=10):
+        """
+        Polls the given batches concurrently and yields their ids as they
+        complete, waiting at most timeout seconds in total. Raises
+        BulkBatchFailed if one fails.
+        """
+        pending = list(batch_ids)
+        waited = 0
+        while pending:
+            done = await asyncio.gather(*[self.is_batch_done(job_id, batch_id) for batch_id in pending])
+            for batch_id, batch_done in zip(list(pending), done):
+                if batch_done:
+                    pending.remove(batch_id)
+                    yield batch_id
+            if not pending:
+                break
+            if waited >= timeout:
+                raise RuntimeError('Batches {0} of job {1} are not complete after {2} seconds'.format(
+                    ', '.join(pending), job_id, timeout))
+            await asyncio.sleep(sleep_interval)
+            waited += sleep_interval
+
+    async def get_job_batches(self, job_id):
+        """Returns the status dicts of all batches of the job"""
+        uri = self.endpoint + "/job/%s/batch" % job_id
+        resp = await self._request('poll', 'GET', uri, job_id=job_id, headers=self.headers())
+        self.check_status(resp, resp.content)
+        return self._job_batches(resp, job_id)
+
+    async def rest_query(self, soql):
+        """Runs a query through the REST API and returns the decoded response, e.g. for aggregates"""
+        uri = self.instance_url + "/services/data/v%s/query" % self.API_version
+        headers = {"Authorization": "Bearer %s" % self.sessionId, "Accept": "application/json"}
+        resp = await self._request('rest', 'GET', uri, params={'q': soql}, headers=headers)
+        self.check_status(resp, resp.content)
+        return resp.json()
+
+    async def limits(self):
+        """Returns the org's limits, e.g. {'DailyApiRequests': {'Max': 15000, 'Remaining': 14998}, ...}"""
+        uri = self.instance_url + "/services/data/v%s/limits" % self.API_version
+        headers = {"Authorization": "Bearer %s" % self.sessionId, "Accept": "application/json"}
+        resp = await self._request('rest', 'GET', uri, headers=headers)
+        self.check_status(resp, resp.content)
+        return resp.json()
+
+    async def count(self, soql):
+        """Returns the number of records soql selects, using a COUNT() query"""
+        return (await self.rest_query(soql_utils.count_query(soql)))['totalSize']
+
+    async def get_upload_results(self, job_id, batch_id, callback=(lambda *args, **kwargs: None),
+                                 batch_size=0, logger=None):
+        """
+        Passes the results of an upload batch to callback, batch_size records at a
+        time, like SalesforceBulkipy.get_upload_results. Returns False if the batch
+        is not done.
+        """
+        job_id = job_id or self.lookup_job_id(batch_id)
+        if not await self.is_batch_done(job_id, batch_id):
+            return False
+
+        uri = self.endpoint + "/job/%s/batch/%s/result" % (job_id, batch_id)
+        resp = await self._request('download', 'GET', uri, job_id=job_id, headers=self.headers())
+        self.check_status(resp, resp.content)
+        return self._feed_upload_response(resp, callback, batch_size, logger)
+
+    async def get_batch_result_ids(self, batch_id, job_id=None):
+        job_id = job_id or self.lookup_job_id(batch_id)
+        if not await self.is_batch_done(job_id, batch_id):
+            return False
+
+        uri = urlparse.urljoin(self.endpoint + "/", "job/{0}/batch/{1}/result".format(job_id, batch_id))
+        resp = await self._request('result_list', 'GET', uri, job_id=job_id, headers=self.headers())
+        if resp.status_code != 200:
+            return False
+        return self._result_ids(resp)
+
+    async def get_all_results_for_batch(self, batch_id, job_id=None, parse_csv=False):
+        """
+        Generates an async generator of the rows of each result file of the
+        batch, see get_batch_results
+        """
+        result_ids = await self.get_batch_result_ids(batch_id, job_id=job_id)
+        if not result_ids:
+            raise RuntimeError('Batch is not complete')
+        for result_id in result_ids:
+            yield self.get_batch_results(batch_id, result_id, job_id=job_id, parse_csv=parse_csv)
+
+    async def get_batch_results(self, batch_id, result_id, job_id=None, parse_csv=False):
+        """
+        Streams a result file: generates its lines, or with parse_csv lists of
+        values (values may span lines), or the records of a JSON result file
+        """
+        job_id = job_id or self.lookup_job_id(batch_id)
+        uri = urlparse.urljoin(self.endpoint + "/",
+                               "job/{0}/batch/{1}/result/{2}".format(job_id, batch_id, result_id))
+        resp = await self._request('download', 'GET', uri, job_id=job_id, headers=self.headers(), stream=True)
+        try:
+            if resp.status_code >= 400:
+                self.raise_error(resp.content, resp.status_code)
+            chunks = self._iter_content('download', resp, job_id=job_id)
+            if self._is_json(resp):
+                parser = JsonArrayParser()
+                async for chunk in chunks:
+                    for record in parser.feed(chunk):
+                        yield record
+                for record in parser.feed(b'', final=True):
+                    yield record
+                return
+
+            async for block in self._iter_records(chunks):
+                if parse_csv:
+                    rows = parse_rows(block)
+                else:
+                    rows = [line.decode('utf-8') for line in block.splitlines()]
+                for row in rows:
+                    yield row
+        finally:
+            resp.release()
+
+
+for _name in SYNC_ONLY_METHODS:
+    setattr(AsyncSalesforceBulkipy, _name, _sync_only(_name))
@@ -0,0 +1,426 @@
+from __future__ import absolute_import
+from future.utils import iteritems, string_types
+
+import csv
+import itertools
+import json
+import mmap
+import os
+from collections import deque
+
+from . import bulk_states
+from . import soql as soql_utils
+from .csv_adapter import CsvSliceBody
+from .salesforce_bulkipy import SalesforceBulkipy, UploadResult
+
+# Bulk API 2.0 job states, mapped to the v1 batch state with the same meaning
+V2_BATCH_STATES = {
+    'Open': bulk_states.QUEUED,
+    'UploadComplete': bulk_states.QUEUED,
+    'InProgress': bulk_states.IN_PROGRESS,
+    'JobComplete': bulk_states.COMPLETED,
+    'Failed': bulk_states.FAILED,
+    'Aborted': bulk_states.ABORTED,
+}
+
+# Bulk API 2.0 job states, mapped to the v1 job state with the same meaning
+V2_JOB_STATES = {
+    'Open': bulk_states.OPEN,
+    'UploadComplete': bulk_states.CLOSED,
+    'InProgress': bulk_states.CLOSED,
+    'JobComplete': bulk_states.CLOSED,
+    'Failed': bulk_states.FAILED,
+    'Aborted': bulk_states.ABORTED,
+}
+
+INGEST_RESULTS = ('successfulResults', 'failedResults', 'unprocessedrecords')
+
+
+class _ResultPage(object):
+    """
+    A page of query results, requested when its rows are first read. The rest
+    of the page is read into memory by finish before the next page is
+    requested, so a governor download slot is never kept by a page that is
+    not being read.
+
+    Args:
+        fetch: callable returning the streamed response of the page and an
+            iterator over its rows
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.locator = None
+        self.rows = None
+        self.buffered = deque()
+
+    def _start(self):
+        if self.rows is None:
+            resp, self.rows = self.fetch()
+            self.locator = resp.headers.get('Sforce-Locator')
+
+    def iter_rows(self):
+        self._start()
+        while True:
+            if self.buffered:
+                yield self.buffered.popleft()
+                continue
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                return
+            yield row
+
+    def finish(self):
+        """Reads the rows not read yet into memory and returns the locator of the next page"""
+        self._start()
+        self.buffered.extend(self.rows)
+        return self.locator
+
+
+class SalesforceBulkipyV2(SalesforceBulkipy):
+    """
+    Client for Bulk API 2.0 (``/services/data/vXX.X/jobs``), with the same
+    create/upload/wait/results methods as SalesforceBulkipy.
+
+    Salesforce splits 2.0 ingest data into batches itself, so each ingest job
+    takes a single upload of up to 150 MB, and its id doubles as its only
+    batch id. Query jobs can only be created together with their SOQL, so
+    ``create_query_job`` returns a local handle and every ``query`` on that
+    handle creates a 2.0 query job whose id is returned as the batch id.
+    Query results are paged with ``maxRecords`` records per result set.
+    """
+
+    # Salesforce chunks 2.0 queries by itself, extract shards them by datetime only
+    supports_pk_chunking = False
+
+    def __init__(self, session_id=None, host=None, username=None, password=None, security_token=None,
+                 sandbox=False, API_version="47.0", max_records=None, **kwargs):
+        super(SalesforceBulkipyV2, self).__init__(session_id=session_id, host=host, username=username,
+                                                  password=password, security_token=security_token,
+                                                  sandbox=sandbox, API_version=API_version, **kwargs)
+        self.endpoint = self.instance_url + "/services/data/v%s/jobs" % API_version
+        self.max_records = max_records
+        self.job_types = {}  # dict of job_id => 'ingest' or 'query'
+        self.query_handles = {}  # dict of handle => {'object', 'operation', 'jobs'}
+        self.uploaded_jobs = set()  # ingest jobs already marked UploadComplete
+        self._handle_ids = itertools.count(1)
+
+    def headers(self, values={}):
+        default = {"Authorization": "Bearer %s" % self.sessionId,
+                   "Content-Type": "application/json; charset=UTF-8",
+                   "Accept": "application/json"}
+        for k, val in iteritems(values):
+            default[k] = val
+        return default
+
+    def _job_url(self, job_id, *parts):
+        return '/'.join((self.endpoint, self.job_types.get(job_id, 'ingest'), job_id) + parts)
+
+    def _json_request(self, kind, method, url, job_id=None, payload=None):
+        resp = self._request(kind, method, url, job_id=job_id, headers=self.headers(),
+                             data=json.dumps(payload) if payload is not None else None)
+        self.check_status(resp, resp.content)
+        return resp.json()
+
+    def create_job(self, object_name=None, operation=None, contentType='CSV',
+                   concurrency=None, external_id_name=None, line_ending='LF'):
+        assert (object_name is not None)
+        assert (operation is not None)
+
+        if operation in ('query', 'queryAll'):
+            handle = 'query-%d' % next(self._handle_ids)
+            self.query_handles[handle] = {'object': object_name, 'operation': operation, 'jobs': []}
+            self.jobs[handle] = handle
+            return handle
+
+        payload = {'object': object_name,
+                   'operation': operation,
+                   'contentType': contentType,
+                   'lineEnding': line_ending}
+        if external_id_name:
+            payload['externalIdFieldName'] = external_id_name
+
+        job_id = self._json_request('job', 'POST', self.endpoint + '/ingest', payload=payload)['id']
+        self.jobs[job_id] = job_id
+        self.job_types[job_id] = 'ingest'
+        return job_id
+
+    def _set_job_state(self, job_id, state):
+        result = self._json_request('job', 'PATCH', self._job_url(job_id), job_id=job_id,
+                                    payload={'state': state})
+        if self.job_types.get(job_id) == 'query':
+            # a 2.0 query job is a batch of its query handle
+            self.batch_statuses[job_id] = self._map_status(result, V2_BATCH_STATES)
+        else:
+            self.job_statuses[job_id] = self._map_status(result, V2_JOB_STATES)
+
+    def close_job(self, job_id):
+        """Marks the upload of an ingest job complete, a no-op for query jobs"""
+        if job_id in self.query_handles or self.job_types.get(job_id) == 'query':
+            return
+        if job_id not in self.uploaded_jobs:
+            self._set_job_state(job_id, 'UploadComplete')
+            self.uploaded_jobs.add(job_id)
+
+    def abort_job(self, job_id):
+        """Abort a given bulk job, or every query job created on a query handle"""
+        handle = self.query_handles.get(job_id)
+        for real_job_id in (handle['jobs'] if handle else [job_id]):
+            self._set_job_state(real_job_id, 'Aborted')
+
+    # Add a BulkQuery to the job - returns the batch id, the id of the 2.0 query job
+    def query(self, job_id, soql):
+        if job_id is None:
+            job_id = self.create_query_job(soql_utils.object_name(soql))
+        handle = self.query_handles[job_id]
+
+        payload = {'operation': handle['operation'], 'query': soql}
+        batch_id = self._json_request('upload', 'POST', self.endpoint + '/query', payload=payload)['id']
+
+        self.job_types[batch_id] = 'query'
+        self.batches[batch_id] = job_id
+        handle['jobs'].append(batch_id)
+        return batch_id
+
+    def post_bulk_batch(self, job_id, csv_generator):
+        """
+        Streams the data of an ingest job and marks its upload complete, returns
+        the job id as the batch id. A 2.0 job takes a single upload.
+        """
+        uri = self._job_url(job_id, 'batches')
+        headers = self.headers({"Content-Type": "text/csv"})
+        resp = self._request('upload', 'PUT', uri, job_id=job_id, data=csv_generator, headers=headers)
+        self.check_status(resp, resp.content)
+
+        self.close_job(job_id)
+        self.batches[job_id] = job_id
+        return job_id
+
+    def bulk_csv_upload(self, job_id, csv, batch_size=None):
+        """
+        Uploads the whole csv at once and marks the upload complete, the server
+        splits it into batches. batch_size is ignored. Returns [job_id].
+        """
+        if isinstance(csv, string_types):
+            csv = csv.encode('utf-8')
+        return [self.post_bulk_batch(job_id, csv)]
+
+    def bulk_csv_file_upload(self, job_id, path, batch_size=None, index_path=None, batch_numbers=None):
+        """
+        Uploads a whole CSV file at once from a memory mapping, without reading it
+        into memory, and marks the upload complete. A 2.0 job takes a single upload
+        (of at most 150 MB), so batch_size, index_path and batch_numbers are
+        ignored. Returns [job_id].
+        """
+        if not os.path.getsize(path):
+            return [self.post_bulk_batch(job_id, b'')]
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapping)
+            body = CsvSliceBody(view[:0], view[:])
+            try:
+                return [self.post_bulk_batch(job_id, body)]
+            finally:
+                body.close()
+                if hasattr(view, 'release'):
+                    view.release()
+                mapping.close()
+
+    def bulk_delete(self, job_id, object_type, where, batch_size=None):
+        query_job_id = self.create_query_job(object_type)
+        soql = "Select Id from %s where %s" % (object_type, where)
+        query_batch_id = self.query(query_job_id, soql)
+        self.wait_for_batch(query_job_id, query_batch_id, timeout=120)
+
+        lines = []
+        for i, page in enumerate(self.get_all_results_for_batch(batch_id=query_batch_id, job_id=query_job_id)):
+            page = list(page)
+            lines.extend(page if not i else page[1:])
+        if job_id is None:
+            job_id = self.create_delete_job(object_type)
+
+        return self.bulk_csv_upload(job_id, '\n'.join(lines))
+
+    def forget_job(self, job_id):
+        """Drops a job or a query handle with its query jobs, and their cached statuses"""
+        handle = self.query_handles.pop(job_id, None)
+        for real_job_id in (handle['jobs'] if handle else [job_id]):
+            self.job_types.pop(real_job_id, None)
+            self.job_statuses.pop(real_job_id)
+        self.uploaded_jobs.discard(job_id)
+        super(SalesforceBulkipyV2, self).forget_job(job_id)
+
+    def _last_job_state(self, job_id):
+        if job_id in self.query_handles:
+            return self._handle_state(self.query_handles[job_id])
+        return super(SalesforceBulkipyV2, self)._last_job_state(job_id)
+
+    def _handle_state(self, handle):
+        """A query handle is closed once all of its query jobs finished, going by their last known states"""
+        if handle['jobs'] and all(self.batch_statuses.last_state(real_job_id) in self.batch_statuses.terminal_states
+                                  for real_job_id in handle['jobs']):
+            return bulk_states.CLOSED
+        return bulk_states.OPEN
+
+    def lookup_job_id(self, batch_id):
+        # the id of a 2.0 job is also its batch id
+        if batch_id in self.job_types:
+            return self.batches.get(batch_id, batch_id)
+        return super(SalesforceBulkipyV2, self).lookup_job_id(batch_id)
+
+    @staticmethod
+    def _map_status(result, states):
+        status = dict((k, v) for k, v in iteritems(result))
+        status['jobState'] = result.get('state')
+        status['state'] = states.get(result.get('state'), result.get('state'))
+        if result.get('errorMessage'):
+            status['stateMessage'] = result['errorMessage']
+        return status
+
+    def _fetch_job_status(self, job_id):
+        handle = self.query_handles.get(job_id)
+        if handle is not None:
+            return {'id': job_id, 'object': handle['object'], 'operation': handle['operation'],
+                    'state': self._handle_state(handle), 'jobs': list(handle['jobs'])}
+        result = self._json_request('job', 'GET', self._job_url(job_id), job_id=job_id)
+        return self._map_status(result, V2_JOB_STATES)
+
+    def _fetch_batch_status(self, job_id, batch_id):
+        result = self._json_request('poll', 'GET', self._job_url(batch_id), job_id=job_id)
+        return self._map_status(result, V2_BATCH_STATES)
+
+    def get_batch_result_ids(self, batch_id, job_id=None):
+        """The result sets of an ingest job, query results are paged instead"""
+        job_id = job_id or self.lookup_job_id(batch_id)
+        if not self.is_batch_done(job_id, batch_id):
+            return False
+        if self.job_types.get(batch_id) == 'query':
+            return [None]
+        return list(INGEST_RESULTS)
+
+    def get_all_results_for_batch(self, batch_id, job_id=None, parse_csv=False, logger=None,
+                                  max_records=None):
+        """
+        Generates each result set of the batch, fetching the next one when needed.
+        For queries that is one page of at most max_records records per result set,
+        each starting with the csv header.
+        """
+        if self.job_types.get(batch_id) != 'query':
+            for page in super(SalesforceBulkipyV2, self).get_all_results_for_batch(
+                    batch_id, job_id=job_id, parse_csv=parse_csv, logger=logger):
+                yield page
+            return
+
+        job_id = job_id or self.lookup_job_id(batch_id)
+        if not self.is_batch_done(job_id, batch_id):
+            if logger:
+                logger.error('Batch is not complete, may have timed out. '
+                             'batch_id: %s, job_id: %s', batch_id, job_id)
+            raise RuntimeError('Batch is not complete')
+
+        locator = None
+        while True:
+            page = _ResultPage(lambda locator=locator: self._query_results_page_rows(
+                batch_id, locator, max_records, parse_csv))
+            yield page.iter_rows()
+            locator = page.finish()
+            if not locator or locator == 'null':
+                break
+
+    def _query_results_page_rows(self, batch_id, locator, max_records, parse_csv):
+        resp = self._query_results_page(batch_id, locator, max_records)
+        return resp, self._result_rows(resp, batch_id, parse_csv, lambda message: None)
+
+    def _query_results_page(self, batch_id, locator=None, max_records=None):
+        params = {}
+        if locator:
+            params['locator'] = locator
+        max_records = max_records or self.max_records
+        if max_records:
+            params['maxRecords'] = max_records
+        uri = self._job_url(batch_id, 'results')
+        resp = self._request('download', 'GET', uri, job_id=batch_id, params=params,
+                             headers=self.headers({"Accept": "text/csv"}), stream=True)
+        if resp.status_code >= 400:
+            self.raise_error(resp.content, resp.status_code)
+        return resp
+
+    def get_batch_results(self, batch_id, result_id, job_id=None,
+                          parse_csv=False, logger=None):
+        """
+        Generates the lines of one result set. result_id is one of INGEST_RESULTS
+        for ingest jobs and the page locator (None for the first page) for queries.
+        """
+        logger = logger or (lambda message: None)
+        logger('Downloading bulk result file id=#{0}'.format(result_id))
+        resp = self._result_response(batch_id, result_id, job_id)
+        for row in self._result_rows(resp, batch_id, parse_csv, logger):
+            yield row
+
+    def _result_response(self, batch_id, result_id, job_id):
+        if self.job_types.get(batch_id) == 'query':
+            return self._query_results_page(batch_id, result_id)
+        uri = self._job_url(batch_id, result_id) + '/'
+        resp = self._request('download', 'GET', uri, job_id=batch_id,
+                             headers=self.headers({"Accept": "text/csv"}), stream=True)
+        if resp.status_code >= 400:
+            self.raise_error(resp.content, resp.status_code)
+        return resp
+
+    def _result_responses(self, batch_id, job_id):
+        """Generates the streamed responses of all result pages of a query"""
+        if self.job_types.get(batch_id) != 'query':
+            raise ValueError('Only the results of a query can be downloaded to a single file')
+        if not self.is_batch_done(job_id, batch_id):
+            raise RuntimeError('Batch is not complete')
+        locator = None
+        while True:
+            resp = self._query_results_page(batch_id, locator)
+            locator = resp.headers.get('Sforce-Locator')
+            yield resp
+            if not locator or locator == 'null':
+                break
+
+    def get_batch_result_iter(self, job_id, batch_id, parse_csv=False,
+                              logger=None):
+        """
+        Return a line iterator over all result pages of a batch. If parse_csv=True
+        the iterator returns dicts.
+        """
+        status = self.batch_status(job_id, batch_id)
+        if status['state'] != bulk_states.COMPLETED:
+            return None
+        pages = self.get_all_results_for_batch(batch_id, job_id=job_id)
+        if parse_csv:
+            return itertools.chain.from_iterable(
+                self._unicode_list_dicts_gen(csv.DictReader(page, delimiter=',', quotechar='"'))
+                for page in pages)
+        return itertools.chain.from_iterable(
+            page if not i else itertools.islice(page, 1, None) for i, page in enumerate(pages))
+
+    def get_upload_results(self, job_id, batch_id,
+                           callback=(lambda *args, **kwargs: None),
+                           batch_size=0, logger=None):
+        """
+        Passes the successful and failed records of an ingest job to callback as
+        UploadResults, in the same way as SalesforceBulkipy.get_upload_results.
+        """
+        job_id = job_id or self.lookup_job_id(batch_id)
+
+        if not self.is_batch_done(job_id, batch_id):
+            return False
+
+        results = [UploadResult('Id', 'Success', 'Created', 'Error')]
+        for result_id in INGEST_RESULTS[:2]:
+            rows = csv.DictReader(self.get_batch_results(batch_id, result_id, job_id=job_id))
+            for row in rows:
+                results.append(UploadResult(row.get('sf__Id', ''),
+                                            'true' if result_id == 'successfulResults' else 'false',
+                                            row.get('sf__Created', 'false'),
+                                            row.get('sf__Error', '')))
+        if logger:
+            logger("Total records: %d" % len(results))
+
+        self._feed_upload_results(results, callback, batch_size, len(results))
+        return True
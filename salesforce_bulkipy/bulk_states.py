@@ -1,3 +1,5 @@
+QUEUED = 'Queued'
+IN_PROGRESS = 'InProgress'
 ABORTED = 'Aborted'
 FAILED = 'Failed'
 NOT_PROCESSED = 'Not Processed'
@@ -8,3 +10,14 @@ ERROR_STATES = (
     FAILED,
     NOT_PROCESSED,
 )
+
+TERMINAL_STATES = (COMPLETED,) + ERROR_STATES
+
+# Job states
+OPEN = 'Open'
+CLOSED = 'Closed'
+
+JOB_TERMINAL_STATES = (
+    ABORTED,
+    FAILED,
+)
@@ -40,3 +40,58 @@ class CsvDictsAdapter(object):
         self.csv.writerow(row)
         self.buffer.seek(0)
         return self.buffer.read()
+
+
+class CsvSliceBody(object):
+    """
+    A file-like request body made of a CSV header and a slice of records, both
+    memoryviews (e.g. of a memory-mapped file) that are sent without being
+    copied into Python strings. Has a length, so it is sent with a Content-Length.
+    """
+    def __init__(self, header, records, chunk_size=1024 * 1024):
+        self.parts = [header, records]
+        self.chunk_size = chunk_size
+        self.position = 0
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence != 0:
+            raise ValueError('Only absolute seeks are supported')
+        self.position = offset
+
+    def read(self, size=-1):
+        """Returns up to size bytes from a single part, as a memoryview; without size, the rest as bytes"""
+        if size is None or size < 0:
+            return b''.join(bytes(chunk) for chunk in self._rest())
+        offset = self.position
+        for part in self.parts:
+            if offset < len(part):
+                stop = min(len(part), offset + size)
+                self.position += stop - offset
+                return part[offset:stop]
+            offset -= len(part)
+        return b''
+
+    def _rest(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not len(chunk):
+                break
+            yield chunk
+
+    def __iter__(self):
+        self.seek(0)
+        return self._rest()
+
+    def close(self):
+        """Releases the memoryviews, so the mapping they point into can be closed"""
+        for part in self.parts:
+            release = getattr(part, 'release', None)
+            if release:
+                release()
+        self.parts = []
@@ -0,0 +1,125 @@
+"""
+Quote-aware scanning of CSV bytes for record boundaries.
+
+A line end only ends a record when it is outside of a quoted value, i.e. when
+an even number of quotes precede it in the record. Quotes are counted with
+bytes.count, so no Python code runs per byte or per field. The functions work
+on bytes as well as on memory-mapped files.
+"""
+from __future__ import absolute_import
+
+
+def last_record_end(data, start=0, end=None):
+    """
+    Returns the offset just past the last line end in data[start:end] that ends
+    a record, or -1 if there is none. start must be at the start of a record.
+    """
+    end = len(data) if end is None else end
+    newline = data.rfind(b'\n', start, end)
+    if newline < 0:
+        return -1
+    quotes = data.count(b'"', start, newline)
+    while quotes % 2:
+        # the line end is inside a quoted value, try the previous one
+        previous = data.rfind(b'\n', start, newline)
+        if previous < 0:
+            return -1
+        quotes -= data.count(b'"', previous, newline)
+        newline = previous
+    return newline + 1
+
+
+class RecordBlocks(object):
+    """Cuts CSV bytes fed chunk by chunk into blocks of complete records"""
+
+    def __init__(self):
+        self.carry = b''
+
+    def feed(self, chunk):
+        """Returns the records completed by chunk, b'' if there are none yet"""
+        data = self.carry + chunk if self.carry else chunk
+        end = last_record_end(data)
+        if end < 0:
+            # a single record longer than the chunks fed since the last block
+            self.carry = data
+            return b''
+        self.carry = data[end:]
+        return data[:end]
+
+    def close(self):
+        """Returns the data left, the last record if it has no line end"""
+        rest, self.carry = self.carry, b''
+        return rest
+
+
+def iter_record_chunks(fileobj, chunk_size=4 * 1024 * 1024):
+    """
+    Reads a file of CSV records in blocks of about chunk_size bytes, each cut
+    after the last complete record it holds, and generates them
+    """
+    blocks = RecordBlocks()
+    while True:
+        data = fileobj.read(chunk_size)
+        if not data:
+            break
+        block = blocks.feed(data)
+        if block:
+            yield block
+    rest = blocks.close()
+    if rest:
+        yield rest
+
+
+def next_record_end(data, start=0):
+    """Returns the offset just past the record starting at start, its line end included"""
+    quotes = 0
+    pos = start
+    while True:
+        newline = data.find(b'\n', pos)
+        if newline < 0:
+            return len(data)
+        quotes += data[pos:newline].count(b'"')
+        if quotes % 2 == 0:
+            return newline + 1
+        pos = newline + 1
+
+
+def record_offsets(data, every, start=0, window_size=8 * 1024 * 1024):
+    """
+    Returns the offsets of the start of every every-th record of data, from the
+    record at start (included) to the end of data (included), so consecutive
+    offsets delimit groups of every records. data is scanned window by window.
+    """
+    offsets = [start]
+    count = 0
+    end = len(data)
+    pos = start
+    while pos < end:
+        window = data[pos:pos + window_size]
+        if pos + len(window) < end:
+            cut = last_record_end(window)
+            if cut < 0:
+                # a single record longer than the window
+                window_size *= 2
+                continue
+            window = window[:cut]
+
+        lines = window.split(b'\n')
+        if not lines[-1]:
+            lines.pop()
+        offset = pos
+        quotes = 0
+        for line in lines:
+            offset += len(line) + 1
+            quotes += line.count(b'"')
+            if quotes % 2:
+                continue
+            quotes = 0
+            count += 1
+            if count % every == 0:
+                offsets.append(min(offset, end))
+        pos += len(window)
+
+    if offsets[-1] != end:
+        offsets.append(end)
+    return offsets
@@ -0,0 +1,225 @@
+"""A limiter shared by clients, keeping the Bulk API traffic of a process within the limits of each org"""
+from __future__ import absolute_import
+
+import threading
+import time
+from collections import defaultdict, deque
+
+from .salesforce_bulkipy import BulkBudgetExhausted
+
+# request kind => the pool of concurrent requests it counts against
+KIND_POOLS = {
+    'upload': 'upload',
+    'download': 'download',
+    'job': 'poll',
+    'poll': 'poll',
+    'result_list': 'poll',
+    'rest': 'poll',
+}
+
+DEFAULT_CONCURRENCY = {'upload': 4, 'poll': 8, 'download': 4}
+
+# daily allowances of the REST limits resource spent by the requests of the clients
+API_REQUESTS = 'DailyApiRequests'
+BULK_BATCHES = 'DailyBulkApiBatches'
+
+
+class _Org(object):
+    """The limiter state of one org"""
+
+    def __init__(self, tokens, now):
+        self.in_flight = defaultdict(int)  # pool => granted requests
+        self.waiting = defaultdict(dict)  # pool => {job_id: deque of tickets}
+        self.rotation = defaultdict(deque)  # pool => job ids with waiting requests, next one first
+        self.tokens = tokens
+        self.refilled = now
+        self.limits = {}  # name => {'Max': ..., 'Remaining': ...} as of the last refresh
+        self.spent = defaultdict(int)  # name => spent since the last refresh
+
+
+class _Slot(object):
+    """A granted request, its slot is given back by release, once"""
+
+    def __init__(self, governor, org, pool):
+        self.governor = governor
+        self.org = org
+        self.pool = pool
+        self.released = False
+        self.finalizer = None
+
+    def release(self):
+        self.governor._release(self)
+
+
+class BulkGovernor(object):
+    """
+    Limits the requests of all clients created with ``governor=`` it, per org
+    (instance url), so many jobs can run from one process at full speed without
+    being rate limited:
+
+    - at most ``concurrency[pool]`` requests are in flight at once in each pool:
+      'upload', 'poll' (job, batch status and result list calls) and 'download'.
+      Downloads keep their slot until their stream is consumed or closed. Waiting
+      requests are served round-robin between jobs, so a job with many batches
+      does not starve the others.
+    - at most ``requests_per_second`` requests start per second, in bursts of at
+      most ``burst``
+    - requests answered with 429 Too Many Requests are sent again, up to
+      ``max_retries`` times, after their Retry-After delay or an exponential backoff
+    - once the org's limits are loaded with refresh_limits, the daily API requests
+      and batches left are tracked, and uploads raise BulkBudgetExhausted when
+      ``reserve[limit]`` or fewer are left
+
+    Args:
+        concurrency (dict): pool => most requests in flight, None for no limit
+        requests_per_second (float): the rate of requests per org, None for no limit
+        burst (int): the number of requests that can start at once, defaults to
+            requests_per_second
+        max_retries (int): attempts to resend a request answered with 429
+        backoff (float): seconds before the first retry without Retry-After, doubled
+            on every attempt
+        max_backoff (float): the longest wait between retries
+        reserve (dict): limit name => allowance kept for other applications, e.g.
+            {'DailyApiRequests': 1000}
+    """
+
+    def __init__(self, concurrency=None, requests_per_second=None, burst=None, max_retries=5,
+                 backoff=1.0, max_backoff=60.0, reserve=None, clock=time.time, sleep=time.sleep):
+        self.concurrency = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        self.requests_per_second = requests_per_second
+        self.burst = burst or max(1, int(requests_per_second or 1))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reserve = reserve or {}
+        self.clock = clock
+        self.sleep = sleep
+        self._orgs = {}
+        self._cond = threading.Condition()
+
+    def _org(self, org):
+        state = self._orgs.get(org)
+        if state is None:
+            state = self._orgs[org] = _Org(self.burst, self.clock())
+        return state
+
+    def acquire(self, org, kind, job_id=None, method=None, url=None):
+        """
+        Waits until a request of the given kind may be sent to org and returns
+        its slot, to release once the response has been read
+        """
+        pool = KIND_POOLS.get(kind, 'poll')
+        with self._cond:
+            state = self._org(org)
+            if kind == 'upload':
+                self._check_budget(state)
+            ticket = [False]
+            queue = state.waiting[pool].get(job_id)
+            if queue is None:
+                queue = state.waiting[pool][job_id] = deque()
+                state.rotation[pool].append(job_id)
+            queue.append(ticket)
+            self._grant(state, pool)
+            while not ticket[0]:
+                self._cond.wait()
+
+            state.spent[API_REQUESTS] += 1
+            if kind == 'upload' and method == 'POST' and url and url.endswith('/batch'):
+                state.spent[BULK_BATCHES] += 1
+            delay = self._take_token(state)
+        if delay > 0:
+            self.sleep(delay)
+        return _Slot(self, state, pool)
+
+    def _grant(self, state, pool):
+        """Hands free slots of the pool to the waiting jobs in turn"""
+        limit = self.concurrency.get(pool)
+        rotation = state.rotation[pool]
+        granted = False
+        while rotation and (limit is None or state.in_flight[pool] < limit):
+            job_id = rotation.popleft()
+            queue = state.waiting[pool][job_id]
+            queue.popleft()[0] = True
+            state.in_flight[pool] += 1
+            granted = True
+            if queue:
+                rotation.append(job_id)
+            else:
+                del state.waiting[pool][job_id]
+        if granted:
+            self._cond.notify_all()
+
+    def _release(self, slot):
+        with self._cond:
+            if slot.released:
+                return
+            slot.released = True
+            slot.org.in_flight[slot.pool] -= 1
+            self._grant(slot.org, slot.pool)
+
+    def _take_token(self, state):
+        """Takes a token from the org's bucket, returns the seconds to wait for it"""
+        if not self.requests_per_second:
+            return 0
+        now = self.clock()
+        state.tokens = min(self.burst, state.tokens + (now - state.refilled) * self.requests_per_second)
+        state.refilled = now
+        state.tokens -= 1
+        return -state.tokens / self.requests_per_second if state.tokens < 0 else 0
+
+    def retry_delay(self, attempt, resp):
+        """Seconds to wait before sending a request again, or None if it should not be"""
+        if resp.status_code != 429 or attempt > self.max_retries:
+            return None
+        try:
+            return float(resp.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+
+    def _check_budget(self, state):
+        for name, keep in self.reserve.items():
+            remaining = self._remaining(state, name)
+            if remaining is not None and remaining <= keep:
+                raise BulkBudgetExhausted(name, remaining)
+
+    @staticmethod
+    def _remaining(state, name):
+        limit = state.limits.get(name)
+        if limit is None:
+            return None
+        return limit['Remaining'] - state.spent[name]
+
+    def refresh_limits(self, client):
+        """Loads the daily limits of the client's org, returns its budget"""
+        limits = client.limits()
+        with self._cond:
+            state = self._org(client.instance_url)
+            state.limits = dict((name, limit) for name, limit in limits.items()
+                                if isinstance(limit, dict) and 'Remaining' in limit)
+            state.spent.clear()
+        return self.budget(client.instance_url)
+
+    def budget(self, org):
+        """
+        Returns {limit name: {'Max': ..., 'Remaining': ...}} of the org, the
+        remaining allowances lowered by the requests sent since refresh_limits
+        """
+        with self._cond:
+            state = self._org(org)
+            return dict((name, {'Max': limit.get('Max'), 'Remaining': self._remaining(state, name)})
+                        for name, limit in state.limits.items())
+
+    def report(self):
+        """Returns the requests in flight and waiting per pool and the budget of every org"""
+        with self._cond:
+            orgs = list(self._orgs.items())
+            report = {}
+            for org, state in orgs:
+                report[org] = {
+                    'in_flight': dict((pool, n) for pool, n in state.in_flight.items() if n),
+                    'waiting': dict((pool, sum(len(q) for q in queues.values()))
+                                    for pool, queues in state.waiting.items() if queues),
+                }
+        for org in report:
+            report[org]['budget'] = self.budget(org)
+        return report
@@ -0,0 +1,173 @@
+from __future__ import absolute_import
+
+import threading
+import time
+from collections import defaultdict
+
+from . import bulk_states
+
+
+class Instrumentation(object):
+    """Receives events for every Bulk API call made by a client.
+
+    This base class ignores everything, so subclasses only need to override
+    the events they care about. ``enabled`` tells the client whether it is
+    worth doing extra bookkeeping (e.g. counting streamed bytes); leave it
+    False for a sink that drops events.
+    """
+    enabled = False
+
+    def request(self, kind, method, url, status_code, elapsed, bytes_sent,
+                bytes_received, job_id=None):
+        """Called once the response headers of an HTTP request are in.
+
+        ``bytes_received`` is 0 for streamed responses; their body size is
+        reported afterwards through ``transfer``.
+        """
+
+    def transfer(self, kind, url, bytes_received, elapsed, job_id=None):
+        """Called when a streamed response body has been fully consumed"""
+
+    def retry(self, kind, method, url, attempt, reason, job_id=None):
+        """Called before a request is sent again"""
+
+    def poll(self, job_id, batch_id, state):
+        """Called for every status check made while waiting on a batch"""
+
+    def batch_status(self, job_id, batch_id, status):
+        """Called with every batch status document fetched from the server"""
+
+    def job_status(self, job_id, status):
+        """Called with every job status document fetched from the server"""
+
+
+class MetricsCollector(Instrumentation):
+    """In-memory aggregator of client events.
+
+    Call ``report()`` to get a plain dict with per request kind latency and
+    byte totals, retry and poll counts, and per job / per batch timings::
+
+        metrics = MetricsCollector()
+        bulk = SalesforceBulkipy(session_id, host, instrumentation=metrics)
+        ...
+        print(metrics.report())
+    """
+    enabled = True
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(lambda: {
+                'count': 0, 'errors': 0, 'total_time': 0.0,
+                'max_time': 0.0, 'bytes_sent': 0, 'bytes_received': 0})
+            self.retries = defaultdict(int)
+            self.polls = defaultdict(int)
+            # batch_id => timing info, see _track_batch
+            self.batches = {}
+
+    def request(self, kind, method, url, status_code, elapsed, bytes_sent,
+                bytes_received, job_id=None):
+        with self._lock:
+            stats = self.requests[kind]
+            stats['count'] += 1
+            if status_code >= 400:
+                stats['errors'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+
+    def transfer(self, kind, url, bytes_received, elapsed, job_id=None):
+        with self._lock:
+            stats = self.requests[kind]
+            stats['total_time'] += elapsed
+            stats['bytes_received'] += bytes_received
+
+    def retry(self, kind, method, url, attempt, reason, job_id=None):
+        with self._lock:
+            self.retries[kind] += 1
+
+    def poll(self, job_id, batch_id, state):
+        with self._lock:
+            self.polls[job_id] += 1
+
+    def batch_status(self, job_id, batch_id, status):
+        with self._lock:
+            self._track_batch(job_id, batch_id, status)
+
+    def _track_batch(self, job_id, batch_id, status):
+        now = self.clock()
+        info = self.batches.get(batch_id)
+        if info is None:
+            info = self.batches[batch_id] = {
+                'job_id': job_id, 'first_seen': now, 'started': None,
+                'finished': None, 'state': None, 'records': 0,
+                'server_processing_ms': 0}
+        state = status.get('state')
+        info['state'] = state
+        if state == bulk_states.IN_PROGRESS and info['started'] is None:
+            info['started'] = now
+        if state in bulk_states.TERMINAL_STATES and info['finished'] is None:
+            info['finished'] = now
+            if info['started'] is None:
+                # the batch went from queued to done between two polls
+                info['started'] = now
+        info['records'] = int(status.get('numberRecordsProcessed') or 0)
+        info['server_processing_ms'] = int(status.get('totalProcessingTime') or 0)
+
+    def report(self):
+        """Returns a snapshot of the collected metrics as a dict"""
+        with self._lock:
+            requests = {}
+            for kind, stats in self.requests.items():
+                stats = dict(stats)
+                stats['avg_time'] = (stats['total_time'] / stats['count']
+                                     if stats['count'] else 0.0)
+                requests[kind] = stats
+
+            batches = {}
+            jobs = defaultdict(lambda: {
+                'batches': 0, 'records': 0, 'polls': 0, 'queued_time': 0.0,
+                'processing_time': 0.0, 'server_processing_ms': 0,
+                'started': None, 'finished': None})
+            for batch_id, info in self.batches.items():
+                queued = ((info['started'] or self.clock()) - info['first_seen'])
+                processing = (((info['finished'] or self.clock()) - info['started'])
+                              if info['started'] is not None else 0.0)
+                batches[batch_id] = {
+                    'job_id': info['job_id'],
+                    'state': info['state'],
+                    'records': info['records'],
+                    'queued_time': queued,
+                    'processing_time': processing,
+                    'server_processing_ms': info['server_processing_ms'],
+                }
+
+                job = jobs[info['job_id']]
+                job['batches'] += 1
+                job['records'] += info['records']
+                job['queued_time'] += queued
+                job['processing_time'] += processing
+                job['server_processing_ms'] += info['server_processing_ms']
+                if job['started'] is None or info['first_seen'] < job['started']:
+                    job['started'] = info['first_seen']
+                if info['finished'] is not None and (
+                        job['finished'] is None or info['finished'] > job['finished']):
+                    job['finished'] = info['finished']
+
+            for job_id, job in jobs.items():
+                job['polls'] = self.polls.get(job_id, 0)
+                elapsed = (job['finished'] or self.clock()) - job['started']
+                job['records_per_second'] = job['records'] / elapsed if elapsed > 0 else 0.0
+
+            return {
+                'requests': requests,
+                'retries': dict(self.retries),
+                'polls': dict(self.polls),
+                'batches': batches,
+                'jobs': dict(jobs),
+            }
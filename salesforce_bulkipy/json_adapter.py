@@ -0,0 +1,129 @@
+from __future__ import absolute_import
+
+import codecs
+import json
+
+from future.utils import implements_iterator
+
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    try:
+        import ujson as _json
+    except ImportError:
+        _json = json
+
+    def dumps(obj):
+        return _json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+dumps.__doc__ = """Serializes obj to UTF-8 JSON bytes, using orjson or ujson when installed"""
+
+
+@implements_iterator
+class JsonDictsAdapter(object):
+    """
+    Provide a dict generator and it provides an iterator over the chunks of a
+    JSON array of those dicts, one record per chunk, for streaming JSON batches.
+    """
+
+    def __init__(self, source_generator):
+        self.source = source_generator
+        self.started = False
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        try:
+            row = next(self.source)
+        except StopIteration:
+            self.finished = True
+            return b']' if self.started else b'[]'
+
+        if self.started:
+            return b',' + dumps(row)
+        self.started = True
+        return b'[' + dumps(row)
+
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]'
+
+
+class JsonArrayParser(object):
+    """
+    Incrementally parses a top-level JSON array fed as byte chunks: feed returns
+    the items each chunk completes, and done is set once the array is closed.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.started = False
+        self.done = False
+
+    def feed(self, chunk, final=False):
+        """Parses the next chunk, final=True once there are no more, and returns the completed items"""
+        if self.done:
+            return []
+        buf = self.buf + self.utf8.decode(chunk, final=final)
+        pos = 0
+        items = []
+
+        while True:
+            while pos < len(buf) and (buf[pos] in _WHITESPACE or (self.started and buf[pos] == ',')):
+                pos += 1
+
+            if pos < len(buf):
+                if not self.started:
+                    if buf[pos] != '[':
+                        raise ValueError('Expected a JSON array, got %r' % buf[pos:pos + 20])
+                    self.started = True
+                    pos += 1
+                    continue
+                if buf[pos] == ']':
+                    self.done = True
+                    break
+                try:
+                    item, end = self.decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # the item may continue in the next chunk
+                    if final:
+                        raise
+                else:
+                    # a number is only complete once the next delimiter has been read
+                    if (final or not isinstance(item, (int, float)) or isinstance(item, bool)
+                            or (end < len(buf) and buf[end] in _DELIMITERS)):
+                        pos = end
+                        items.append(item)
+                        continue
+
+            if final:
+                raise ValueError('Unexpected end of JSON array')
+            break
+
+        self.buf = buf[pos:]
+        return items
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parses a top-level JSON array from an iterable of byte chunks,
+    yielding its items as they are completed, without holding the whole
+    document in memory.
+    """
+    parser = JsonArrayParser()
+    for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+        if parser.done:
+            return
+    for item in parser.feed(b'', final=True):
+        yield item
@@ -0,0 +1,75 @@
+"""Parses chunks of CSV records in a multiprocessing pool, keeping their order"""
+from __future__ import absolute_import
+
+import csv
+import io
+import multiprocessing
+from collections import deque
+
+from future.utils import PY2
+
+import unicodecsv
+
+from .csv_offsets import iter_record_chunks
+
+
+def parse_rows(data):
+    """Parses a chunk of complete CSV records into lists of strings"""
+    if PY2:
+        return list(unicodecsv.reader(io.BytesIO(data), encoding='utf-8'))
+    return list(csv.reader(io.StringIO(data.decode('utf-8'), newline='')))
+
+
+def parse_chunk(task):
+    """
+    Pool worker: parses a chunk of records and applies the converters, given as
+    (data, header, converters, columnar). Converters are not applied to empty
+    values, which become None. Returns the rows, or with columnar a dict of
+    field => list of values.
+    """
+    data, header, converters, columnar = task
+    rows = parse_rows(data)
+    if converters:
+        conversions = [(i, converters[field]) for i, field in enumerate(header) if field in converters]
+        for row in rows:
+            for i, convert in conversions:
+                row[i] = convert(row[i]) if row[i] != '' else None
+    if columnar:
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in header]
+        return dict(zip(header, columns))
+    return rows
+
+
+def parse_file(fileobj, header, processes=None, chunk_size=4 * 1024 * 1024, converters=None,
+               columnar=False, pool=None):
+    """
+    Cuts a file of CSV records (without its header) into chunks at record
+    boundaries and parses them in a process pool. Generates the parsed chunks
+    in file order; at most two chunks per process are in flight, so memory
+    stays bounded whatever the file size.
+
+    Args:
+        fileobj: the binary file, positioned after the header
+        header: the field names
+        processes: size of the pool, defaults to the number of cores
+        chunk_size: bytes per chunk
+        converters: dict of field => callable applied to its values, must be picklable
+        columnar: generate dicts of field => list of values instead of lists of rows
+        pool: a multiprocessing pool to use instead of starting one
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(processes)
+    window = 2 * (processes or getattr(pool, '_processes', None) or multiprocessing.cpu_count())
+    pending = deque()
+    try:
+        for data in iter_record_chunks(fileobj, chunk_size):
+            pending.append(pool.apply_async(parse_chunk, ((data, header, converters, columnar),)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        if own_pool:
+            pool.terminate()
+            pool.join()
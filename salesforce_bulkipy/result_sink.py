@@ -0,0 +1,178 @@
+"""Writers that land the raw result files of a batch in a single file"""
+from __future__ import absolute_import
+
+import csv
+import io
+
+try:
+    import pyarrow
+    import pyarrow.csv as pyarrow_csv
+    import pyarrow.parquet as pyarrow_parquet
+except ImportError:
+    pyarrow = None
+
+# the CSV result of a query batch that selected no records
+NO_RESULTS = 'Records not found for this query'
+_NO_RESULTS = NO_RESULTS.encode('ascii')
+
+
+def split_first_line(chunks):
+    """
+    Reads chunks until the end of the first line and returns that line (with its
+    line ending) and an iterator over the rest of the bytes
+    """
+    chunks = iter(chunks)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        end = head.find(b'\n')
+        if end >= 0:
+            rest = head[end + 1:]
+            return head[:end + 1], _prepend(rest, chunks)
+    return head, iter(())
+
+
+def _prepend(first, chunks):
+    if first:
+        yield first
+    for chunk in chunks:
+        yield chunk
+
+
+def write_csv(result_files, out):
+    """
+    Copies CSV result files to out block by block, writing the header line of
+    the first one only and skipping files without records. A line end is added
+    after a file whose last record has none.
+    """
+    header_written = False
+    last = b''
+    for chunks in result_files:
+        header, rest = split_first_line(chunks)
+        if not header or header.strip() == _NO_RESULTS:
+            continue
+        if not header_written:
+            if not header.endswith(b'\n'):
+                header += b'\n'
+            out.write(header)
+            header_written = True
+            last = b'\n'
+        first = True
+        for chunk in rest:
+            if not chunk:
+                continue
+            if first and last != b'\n':
+                # the previous file ended without a line end
+                out.write(b'\n')
+            first = False
+            out.write(chunk)
+            last = chunk[-1:]
+
+
+def write_json(result_files, out):
+    """
+    Copies JSON result files, each holding an array of records, to out as a
+    single array. Only the brackets at the ends of every file are looked at, the
+    records are copied block by block.
+    """
+    out.write(b'[')
+    records_written = False
+    for chunks in result_files:
+        chunks = iter(chunks)
+        body = b''
+        opened = False
+        # skip the opening bracket, and the file if the array is empty
+        for chunk in chunks:
+            body = (body + chunk).lstrip()
+            if body and not opened:
+                if not body.startswith(b'['):
+                    raise ValueError('Expected a JSON array, got %r' % body[:20])
+                opened = True
+                body = body[1:].lstrip()
+            if body:
+                break
+        if not body or body.startswith(b']'):
+            continue
+
+        if records_written:
+            out.write(b',')
+        records_written = True
+        # hold back everything from the last closing bracket, it may end the array
+        held = b''
+        for chunk in _prepend(body, chunks):
+            end = chunk.rfind(b']')
+            if end >= 0:
+                out.write(held + chunk[:end])
+                held = chunk[end:]
+            elif chunk.strip():
+                out.write(held + chunk)
+                held = b''
+            else:
+                held += chunk
+        out.write(held.rstrip()[:-1])
+    out.write(b']')
+
+
+class ChunksReader(io.RawIOBase):
+    """A read-only binary file object over an iterable of byte chunks"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self.pending:
+            try:
+                self.pending = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buf), len(self.pending))
+        buf[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def write_parquet(result_files, out, compression=None, block_size=1 << 20):
+    """
+    Converts CSV result files to a single Parquet file with pyarrow, a record
+    batch at a time. Every column is stored as a string, as the Bulk API
+    returns them; empty values become nulls. Values may span lines. When no
+    file has records, an empty table is written, with the columns of the
+    header if there was one.
+    """
+    if pyarrow is None:
+        raise RuntimeError('Writing Parquet files requires pyarrow')
+
+    writer = None
+    names = []
+    try:
+        for chunks in result_files:
+            header, rest = split_first_line(chunks)
+            if not header or header.strip() == _NO_RESULTS:
+                continue
+            names = next(csv.reader([header.decode('utf-8')]))
+            first = next((chunk for chunk in rest if chunk.strip()), None)
+            if first is None:
+                # a header without records, pyarrow rejects empty input
+                continue
+            reader = pyarrow_csv.open_csv(
+                ChunksReader(_prepend(first, rest)),
+                read_options=pyarrow_csv.ReadOptions(column_names=names, block_size=block_size),
+                parse_options=pyarrow_csv.ParseOptions(newlines_in_values=True),
+                convert_options=pyarrow_csv.ConvertOptions(
+                    column_types=dict((name, pyarrow.string()) for name in names),
+                    strings_can_be_null=True))
+            for batch in reader:
+                if writer is None:
+                    writer = pyarrow_parquet.ParquetWriter(out, batch.schema, compression=compression or 'snappy')
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+        if writer is None:
+            schema = pyarrow.schema([(name, pyarrow.string()) for name in names])
+            pyarrow_parquet.write_table(pyarrow.Table.from_batches([], schema), out,
+                                        compression=compression or 'snappy')
+    finally:
+        if writer is not None:
+            writer.close()
@@ -1,15 +1,23 @@
 from __future__ import absolute_import
 from future.standard_library import install_aliases
-from future.utils import iteritems
+from future.utils import iteritems, string_types
 install_aliases()
 
 import sys
 import re
 import time
 import csv
+import itertools
+import gzip
+import json
+import mmap
+import os
+import threading
+import weakref
 from io import BytesIO
 from tempfile import TemporaryFile
 from collections import namedtuple
+from datetime import timedelta
 import xml.etree.ElementTree as ET
 
 try:
@@ -23,6 +31,15 @@ try:
 except ImportError:
     import urllib.parse as urlparse
 from . import bulk_states
+from .instrumentation import Instrumentation
+from .status_cache import StatusCache
+from .json_adapter import JsonDictsAdapter, iter_json_array
+from .result_sink import NO_RESULTS
+from . import result_sink
+from . import parallel_csv
+from . import csv_offsets
+from .csv_adapter import CsvSliceBody
+from . import soql as soql_utils
 
 import simple_salesforce
 import requests
@@ -30,6 +47,13 @@ import requests
 
 UploadResult = namedtuple('UploadResult', 'id success created error')
 
+# job contentType => Content-Type of its batches
+BATCH_CONTENT_TYPES = {
+    'CSV': 'text/csv',
+    'JSON': 'application/json',
+    'XML': 'application/xml',
+}
+
 
 class BulkApiError(Exception):
     def __init__(self, message, status_code=None):
@@ -56,27 +80,58 @@ class BulkBatchFailed(BulkApiError):
         super(BulkBatchFailed, self).__init__(message)
 
 
+class BulkBudgetExhausted(BulkApiError):
+    def __init__(self, limit, remaining):
+        self.limit = limit
+        self.remaining = remaining
+
+        message = 'Only {0} {1} left today'.format(remaining, limit)
+        super(BulkBudgetExhausted, self).__init__(message)
+
+
 class SalesforceBulkipy(object):
+    # whether extract can shard queries by Id with PK chunking
+    supports_pk_chunking = True
+
     def __init__(self, session_id=None, host=None, username=None, password=None, security_token=None, sandbox=False,
-                 exception_class=BulkApiError, API_version="29.0"):
+                 exception_class=BulkApiError, API_version="29.0", instrumentation=None,
+                 status_cache_size=1000, status_cache_ttl=10, session_cache=None, governor=None):
         if (not session_id or not host) and (not username or not password or not security_token):
             raise RuntimeError(
                 "Must supply either sessionId,host or username,password,security_token")
+        # kept to log in again when the session expires
+        self.username = username
+        self.password = password
+        self.security_token = security_token
+        self.sandbox = sandbox
+        self.session_cache = session_cache
         if username and password and security_token:
-            session_id, host = SalesforceBulkipy.login_to_salesforce_using_username_password(username, password,
-                                                                                             security_token, sandbox)
+            cached = session_cache.get(username, sandbox) if session_cache else None
+            if cached:
+                session_id, host = cached
+            else:
+                session_id, host = self._login()
 
         if host[0:4] == 'http':
-            self.endpoint = host
+            self.instance_url = host
         else:
-            self.endpoint = "https://" + host
-        self.endpoint += "/services/async/%s" % API_version
+            self.instance_url = "https://" + host
+        self.API_version = API_version
+        self.endpoint = self.instance_url + "/services/async/%s" % API_version
         self.sessionId = session_id
         self.jobNS = 'http://www.force.com/2009/06/asyncapi/dataload'
         self.jobs = {}  # dict of job_id => job_id
         self.batches = {}  # dict of batch_id => job_id
-        self.batch_statuses = {}
+        self.job_content_types = {}  # dict of job_id => contentType
+        # statuses of finished jobs/batches are kept until evicted, others for status_cache_ttl seconds,
+        # the states of evicted ones are kept until their jobs are forgotten
+        self.batch_statuses = StatusCache(status_cache_size, status_cache_ttl, tracked=self.batches)
+        self.job_statuses = StatusCache(status_cache_size, status_cache_ttl,
+                                        terminal_states=bulk_states.JOB_TERMINAL_STATES, tracked=self.jobs)
         self.exception_class = exception_class
+        self.instrumentation = instrumentation or Instrumentation()
+        self.governor = governor
+        self._login_lock = threading.Lock()
 
     @staticmethod
     def login_to_salesforce_using_username_password(username, password, security_token, sandbox):
@@ -84,6 +139,14 @@ class SalesforceBulkipy(object):
                                           sandbox=sandbox)
         return sf.session_id, sf.sf_instance
 
+    def _login(self):
+        """Logs in with the client's credentials, caches the session and returns (session_id, host)"""
+        session_id, host = self.login_to_salesforce_using_username_password(
+            self.username, self.password, self.security_token, self.sandbox)
+        if self.session_cache:
+            self.session_cache.set(self.username, self.sandbox, session_id, host)
+        return session_id, host
+
     def headers(self, values={}):
         default = {"X-SFDC-Session": self.sessionId,
                    "Content-Type": "application/xml; charset=UTF-8"}
@@ -91,6 +154,197 @@ class SalesforceBulkipy(object):
             default[k] = val
         return default
 
+    def _request(self, kind, method, url, job_id=None, **kwargs):
+        """ Sends an HTTP request to the Bulk API and reports it to the instrumentation.
+        With a governor, waits for its turn first and resends requests answered with 429.
+
+        Args:
+            kind (str): the kind of call, used to group metrics and governor pools (job,
+                upload, poll, result_list, download, rest)
+            method (str): the HTTP method
+            url (str): the url to call
+            job_id (str): the job the call belongs to, if any
+            **kwargs: passed through to requests
+
+        Returns:
+            the requests.Response
+        """
+
+        governor = self.governor
+        if governor is None:
+            return self._send_with_login(kind, method, url, job_id, kwargs)
+
+        attempt = 0
+        while True:
+            slot = governor.acquire(self.instance_url, kind, job_id, method, url)
+            try:
+                resp = self._send_with_login(kind, method, url, job_id, kwargs)
+            except Exception:
+                slot.release()
+                raise
+            attempt += 1
+            delay = governor.retry_delay(attempt, resp) if self._can_resend(kwargs.get('data')) else None
+            if delay is None:
+                if kwargs.get('stream') and resp.status_code < 400:
+                    self._release_after_stream(resp, slot)
+                else:
+                    slot.release()
+                return resp
+            slot.release()
+            self.instrumentation.retry(kind, method, url, attempt, 'rate limited', job_id=job_id)
+            governor.sleep(delay)
+            if hasattr(kwargs.get('data'), 'seek'):
+                kwargs['data'].seek(0)
+
+    @staticmethod
+    def _release_after_stream(resp, slot):
+        """Keeps the governor slot of a streamed response until it is consumed, closed or collected"""
+        iter_content = resp.iter_content
+        close = resp.close
+
+        def releasing_iter_content(*args, **kwargs):
+            try:
+                for chunk in iter_content(*args, **kwargs):
+                    yield chunk
+            finally:
+                slot.release()
+
+        def releasing_close():
+            try:
+                close()
+            finally:
+                slot.release()
+
+        # requests reads content and lines through iter_content
+        resp.iter_content = releasing_iter_content
+        resp.close = releasing_close
+        slot.finalizer = weakref.ref(resp, lambda ref: slot.release())
+
+    def _send_with_login(self, kind, method, url, job_id, kwargs):
+        resp = self._send(kind, method, url, job_id, kwargs)
+        if self._is_invalid_session(resp) and self.username and self._can_resend(kwargs.get('data')):
+            # the (possibly cached) session expired, log in again and retry once
+            self.instrumentation.retry(kind, method, url, 1, 'invalid session', job_id=job_id)
+            old_session_id = self._session_in(kwargs.get('headers'))
+            with self._login_lock:
+                # concurrent requests rejected with the same session log in once
+                if self.sessionId == old_session_id:
+                    if self.session_cache:
+                        self.session_cache.invalidate(self.username, self.sandbox)
+                    self.sessionId = self._login()[0]
+            kwargs['headers'] = self._renew_session_headers(kwargs.get('headers'), old_session_id)
+            if hasattr(kwargs.get('data'), 'seek'):
+                kwargs['data'].seek(0)
+            resp = self._send(kind, method, url, job_id, kwargs)
+        return resp
+
+    def _renew_session_headers(self, headers, old_session_id):
+        """Returns a copy of the request headers with the old session replaced by the current one"""
+        headers = dict(headers or {})
+        if headers.get('X-SFDC-Session') == old_session_id:
+            headers['X-SFDC-Session'] = self.sessionId
+        if headers.get('Authorization') == 'Bearer %s' % old_session_id:
+            headers['Authorization'] = 'Bearer %s' % self.sessionId
+        return headers
+
+    @staticmethod
+    def _session_in(headers):
+        """The session id a request was sent with"""
+        headers = headers or {}
+        authorization = headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            return authorization[len('Bearer '):]
+        return headers.get('X-SFDC-Session')
+
+    @staticmethod
+    def _is_invalid_session(resp):
+        """Whether the API rejected the session: 400 InvalidSessionId for v1, 401 for REST and 2.0"""
+        if resp.status_code == 401:
+            return True
+        return resp.status_code == 400 and b'InvalidSessionId' in resp.content
+
+    @staticmethod
+    def _can_resend(data):
+        """Whether a request body can be sent a second time, generators cannot"""
+        return data is None or isinstance(data, (bytes, bytearray) + string_types) or hasattr(data, 'seek')
+
+    def _send(self, kind, method, url, job_id, kwargs):
+        instrumentation = self.instrumentation
+        if not instrumentation.enabled:
+            return requests.request(method, url, **kwargs)
+        kwargs = dict(kwargs)
+
+        counter = None
+        data = kwargs.get('data')
+        if data is None:
+            bytes_sent = 0
+        elif isinstance(data, (bytes, bytearray)):
+            bytes_sent = len(data)
+        elif isinstance(data, string_types):
+            bytes_sent = len(data.encode('utf-8'))
+        elif hasattr(data, '__len__'):
+            bytes_sent = len(data)
+        else:
+            # a generator body, count the chunks while requests consumes them
+            counter = [0]
+            kwargs['data'] = self._counting_gen(data, counter)
+            bytes_sent = 0
+
+        start = time.time()
+        resp = requests.request(method, url, **kwargs)
+        elapsed = time.time() - start
+
+        if counter is not None:
+            bytes_sent = counter[0]
+        bytes_received = 0 if kwargs.get('stream') else len(resp.content)
+        instrumentation.request(kind, method, url, resp.status_code, elapsed,
+                                bytes_sent, bytes_received, job_id=job_id)
+        return resp
+
+    def _iter_lines(self, kind, resp, job_id=None, **kwargs):
+        """ Iterates over the lines of a streamed response, reporting the body size
+        to the instrumentation once the stream is consumed
+        """
+
+        if not self.instrumentation.enabled:
+            return resp.iter_lines(**kwargs)
+        return self._counting_lines_gen(kind, resp, job_id, **kwargs)
+
+    def _counting_lines_gen(self, kind, resp, job_id, **kwargs):
+        start = time.time()
+        try:
+            for line in resp.iter_lines(**kwargs):
+                yield line
+        finally:
+            tell = getattr(resp.raw, 'tell', None)
+            self.instrumentation.transfer(kind, resp.url, tell() if tell else 0,
+                                          time.time() - start, job_id=job_id)
+
+    def _iter_content(self, kind, resp, job_id=None, chunk_size=64 * 1024):
+        """ Iterates over the raw chunks of a streamed response, reporting the body size
+        to the instrumentation once the stream is consumed
+        """
+
+        if not self.instrumentation.enabled:
+            return resp.iter_content(chunk_size)
+        return self._counting_content_gen(kind, resp, job_id, chunk_size)
+
+    def _counting_content_gen(self, kind, resp, job_id, chunk_size):
+        start = time.time()
+        size = 0
+        try:
+            for chunk in resp.iter_content(chunk_size):
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.instrumentation.transfer(kind, resp.url, size, time.time() - start, job_id=job_id)
+
+    @staticmethod
+    def _counting_gen(chunks, counter):
+        for chunk in chunks:
+            counter[0] += len(chunk)
+            yield chunk
+
     # Register a new Bulk API job - returns the job id
     def create_query_job(self, object_name, **kwargs):
         return self.create_job(object_name, "query", **kwargs)
@@ -108,26 +362,50 @@ class SalesforceBulkipy(object):
         return self.create_job(object_name, "delete", **kwargs)
 
     def create_job(self, object_name=None, operation=None, contentType='CSV',
-                   concurrency=None, external_id_name=None):
+                   concurrency=None, external_id_name=None, pk_chunking=None):
+        """
+        Creates a job and returns its id. pk_chunking enables PK chunking for
+        query jobs: True for the default chunk size, or the chunk size.
+        """
         assert (object_name is not None)
         assert (operation is not None)
 
+        url, headers, doc = self._create_job_request(object_name, operation, contentType,
+                                                     concurrency, external_id_name, pk_chunking)
+        resp = self._request('job', 'POST', url, headers=headers, data=doc)
+        return self._job_created(resp, contentType)
+
+    def _create_job_request(self, object_name, operation, contentType, concurrency, external_id_name,
+                            pk_chunking):
+        """Returns the url, headers and document of the request creating a job"""
         doc = self.create_job_doc(object_name=object_name,
                                   operation=operation,
                                   contentType=contentType,
                                   concurrency=concurrency,
                                   external_id_name=external_id_name)
         url = self.endpoint + '/job'
-
-        resp = requests.post(url, headers=self.headers(), data=doc)
+        headers = self.headers()
+        if pk_chunking:
+            headers['Sforce-Enable-PKChunking'] = (
+                'true' if pk_chunking is True else 'chunkSize=%d' % pk_chunking)
+        return url, headers, doc
+
+    def _job_created(self, resp, contentType):
+        """Checks the response of a job creation, registers the job and returns its id"""
         self.check_status(resp, resp.content)
 
         tree = ET.fromstring(resp.content)
         job_id = tree.findtext("{%s}id" % self.jobNS)
         self.jobs[job_id] = job_id
+        self.job_content_types[job_id] = contentType
 
         return job_id
 
+    def batch_headers(self, job_id):
+        """Headers for posting a batch to the job, with the Content-Type matching the job's contentType"""
+        content_type = BATCH_CONTENT_TYPES.get(self.job_content_types.get(job_id), 'text/csv')
+        return self.headers({"Content-Type": content_type})
+
     def check_status(self, resp, content):
         if resp.status_code >= 400:
             msg = "Bulk API HTTP Error result: {0}".format(content)
@@ -137,16 +415,18 @@ class SalesforceBulkipy(object):
         doc = self.create_close_job_doc()
         url = self.endpoint + "/job/%s" % job_id
 
-        resp = requests.post(url, headers=self.headers(), data=doc)
+        resp = self._request('job', 'POST', url, job_id=job_id, headers=self.headers(), data=doc)
         self.check_status(resp, resp.content)
+        self.job_statuses[job_id] = self._parse_status(resp.content)
 
     def abort_job(self, job_id):
         """Abort a given bulk job"""
         doc = self.create_abort_job_doc()
         url = self.endpoint + "/job/%s" % job_id
 
-        resp = requests.post(url, headers=self.headers(), data=doc)
+        resp = self._request('job', 'POST', url, job_id=job_id, headers=self.headers(), data=doc)
         self.check_status(resp, resp.content)
+        self.job_statuses[job_id] = self._parse_status(resp.content)
 
     def create_job_doc(self, object_name=None, operation=None,
                        contentType='CSV', concurrency=None, external_id_name=None):
@@ -188,21 +468,23 @@ class SalesforceBulkipy(object):
     # Add a BulkQuery to the job - returns the batch id
     def query(self, job_id, soql):
         if job_id is None:
-            job_id = self.create_job(
-                re.search(re.compile("from (\w+)", re.I), soql).group(1),
-                "query")
+            job_id = self.create_job(soql_utils.object_name(soql), "query")
 
         uri = self.endpoint + "/job/%s/batch" % job_id
-        headers = self.headers({"Content-Type": "text/csv"})
+        headers = self.batch_headers(job_id)
 
-        resp = requests.post(uri, headers=headers, data=soql)
+        resp = self._request('upload', 'POST', uri, job_id=job_id, headers=headers, data=soql)
         self.check_status(resp, resp.content)
 
-        tree = ET.fromstring(resp.content)
-        batch_id = tree.findtext("{%s}id" % self.jobNS)
+        return self._batch_created(resp, job_id)
 
-        self.batches[batch_id] = job_id
+    def _batch_created(self, resp, job_id):
+        """Checks the response of a batch upload, registers the batch and returns its id"""
+        if resp.status_code >= 400:
+            self.raise_error(resp.content, resp.status_code)
 
+        batch_id = self._parse_info(resp)['id']
+        self.batches[batch_id] = job_id
         return batch_id
 
     def split_csv(self, csv, batch_size):
@@ -233,20 +515,102 @@ class SalesforceBulkipy(object):
         batch_ids = []
 
         uri = self.endpoint + "/job/%s/batch" % job_id
-        headers = self.headers({"Content-Type": "text/csv"})
+        headers = self.batch_headers(job_id)
         for batch in batches:
-            resp = requests.post(uri, data=batch, headers=headers)
-            content = resp.content
+            resp = self._request('upload', 'POST', uri, job_id=job_id, data=batch, headers=headers)
+            batch_ids.append(self._batch_created(resp, job_id))
 
-            if resp.status_code >= 400:
-                self.raise_error(content, resp.status)
+        return batch_ids
 
-            tree = ET.fromstring(content)
-            batch_id = tree.findtext("{%s}id" % self.jobNS)
+    def bulk_csv_file_upload(self, job_id, path, batch_size=2500, index_path=None, batch_numbers=None):
+        """
+        Uploads a CSV file in batches of batch_size records without reading it into
+        memory: the file is memory-mapped and every batch is sent as the header and a
+        slice of the mapping. The record boundaries are found with a quote-aware scan
+        and saved to an offset index, which later calls reuse while the file and
+        batch_size are unchanged, e.g. to re-send the batches that failed.
 
-            self.batches[batch_id] = job_id
-            batch_ids.append(batch_id)
+        Args:
+            job_id: the job
+            path: the CSV file, starting with its header
+            batch_size: records per batch
+            index_path: the offset index file, defaults to path + '.offsets.json'
+            batch_numbers: the (0-based) numbers of the batches to send, e.g.
+                range(10, 20), all batches by default
 
+        Returns:
+            the batch ids, in the order of batch_numbers
+        """
+        index = self.csv_file_index(path, batch_size, index_path)
+        offsets = index['offsets']
+        numbers = range(len(offsets) - 1) if batch_numbers is None else batch_numbers
+        batch_ids = []
+        if not index['size']:
+            return batch_ids
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapping)
+            try:
+                for n in numbers:
+                    body = CsvSliceBody(view[:index['header_end']], view[offsets[n]:offsets[n + 1]])
+                    try:
+                        batch_ids.append(self.post_bulk_batch(job_id, body))
+                    finally:
+                        body.close()
+            finally:
+                if hasattr(view, 'release'):
+                    view.release()
+                mapping.close()
+        return batch_ids
+
+    @staticmethod
+    def csv_file_index(path, batch_size, index_path=None):
+        """
+        Returns the offset index of a CSV file for batches of batch_size records,
+        building and saving it unless index_path holds one for the same file. The
+        index is a dict of the file 'size' and 'mtime', 'batch_size', 'header_end'
+        and the 'offsets' delimiting the batches: batch n spans
+        offsets[n]:offsets[n + 1].
+        """
+        index_path = index_path or path + '.offsets.json'
+        stat = os.stat(path)
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if (index['size'], index['mtime'], index['batch_size']) == (stat.st_size, stat.st_mtime, batch_size):
+                return index
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        index = {'size': stat.st_size, 'mtime': stat.st_mtime, 'batch_size': batch_size,
+                 'header_end': 0, 'offsets': [0]}
+        if stat.st_size:
+            with open(path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    index['header_end'] = csv_offsets.next_record_end(mapping)
+                    index['offsets'] = csv_offsets.record_offsets(mapping, batch_size, index['header_end'])
+                finally:
+                    mapping.close()
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+        return index
+
+    # Add JSON batches of dicts to a JSON job - returns the batch ids
+    def bulk_json_upload(self, job_id, records, batch_size=2500):
+        """
+        Streams the dicts generated by records to the job as JSON batches of at
+        most batch_size records each, serializing them while they are sent.
+        """
+        records = iter(records)
+        batch_ids = []
+        while True:
+            try:
+                first = next(records)
+            except StopIteration:
+                break
+            batch = itertools.chain([first], itertools.islice(records, batch_size - 1))
+            batch_ids.append(self.post_bulk_batch(job_id, JsonDictsAdapter(batch)))
         return batch_ids
 
     def raise_error(self, message, status_code=None):
@@ -259,17 +623,14 @@ class SalesforceBulkipy(object):
             raise self.exception_class(message)
 
     def post_bulk_batch(self, job_id, csv_generator):
+        """
+        Streams a batch to the job from a generator, e.g. a CsvDictsAdapter, or
+        a JsonDictsAdapter for JSON jobs. Returns the batch id.
+        """
         uri = self.endpoint + "/job/%s/batch" % job_id
-        headers = self.headers({"Content-Type": "text/csv"})
-        resp = requests.post(uri, data=csv_generator, headers=headers)
-        content = resp.content
-
-        if resp.status_code >= 400:
-            self.raise_error(content, resp.status_code)
-
-        tree = ET.fromstring(content)
-        batch_id = tree.findtext("{%s}id" % self.jobNS)
-        return batch_id
+        headers = self.batch_headers(job_id)
+        resp = self._request('upload', 'POST', uri, job_id=job_id, data=csv_generator, headers=headers)
+        return self._batch_created(resp, job_id)
 
     # Add a BulkDelete to the job - returns the batch id
     def bulk_delete(self, job_id, object_type, where, batch_size=2500):
@@ -278,24 +639,28 @@ class SalesforceBulkipy(object):
         query_batch_id = self.query(query_job_id, soql)
         self.wait_for_batch(query_job_id, query_batch_id, timeout=120)
 
-        results = self.get_all_results_for_batch(batch_id=query_batch_id, job_id=query_job_id)
         if job_id is None:
             job_id = self.create_delete_job(object_type)
+        as_json = self.job_content_types.get(job_id) == 'JSON'
+        results = self.get_all_results_for_batch(batch_id=query_batch_id, job_id=query_job_id,
+                                                 parse_csv=as_json)
 
         batch_ids = []
 
         uri = self.endpoint + "/job/%s/batch" % job_id
-        headers = self.headers({"Content-Type": "text/csv"})
+        headers = self.batch_headers(job_id)
         for batch in results:
-            batch_data = '\n'.join(list(batch))
-            resp = requests.post(uri, data=batch_data, headers=headers)
+            if as_json:
+                batch_data = JsonDictsAdapter({'Id': row[0]} for row in itertools.islice(batch, 1, None))
+            else:
+                batch_data = '\n'.join(list(batch))
+            resp = self._request('upload', 'POST', uri, job_id=job_id, data=batch_data, headers=headers)
             content = resp.content
 
             if resp.status_code >= 400:
                 self.raise_error(content, resp.status_code)
 
-            tree = ET.fromstring(content)
-            batch_id = tree.findtext("{%s}id" % self.jobNS)
+            batch_id = self._parse_info(resp)['id']
 
             self.batches[batch_id] = job_id
             batch_ids.append(batch_id)
@@ -310,19 +675,66 @@ class SalesforceBulkipy(object):
             raise Exception(
                 "Batch id '%s' is uknown, can't retrieve job_id" % batch_id)
 
-    def job_status(self, job_id=None):
+    def forget_job(self, job_id):
+        """Drops a job, its batches and their cached statuses from the client"""
+        self.jobs.pop(job_id, None)
+        self.job_content_types.pop(job_id, None)
+        self.job_statuses.pop(job_id)
+        for batch_id in [b for b, j in iteritems(self.batches) if j == job_id]:
+            del self.batches[batch_id]
+            self.batch_statuses.pop(batch_id)
+
+    def forget_finished_jobs(self):
+        """
+        Forgets every job that was aborted or failed, or that is closed and has
+        only finished batches, going by the last states known to the client, also
+        of statuses evicted from the caches. Returns the ids of the forgotten jobs.
+        """
+        job_batches = {}
+        for batch_id, job_id in iteritems(self.batches):
+            job_batches.setdefault(job_id, []).append(batch_id)
+
+        finished = []
+        for job_id in set(self.jobs) | set(job_batches):
+            state = self._last_job_state(job_id)
+            if state is None:
+                continue
+            if state == bulk_states.CLOSED:
+                if not all(self.batch_statuses.last_state(b) in self.batch_statuses.terminal_states
+                           for b in job_batches.get(job_id, [])):
+                    continue
+            elif state not in self.job_statuses.terminal_states:
+                continue
+            finished.append(job_id)
+
+        for job_id in finished:
+            self.forget_job(job_id)
+        return finished
+
+    def _last_job_state(self, job_id):
+        return self.job_statuses.last_state(job_id)
+
+    def job_status(self, job_id=None, reload=True):
         job_id = job_id or self.lookup_job_id(job_id)
+        if not reload:
+            cached = self.job_statuses.get(job_id)
+            if cached is not None:
+                return cached
+
+        result = self._fetch_job_status(job_id)
+
+        self.instrumentation.job_status(job_id, result)
+        self.job_statuses[job_id] = result
+        return result
+
+    def _fetch_job_status(self, job_id):
         uri = urlparse.urljoin(self.endpoint + "/",
                                'job/{0}'.format(job_id))
-        response = requests.get(uri, headers=self.headers())
+        response = self._request('job', 'GET', uri, job_id=job_id, headers=self.headers())
         if response.status_code != 200:
             self.raise_error(response.content, response.status_code)
 
-        tree = ET.fromstring(response.content)
-        result = {}
-        for child in tree:
-            result[re.sub("{.*?}", "", child.tag)] = child.text
-        return result
+        return self._parse_status(response.content)
 
     def job_state(self, job_id):
         status = self.job_status(job_id)
@@ -332,23 +744,26 @@ class SalesforceBulkipy(object):
             return None
 
     def batch_status(self, job_id=None, batch_id=None, reload=False):
-        if not reload and batch_id in self.batch_statuses:
-            return self.batch_statuses[batch_id]
+        if not reload:
+            cached = self.batch_statuses.get(batch_id)
+            if cached is not None:
+                return cached
 
         job_id = job_id or self.lookup_job_id(batch_id)
+        result = self._fetch_batch_status(job_id, batch_id)
+
+        self.instrumentation.batch_status(job_id, batch_id, result)
+        self.batch_statuses[batch_id] = result
+        return result
+
+    def _fetch_batch_status(self, job_id, batch_id):
         uri = self.endpoint + \
               "/job/%s/batch/%s" % (job_id, batch_id)
 
-        resp = requests.get(uri, headers=self.headers())
+        resp = self._request('poll', 'GET', uri, job_id=job_id, headers=self.headers())
         self.check_status(resp, resp.content)
 
-        tree = ET.fromstring(resp.content)
-        result = {}
-        for child in tree:
-            result[re.sub("{.*?}", "", child.tag)] = child.text
-
-        self.batch_statuses[batch_id] = result
-        return result
+        return self._parse_info(resp)
 
     def batch_state(self, job_id, batch_id, reload=False):
         status = self.batch_status(job_id, batch_id, reload=reload)
@@ -359,6 +774,7 @@ class SalesforceBulkipy(object):
 
     def is_batch_done(self, job_id, batch_id):
         batch_state = self.batch_state(job_id, batch_id, reload=True)
+        self.instrumentation.poll(job_id, batch_id, batch_state)
         if batch_state in bulk_states.ERROR_STATES:
             status = self.batch_status(job_id, batch_id)
             raise BulkBatchFailed(job_id, batch_id, status['stateMessage'])
@@ -373,6 +789,261 @@ class SalesforceBulkipy(object):
             time.sleep(sleep_interval)
             waited += sleep_interval
 
+    def iter_completed_batches(self, job_id, batch_ids, timeout=60 * 10,
+                               sleep_interval=10):
+        """
+        Polls the given batches and yields their ids as they complete, waiting
+        at most timeout seconds in total. Raises BulkBatchFailed if one fails.
+        """
+        pending = list(batch_ids)
+        waited = 0
+        while pending:
+            for batch_id in list(pending):
+                if self.is_batch_done(job_id, batch_id):
+                    pending.remove(batch_id)
+                    yield batch_id
+            if not pending:
+                break
+            if waited >= timeout:
+                raise RuntimeError('Batches {0} of job {1} are not complete after {2} seconds'.format(
+                    ', '.join(pending), job_id, timeout))
+            time.sleep(sleep_interval)
+            waited += sleep_interval
+
+    def get_job_batches(self, job_id):
+        """Returns the status dicts of all batches of the job"""
+        uri = self.endpoint + "/job/%s/batch" % job_id
+        resp = self._request('poll', 'GET', uri, job_id=job_id, headers=self.headers())
+        self.check_status(resp, resp.content)
+        return self._job_batches(resp, job_id)
+
+    def _job_batches(self, resp, job_id):
+        """Parses and caches the batch statuses of a batch list"""
+        if self._is_json(resp):
+            batches = resp.json().get('batchInfo', [])
+        else:
+            tree = ET.fromstring(resp.content)
+            batches = [self._parse_status(ET.tostring(info))
+                       for info in tree.findall("{%s}batchInfo" % self.jobNS)]
+        for status in batches:
+            self.batches.setdefault(status['id'], job_id)
+            self.batch_statuses[status['id']] = status
+        return batches
+
+    def rest_query(self, soql):
+        """Runs a query through the REST API and returns the decoded response, e.g. for aggregates"""
+        uri = self.instance_url + "/services/data/v%s/query" % self.API_version
+        headers = {"Authorization": "Bearer %s" % self.sessionId, "Accept": "application/json"}
+        resp = self._request('rest', 'GET', uri, params={'q': soql}, headers=headers)
+        self.check_status(resp, resp.content)
+        return resp.json()
+
+    def limits(self):
+        """Returns the org's limits, e.g. {'DailyApiRequests': {'Max': 15000, 'Remaining': 14998}, ...}"""
+        uri = self.instance_url + "/services/data/v%s/limits" % self.API_version
+        headers = {"Authorization": "Bearer %s" % self.sessionId, "Accept": "application/json"}
+        resp = self._request('rest', 'GET', uri, headers=headers)
+        self.check_status(resp, resp.content)
+        return resp.json()
+
+    def count(self, soql):
+        """Returns the number of records soql selects, using a COUNT() query"""
+        return self.rest_query(soql_utils.count_query(soql))['totalSize']
+
+    def shard_conditions(self, soql, shards, field='CreatedDate', size_by_count=True, count_resolution=4):
+        """
+        Splits the records selected by soql into at most shards disjoint windows of the
+        datetime field and returns one SOQL condition per window. With size_by_count
+        the range is first cut into shards * count_resolution windows, which are
+        counted with COUNT() queries and grouped so every shard gets about the same
+        number of records.
+        """
+        if shards <= 1:
+            return ['']
+        aggregate = 'SELECT MIN({0}) lo, MAX({0}) hi FROM {1}'.format(field, soql_utils.object_name(soql))
+        where = soql_utils.where_clause(soql)
+        if where:
+            aggregate += ' WHERE ' + where
+        records = self.rest_query(aggregate)['records']
+        if not records or not records[0].get('lo'):
+            return ['']
+        start = soql_utils.parse_datetime(records[0]['lo'])
+        end = soql_utils.parse_datetime(records[0]['hi'])
+
+        if not size_by_count:
+            return [soql_utils.window_condition(field, lower, upper)
+                    for lower, upper in soql_utils.date_bounds(start, end, shards)]
+
+        windows = soql_utils.date_bounds(start, end, shards * count_resolution)
+        counts = [self.count(soql_utils.add_condition(soql, soql_utils.window_condition(field, lower, upper)))
+                  for lower, upper in windows]
+        target = float(sum(counts)) / shards
+
+        conditions = []
+        group_start = 0
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            last = i == len(windows) - 1
+            if last or (seen >= target * (len(conditions) + 1) and len(conditions) < shards - 1):
+                conditions.append(soql_utils.window_condition(field, windows[group_start][0], windows[i][1]))
+                group_start = i + 1
+        return conditions
+
+    def _pk_chunked_query(self, object_name, soql, operation, contentType, chunk_size,
+                          timeout, sleep_interval):
+        """Submits soql to a PK chunking job and returns the job id and the ids of the chunk batches"""
+        job_id = self.create_job(object_name, operation, contentType=contentType, pk_chunking=chunk_size)
+        original = self.query(job_id, soql)
+
+        waited = 0
+        while True:
+            state = self.batch_state(job_id, original, reload=True)
+            if state == bulk_states.NOT_PROCESSED:
+                # the original batch is replaced by one batch per chunk
+                break
+            if state in (bulk_states.FAILED, bulk_states.ABORTED):
+                raise BulkBatchFailed(job_id, original, self.batch_status(job_id, original)['stateMessage'])
+            if waited >= timeout:
+                raise RuntimeError('Batch {0} of job {1} was not chunked after {2} seconds'.format(
+                    original, job_id, timeout))
+            time.sleep(sleep_interval)
+            waited += sleep_interval
+
+        batch_ids = [b['id'] for b in self.get_job_batches(job_id) if b['id'] != original]
+        return job_id, batch_ids
+
+    def extract(self, soql, shards=4, shard_by='CreatedDate', parse_csv=False, size_by_count=True,
+                count_resolution=4, operation='query', contentType='CSV', timeout=60 * 60,
+                sleep_interval=10):
+        """
+        Runs soql as shards parallel batches of one job and generates the merged
+        results, taking each batch as soon as it completes. For CSV jobs the header
+        comes first, once. The rows of different shards are interleaved, so an
+        ORDER BY only holds within each shard. A query with LIMIT or OFFSET is
+        run as a single batch, as the clause would apply to every shard.
+
+        Args:
+            soql: the query
+            shards: the number of batches to split the query into
+            shard_by: a datetime field (CreatedDate, SystemModstamp, ...) to split
+                the query into windows of, or 'Id' to let Salesforce split it into Id
+                ranges with PK chunking (Bulk API v1 only)
+            parse_csv: if true, rows are lists instead of lines
+            size_by_count: size the shards using COUNT() estimates
+            count_resolution: number of counted windows per shard when sizing
+            operation: 'query' or 'queryAll'
+            contentType: the job contentType, CSV or JSON
+            timeout: seconds to wait for all batches
+            sleep_interval: seconds between polls
+        """
+        if shard_by == 'Id' and not self.supports_pk_chunking:
+            raise ValueError('{0} has no PK chunking, shard by a datetime field instead'.format(
+                type(self).__name__))
+        if soql_utils.has_limit(soql):
+            shards = 1
+
+        object_name = soql_utils.object_name(soql)
+        if shard_by == 'Id' and shards > 1:
+            chunk_size = None
+            if size_by_count:
+                chunk_size = min(250000, max(1, -(-self.count(soql) // shards)))
+            job_id, batch_ids = self._pk_chunked_query(object_name, soql, operation, contentType,
+                                                       chunk_size or True, timeout, sleep_interval)
+        else:
+            conditions = self.shard_conditions(soql, shards, shard_by, size_by_count, count_resolution)
+            job_id = self.create_job(object_name, operation, contentType=contentType)
+            batch_ids = [self.query(job_id, soql_utils.add_condition(soql, condition) if condition else soql)
+                         for condition in conditions]
+        self.close_job(job_id)
+
+        with_header = contentType != 'JSON'
+        header_sent = False
+        for batch_id in self.iter_completed_batches(job_id, batch_ids, timeout, sleep_interval):
+            for result in self.get_all_results_for_batch(batch_id, job_id, parse_csv=parse_csv):
+                for i, row in enumerate(result):
+                    if with_header and i == 0:
+                        if row in (NO_RESULTS, [NO_RESULTS]):
+                            # an empty shard has no header either
+                            break
+                        if header_sent:
+                            continue
+                        header_sent = True
+                    yield row
+
+    def sync(self, soql, snapshot, name=None, include_deleted=True, lookback=300, shards=1,
+             timeout=60 * 60, sleep_interval=10):
+        """
+        Brings a local snapshot of the records selected by soql up to date. The first
+        run loads every record, later runs only query the records whose SystemModstamp
+        is past the watermark of the previous run (with include_deleted, through
+        queryAll so records deleted since are returned too), merge them into the
+        snapshot by Id and advance the watermark. Changing soql reloads the snapshot.
+
+        When soql has a WHERE clause, later runs also query the Ids of all the records
+        changed since the watermark, and remove the ones the filtered query no longer
+        returns, i.e. the records changed so they do not match it anymore.
+
+        Args:
+            soql: the query, Id, SystemModstamp and IsDeleted are selected too
+            snapshot: a SqliteSnapshot
+            name: the snapshot to update, defaults to the name of the queried object
+            include_deleted: remove the records deleted since the previous run, as long
+                as they are in the recycle bin
+            lookback: seconds to move the watermark back by, so records of transactions
+                that committed after the previous run with an older SystemModstamp are
+                not missed. Records read again are merged again by Id.
+            shards: number of parallel batches to run the query as, see extract
+            timeout: seconds to wait for the query
+            sleep_interval: seconds between polls
+
+        Returns:
+            a dict with whether the snapshot was reloaded ('full'), the numbers of
+            'upserted' and 'deleted' records and the new 'watermark'
+        """
+        name = name or soql_utils.object_name(soql)
+        fields = ['Id', 'SystemModstamp'] + (['IsDeleted'] if include_deleted else [])
+        query = soql_utils.ensure_fields(soql, fields)
+
+        state = snapshot.state(name)
+        full = state is None or state['soql'] != soql or state['watermark'] is None
+        operation = 'query'
+        changed_ids = ()
+        if not full:
+            since = state['watermark'] - timedelta(seconds=lookback)
+            changed = 'SystemModstamp > %s' % soql_utils.format_datetime(since)
+            query = soql_utils.add_condition(query, changed)
+            if include_deleted:
+                operation = 'queryAll'
+            if soql_utils.where_clause(soql):
+                id_rows = self.extract('SELECT Id FROM %s WHERE %s' % (soql_utils.object_name(soql), changed),
+                                       shards=shards, parse_csv=True, operation=operation,
+                                       timeout=timeout, sleep_interval=sleep_interval)
+                changed_ids = set(row[0] for row in itertools.islice(id_rows, 1, None))
+
+        rows = self.extract(query, shards=shards, parse_csv=True, operation=operation,
+                            timeout=timeout, sleep_interval=sleep_interval)
+        if changed_ids:
+            # the changed records the filtered query does not return are left in changed_ids,
+            # merge reads them once it has merged the rows
+            rows = self._discard_ids(rows, changed_ids)
+        upserted, deleted = snapshot.merge(name, soql, rows, reset=full, remove=changed_ids)
+        return {'full': full, 'upserted': upserted, 'deleted': deleted,
+                'watermark': snapshot.state(name)['watermark']}
+
+    @staticmethod
+    def _discard_ids(rows, ids):
+        """Generates csv parsed rows, header first, discarding the Id of every row from ids"""
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield header
+        id_index = [c.lower() for c in header].index('id')
+        for row in rows:
+            ids.discard(row[id_index])
+            yield row
+
     def get_batch_result_ids(self, batch_id, job_id=None):
         job_id = job_id or self.lookup_job_id(batch_id)
         if not self.is_batch_done(job_id, batch_id):
@@ -383,10 +1054,16 @@ class SalesforceBulkipy(object):
             "job/{0}/batch/{1}/result".format(
                 job_id, batch_id),
         )
-        resp = requests.get(uri, headers=self.headers())
+        resp = self._request('result_list', 'GET', uri, job_id=job_id, headers=self.headers())
         if resp.status_code != 200:
             return False
+        return self._result_ids(resp)
 
+    def _result_ids(self, resp):
+        """Parses the result ids out of a batch result list"""
+        if self._is_json(resp):
+            # JSON jobs list their result ids as a plain array
+            return [str(r) for r in resp.json()]
         tree = ET.fromstring(resp.content)
         find_func = getattr(tree, 'iterfind', tree.findall)
         return [str(r.text) for r in
@@ -419,19 +1096,142 @@ class SalesforceBulkipy(object):
         job_id = job_id or self.lookup_job_id(batch_id)
         logger = logger or (lambda message: None)
 
+        logger('Downloading bulk result file id=#{0}'.format(result_id))
+        resp = self._result_response(batch_id, result_id, job_id)
+        for row in self._result_rows(resp, job_id, parse_csv, logger):
+            yield row
+
+    def _result_response(self, batch_id, result_id, job_id):
+        """Requests a result file, returns the streamed response"""
         uri = urlparse.urljoin(
             self.endpoint + "/",
             "job/{0}/batch/{1}/result/{2}".format(
                 job_id, batch_id, result_id),
         )
-        logger('Downloading bulk result file id=#{0}'.format(result_id))
-        resp = requests.get(uri, headers=self.headers(), stream=True)
+        return self._request('download', 'GET', uri, job_id=job_id, headers=self.headers(), stream=True)
+
+    def _result_responses(self, batch_id, job_id):
+        """Generates the streamed responses of all result files of a batch"""
+        result_ids = self.get_batch_result_ids(batch_id, job_id=job_id)
+        if not result_ids:
+            raise RuntimeError('Batch is not complete')
+        for result_id in result_ids:
+            resp = self._result_response(batch_id, result_id, job_id)
+            if resp.status_code >= 400:
+                self.raise_error(resp.content, resp.status_code)
+            yield resp
+
+    def _result_files(self, batch_id, job_id, chunk_size):
+        """
+        Returns whether the results of a batch are JSON, and a generator of the
+        raw chunks of each result file
+        """
+        responses = self._result_responses(batch_id, job_id)
+        first = next(responses, None)
+        is_json = first is not None and self._is_json(first)
+        result_files = (self._iter_content('download', resp, job_id=job_id, chunk_size=chunk_size)
+                        for resp in itertools.chain([first] if first is not None else [], responses))
+        return is_json, result_files
+
+    def download_results_to(self, batch_id, destination, job_id=None, compression=None,
+                            format=None, chunk_size=1024 * 1024):
+        """
+        Writes all result files of a query batch to a single file, copying the raw
+        bytes in blocks of chunk_size without decoding or parsing them. CSV results
+        keep the header of the first file only, JSON results are joined into one array.
+
+        Args:
+            batch_id: id of batch
+            destination: a path, or a file object opened in binary mode
+            job_id: id of job, if not provided, it will be looked up
+            compression: 'gzip' to compress the output; for Parquet, the codec to use
+            format: 'parquet' to convert CSV results to Parquet (requires pyarrow),
+                by default results are written as they are returned
+            chunk_size: size of the blocks read from the network
+        """
+        job_id = job_id or self.lookup_job_id(batch_id)
+        if compression not in (None, 'gzip') and format != 'parquet':
+            raise ValueError('Unsupported compression: %s' % compression)
+        is_json, result_files = self._result_files(batch_id, job_id, chunk_size)
+        if is_json and format == 'parquet':
+            raise ValueError('Only CSV results can be converted to Parquet')
+
+        out = open(destination, 'wb') if isinstance(destination, string_types) else destination
+        try:
+            if format == 'parquet':
+                result_sink.write_parquet(result_files, out, compression)
+            else:
+                sink = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6) if compression else out
+                try:
+                    (result_sink.write_json if is_json else result_sink.write_csv)(result_files, sink)
+                finally:
+                    if compression:
+                        sink.close()
+        finally:
+            if out is not destination:
+                out.close()
+
+    def get_batch_results_parallel(self, batch_id, job_id=None, processes=None, chunk_size=4 * 1024 * 1024,
+                                   converters=None, columnar=False, pool=None):
+        """
+        Parses the results of a CSV query batch in a process pool. The result files
+        are spooled to a temporary file, which is cut into chunks of about chunk_size
+        bytes at record boundaries (line ends inside quoted values are skipped) and
+        the chunks are parsed in parallel, keeping their order.
+
+        Args:
+            batch_id: id of batch
+            job_id: id of job, if not provided, it will be looked up
+            processes: size of the pool, defaults to the number of cores
+            chunk_size: bytes per parsed chunk
+            converters: dict of field => picklable callable converting its values,
+                e.g. {'NumberOfEmployees': int}; empty values become None
+            columnar: generate one dict of field => list of values per chunk
+            pool: a multiprocessing pool to reuse instead of starting one
+
+        Returns:
+            a generator of the header and the rows, as lists, or of column dicts
+        """
+        job_id = job_id or self.lookup_job_id(batch_id)
+        with TemporaryFile() as spool:
+            is_json, result_files = self._result_files(batch_id, job_id, 1024 * 1024)
+            if is_json:
+                raise ValueError('Only CSV results can be parsed in parallel')
+            result_sink.write_csv(result_files, spool)
+            spool.seek(0)
+            header_line = spool.readline()
+            if not header_line:
+                return
+            header = parallel_csv.parse_rows(header_line)[0]
+            if not columnar:
+                yield header
+            for chunk in parallel_csv.parse_file(spool, header, processes, chunk_size, converters,
+                                                 columnar, pool):
+                if columnar:
+                    yield chunk
+                else:
+                    for row in chunk:
+                        yield row
+
+    def _result_rows(self, resp, job_id, parse_csv, logger):
+        """
+        Generates the (optionally csv parsed) lines of a streamed result file,
+        or the records of a JSON result file, parsed incrementally
+        """
+        if self._is_json(resp):
+            for i, record in enumerate(iter_json_array(self._iter_content('download', resp, job_id=job_id))):
+                if i % 5000 == 0:
+                    logger('Loading bulk result #{0}'.format(i))
+                yield record
+            return
+
+        lines = self._iter_lines('download', resp, job_id=job_id)
 
         if parse_csv:
             iterator = csv.reader(
-                self._unicode_list_gen(resp.iter_lines()), delimiter=',', quotechar='"')
+                self._unicode_list_gen(lines), delimiter=',', quotechar='"')
         else:
-            iterator = self._unicode_list_gen(resp.iter_lines())
+            iterator = self._unicode_list_gen(lines)
 
         BATCH_SIZE = 5000
         for i, line in enumerate(iterator):
@@ -464,22 +1264,28 @@ class SalesforceBulkipy(object):
 
         uri = self.endpoint + \
               "/job/%s/batch/%s/result" % (job_id, batch_id)
-        r = requests.get(uri, headers=self.headers(), stream=True)
+        r = self._request('result_list', 'GET', uri, job_id=job_id, headers=self.headers())
 
-        result_id = r.text.split("<result>")[1].split("</result>")[0]
+        if self._is_json(r):
+            result_id = r.json()[0]
+        else:
+            result_id = r.text.split("<result>")[1].split("</result>")[0]
 
         uri = self.endpoint + \
               "/job/%s/batch/%s/result/%s" % (job_id, batch_id, result_id)
-        r = requests.get(uri, headers=self.headers(), stream=True)
+        r = self._request('download', 'GET', uri, job_id=job_id, headers=self.headers(), stream=True)
+        if self._is_json(r):
+            return iter_json_array(self._iter_content('download', r, job_id=job_id))
+        lines = self._iter_lines('download', r, job_id=job_id, chunk_size=2048)
 
         if parse_csv:
             reader = csv.DictReader(
-                self._unicode_list_gen(r.iter_lines(chunk_size=2048)),
+                self._unicode_list_gen(lines),
                 delimiter=',',
                 quotechar='"')
             return self._unicode_list_dicts_gen(reader)
         else:
-            return self._unicode_list_gen(r.iter_lines(chunk_size=2048))
+            return self._unicode_list_gen(lines)
 
     def get_upload_results(self, job_id, batch_id,
                            callback=(lambda *args, **kwargs: None),
@@ -491,7 +1297,22 @@ class SalesforceBulkipy(object):
 
         uri = self.endpoint + \
               "/job/%s/batch/%s/result" % (job_id, batch_id)
-        resp = requests.get(uri, headers=self.headers())
+        resp = self._request('download', 'GET', uri, job_id=job_id, headers=self.headers())
+        return self._feed_upload_response(resp, callback, batch_size, logger)
+
+    def _feed_upload_response(self, resp, callback, batch_size, logger):
+        """Parses the upload results of a batch result response and passes them to callback"""
+        if self._is_json(resp):
+            results = [UploadResult('Id', 'Success', 'Created', 'Error')]
+            for r in resp.json():
+                error = '; '.join(e.get('message') or str(e) if isinstance(e, dict) else str(e)
+                                  for e in r.get('errors') or [])
+                results.append(UploadResult(r.get('id') or '', str(r.get('success')).lower(),
+                                            str(r.get('created')).lower(), error))
+            if logger:
+                logger("Total records: %d" % len(results))
+            self._feed_upload_results(results, callback, batch_size, len(results))
+            return True
 
         tf = TemporaryFile()
         tf.write(resp.content)
@@ -501,15 +1322,25 @@ class SalesforceBulkipy(object):
             logger("Total records: %d" % total_remaining)
         tf.seek(0)
 
-        records = []
-        line_number = 0
-        col_names = []
         tf_text = tf.read()
         reader = csv.reader(
             self._unicode_list_gen(tf_text.splitlines()), delimiter=",", quotechar='"')
-        for row in reader:
+        self._feed_upload_results((UploadResult(*row) for row in reader),
+                                  callback, batch_size, total_remaining)
+
+        tf.close()
+
+        return True
+
+    @staticmethod
+    def _feed_upload_results(results, callback, batch_size, total_remaining):
+        """Passes UploadResults (header first) to callback, batch_size records at a time"""
+        records = []
+        line_number = 0
+        col_names = []
+        for result in results:
             line_number += 1
-            records.append(UploadResult(*row))
+            records.append(result)
             if len(records) == 1:
                 col_names = records[0]
             if batch_size > 0 and len(records) >= (batch_size + 1):
@@ -518,10 +1349,6 @@ class SalesforceBulkipy(object):
                 records = [col_names]
         callback(records, total_remaining, line_number)
 
-        tf.close()
-
-        return True
-
     def parse_csv(self, tf, callback, batch_size, total_remaining):
         records = []
         line_number = 0
@@ -557,6 +1384,42 @@ class SalesforceBulkipy(object):
 
         return lines
 
+    @classmethod
+    def _parse_info(cls, resp):
+        """ Parses a jobInfo or batchInfo response, which is JSON for JSON jobs and XML otherwise
+
+        Args:
+            resp (requests.Response): the response
+
+        Returns:
+            a dict of the info fields
+        """
+
+        if cls._is_json(resp):
+            return resp.json()
+        return cls._parse_status(resp.content)
+
+    @staticmethod
+    def _is_json(resp):
+        return 'json' in resp.headers.get('Content-Type', '')
+
+    @staticmethod
+    def _parse_status(content):
+        """ Parses a jobInfo or batchInfo XML document into a dict
+
+        Args:
+            content (bytes): the XML document
+
+        Returns:
+            a dict of the element names (without namespace) to their text
+        """
+
+        tree = ET.fromstring(content)
+        result = {}
+        for child in tree:
+            result[re.sub("{.*?}", "", child.tag)] = child.text
+        return result
+
     @staticmethod
     def _xml_element_to_str(root):
         """ Converts a xml.etree.ElementTree.Element to string
@@ -0,0 +1,118 @@
+"""Caches of Salesforce sessions, so new clients can skip the login call"""
+from __future__ import absolute_import
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class SessionCache(object):
+    """
+    Stores the session id and host of a login, keyed by username and sandbox,
+    for ttl seconds. Sessions are not validated when they are read, clients
+    log in again when the API rejects one.
+
+    Subclasses store the entries by implementing _load, _store and _remove.
+    """
+
+    def __init__(self, ttl=2 * 60 * 60, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+
+    @staticmethod
+    def key(username, sandbox):
+        return '%s|%s' % (username, 'sandbox' if sandbox else 'production')
+
+    def get(self, username, sandbox):
+        """Returns the cached (session_id, host), or None if there is none or it expired"""
+        entry = self._load(self.key(username, sandbox))
+        if entry is None or (self.ttl is not None and self.clock() - entry['stored'] >= self.ttl):
+            return None
+        return entry['session_id'], entry['host']
+
+    def set(self, username, sandbox, session_id, host):
+        self._store(self.key(username, sandbox),
+                    {'session_id': session_id, 'host': host, 'stored': self.clock()})
+
+    def invalidate(self, username, sandbox):
+        self._remove(self.key(username, sandbox))
+
+    def _load(self, key):
+        raise NotImplementedError
+
+    def _store(self, key, entry):
+        raise NotImplementedError
+
+    def _remove(self, key):
+        raise NotImplementedError
+
+
+class MemorySessionCache(SessionCache):
+    """Keeps sessions in memory, to share them between the clients of a process"""
+
+    def __init__(self, ttl=2 * 60 * 60, clock=time.time):
+        super(MemorySessionCache, self).__init__(ttl, clock)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+
+    def _remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class FileSessionCache(SessionCache):
+    """
+    Keeps sessions in a JSON file, to share them between processes. The file is
+    only readable by its owner and is replaced atomically on every change, so
+    readers never see a partial write.
+    """
+
+    def __init__(self, path, ttl=2 * 60 * 60, clock=time.time):
+        super(FileSessionCache, self).__init__(ttl, clock)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.sessions')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            _replace(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def _load(self, key):
+        return self._read().get(key)
+
+    def _store(self, key, entry):
+        with self._lock:
+            entries = self._read()
+            entries[key] = entry
+            self._write(entries)
+
+    def _remove(self, key):
+        with self._lock:
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
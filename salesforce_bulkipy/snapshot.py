@@ -0,0 +1,154 @@
+"""Local SQLite copies of query results, kept up to date by SalesforceBulkipy.sync"""
+from __future__ import absolute_import
+
+import sqlite3
+
+from . import soql as soql_utils
+
+STATE_TABLE = '_sync_state'
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+class SqliteSnapshot(object):
+    """
+    Stores the records of queries in a SQLite database, one table per snapshot
+    with a TEXT column per result column and Id as the primary key. Next to
+    them it keeps the query each snapshot was loaded with and its watermark,
+    the newest SystemModstamp merged so far.
+
+    Args:
+        path: the database file, or ':memory:'
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS %s (name TEXT PRIMARY KEY, soql TEXT, watermark TEXT)'
+                % STATE_TABLE)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def state(self, name):
+        """Returns {'soql': ..., 'watermark': datetime or None} of a snapshot, or None if there is none"""
+        row = self.connection.execute(
+            'SELECT soql, watermark FROM %s WHERE name = ?' % STATE_TABLE, (name,)).fetchone()
+        if row is None:
+            return None
+        return {'soql': row[0], 'watermark': soql_utils.parse_datetime(row[1]) if row[1] else None}
+
+    def merge(self, name, soql, rows, reset=False, batch_size=1000, remove=()):
+        """
+        Merges query results into a snapshot in a single transaction: records are
+        upserted by Id, the ones whose IsDeleted is true are removed, and the
+        watermark moves to the newest SystemModstamp seen. With reset, the snapshot
+        is emptied first.
+
+        Args:
+            name: the snapshot
+            soql: the query the rows come from
+            rows: the csv parsed rows, header first
+            reset: replace the snapshot instead of updating it
+            batch_size: number of rows written per statement
+            remove: Ids of records to remove too, read once the rows are merged
+
+        Returns:
+            (number of upserted records, number of deleted records)
+        """
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is not None and [c.lower() for c in header][:1] == ['records not found for this query']:
+            header = None
+        columns = [c.lower() for c in header or ()]
+        if header is not None and 'id' not in columns:
+            raise ValueError('Query results need an Id column to be merged, got %s' % ', '.join(header))
+
+        table = _quote(name)
+        upserted = deleted = 0
+        with self.connection:
+            if reset:
+                self.connection.execute('DROP TABLE IF EXISTS %s' % table)
+            saved = None if reset else self.connection.execute(
+                'SELECT watermark FROM %s WHERE name = ?' % STATE_TABLE, (name,)).fetchone()
+            watermark = saved[0] if saved else None
+            newest = None
+            if header is not None:
+                id_index = columns.index('id')
+                self.connection.execute('CREATE TABLE IF NOT EXISTS %s (%s, PRIMARY KEY (%s))' % (
+                    table, ', '.join('%s TEXT' % _quote(c) for c in header), _quote(header[id_index])))
+                upsert = 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+                    table, ', '.join(_quote(c) for c in header), ', '.join('?' * len(header)))
+                delete = 'DELETE FROM %s WHERE %s = ?' % (table, _quote(header[id_index]))
+                modstamp_index = columns.index('systemmodstamp') if 'systemmodstamp' in columns else None
+                deleted_index = columns.index('isdeleted') if 'isdeleted' in columns else None
+
+                pending_upserts, pending_deletes = [], []
+                for row in rows:
+                    if modstamp_index is not None and row[modstamp_index]:
+                        modstamp = soql_utils.parse_datetime(row[modstamp_index])
+                        if newest is None or modstamp > newest[0]:
+                            newest = (modstamp, row[modstamp_index])
+                    if deleted_index is not None and row[deleted_index].lower() == 'true':
+                        pending_deletes.append((row[id_index],))
+                    else:
+                        pending_upserts.append(row)
+                    if len(pending_upserts) + len(pending_deletes) >= batch_size:
+                        upserted, deleted = self._flush(upsert, delete, pending_upserts, pending_deletes,
+                                                        upserted, deleted)
+                upserted, deleted = self._flush(upsert, delete, pending_upserts, pending_deletes,
+                                                upserted, deleted)
+
+            removals = [(record_id,) for record_id in remove]
+            if removals:
+                try:
+                    deleted += self.connection.executemany(
+                        'DELETE FROM %s WHERE "Id" = ?' % table, removals).rowcount
+                except sqlite3.OperationalError:
+                    # nothing was ever merged
+                    pass
+
+            if newest is not None and (watermark is None or newest[0] > soql_utils.parse_datetime(watermark)):
+                watermark = newest[1]
+            self.connection.execute('INSERT OR REPLACE INTO %s (name, soql, watermark) VALUES (?, ?, ?)'
+                                    % STATE_TABLE, (name, soql, watermark))
+        return upserted, deleted
+
+    def _flush(self, upsert, delete, pending_upserts, pending_deletes, upserted, deleted):
+        if pending_upserts:
+            self.connection.executemany(upsert, pending_upserts)
+        if pending_deletes:
+            # records deleted before they ever made it into the snapshot are not counted
+            deleted += self.connection.executemany(delete, pending_deletes).rowcount
+        upserted += len(pending_upserts)
+        del pending_upserts[:]
+        del pending_deletes[:]
+        return upserted, deleted
+
+    def records(self, name):
+        """Generates the records of a snapshot as dicts"""
+        try:
+            cursor = self.connection.execute('SELECT * FROM %s' % _quote(name))
+        except sqlite3.OperationalError:
+            # nothing was ever merged
+            return
+        columns = [d[0] for d in cursor.description]
+        for row in cursor:
+            yield dict(zip(columns, row))
+
+    def count(self, name):
+        """The number of records in a snapshot"""
+        try:
+            return self.connection.execute('SELECT COUNT(*) FROM %s' % _quote(name)).fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
@@ -0,0 +1,170 @@
+"""Small helpers to inspect and rewrite SOQL queries"""
+from __future__ import absolute_import
+
+import re
+from datetime import datetime, timedelta
+
+# clauses that can follow the FROM clause, in the order SOQL allows them
+_CLAUSES = ('where', 'with', 'group by', 'order by', 'limit', 'offset', 'for')
+
+_KEYWORD = re.compile(r'\b(select|from|where|with|group\s+by|having|order\s+by|limit|offset|for)\b', re.I)
+
+
+def _top_level_keywords(soql):
+    """Returns [(keyword, start, end)] for the clause keywords outside of subqueries and string literals"""
+    keywords = []
+    depth = 0
+    in_string = False
+    i = 0
+    while i < len(soql):
+        c = soql[i]
+        if in_string:
+            if c == '\\':
+                i += 1
+            elif c == "'":
+                in_string = False
+        elif c == "'":
+            in_string = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif depth == 0 and c.isalpha() and (i == 0 or not (soql[i - 1].isalnum() or soql[i - 1] in '_.')):
+            match = _KEYWORD.match(soql, i)
+            if match:
+                keywords.append((re.sub(r'\s+', ' ', match.group(1).lower()), match.start(), match.end()))
+                i = match.end()
+                continue
+        i += 1
+    return keywords
+
+
+def _clause_spans(soql):
+    """Returns {keyword: (start of keyword, end of keyword, end of clause)}"""
+    keywords = _top_level_keywords(soql)
+    spans = {}
+    for n, (keyword, start, end) in enumerate(keywords):
+        if keyword in spans:
+            continue
+        stop = keywords[n + 1][1] if n + 1 < len(keywords) else len(soql)
+        spans[keyword] = (start, end, stop)
+    return spans
+
+
+def object_name(soql):
+    """The name of the object queried by soql"""
+    start, end, stop = _clause_spans(soql)['from']
+    return re.match(r'\s*(\w+)', soql[end:stop]).group(1)
+
+
+def select_fields(soql):
+    """The fields of the top-level select list, as written"""
+    spans = _clause_spans(soql)
+    start, end, stop = spans['select']
+    fields, depth, current = [], 0, ''
+    for c in soql[end:stop]:
+        if c == ',' and depth == 0:
+            fields.append(current.strip())
+            current = ''
+            continue
+        depth += (c == '(') - (c == ')')
+        current += c
+    fields.append(current.strip())
+    return [f for f in fields if f]
+
+
+def ensure_fields(soql, fields):
+    """Adds every field of fields that is not selected yet to the select list"""
+    selected = set(f.lower() for f in select_fields(soql))
+    missing = [f for f in fields if f.lower() not in selected]
+    if not missing:
+        return soql
+    start, end, stop = _clause_spans(soql)['select']
+    select_list = soql[end:stop].rstrip()
+    return soql[:end] + select_list + ', ' + ', '.join(missing) + ' ' + soql[stop:].lstrip()
+
+
+def where_clause(soql):
+    """The condition of the WHERE clause, or None"""
+    spans = _clause_spans(soql)
+    if 'where' not in spans:
+        return None
+    start, end, stop = spans['where']
+    return soql[end:stop].strip()
+
+
+def add_condition(soql, condition):
+    """Returns soql with condition ANDed to its WHERE clause"""
+    spans = _clause_spans(soql)
+    if 'where' in spans:
+        start, end, stop = spans['where']
+        existing = soql[end:stop].strip()
+        tail = soql[stop:]
+        return '%s(%s) AND %s%s' % (soql[:end] + ' ', existing, condition, ' ' + tail if tail else '')
+
+    insert_at = len(soql)
+    for keyword in _CLAUSES[1:]:
+        if keyword in spans:
+            insert_at = min(insert_at, spans[keyword][0])
+    head = soql[:insert_at].rstrip()
+    tail = soql[insert_at:]
+    return '%s WHERE %s%s' % (head, condition, ' ' + tail if tail else '')
+
+
+def has_limit(soql):
+    """Whether soql has a LIMIT or OFFSET clause"""
+    spans = _clause_spans(soql)
+    return 'limit' in spans or 'offset' in spans
+
+
+def count_query(soql):
+    """Rewrites soql into a SELECT COUNT() query over the same records"""
+    spans = _clause_spans(soql)
+    start, end, stop = spans['from']
+    query = 'SELECT COUNT() ' + soql[start:stop].strip()
+    where = where_clause(soql)
+    if where:
+        query += ' WHERE ' + where
+    return query
+
+
+def format_datetime(value):
+    """Formats a naive UTC datetime as a SOQL datetime literal"""
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_datetime(value):
+    """Parses a datetime returned by the API (e.g. 2017-06-01T12:00:00.000+0000) into a naive UTC datetime"""
+    match = re.match(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:?\d\d)?$', value)
+    if not match:
+        raise ValueError('Unknown datetime format: %s' % value)
+    result = datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S')
+    if match.group(2):
+        result += timedelta(microseconds=int(match.group(2)[:6].ljust(6, '0')))
+    offset = match.group(3)
+    if offset and offset != 'Z':
+        offset = offset.replace(':', '')
+        sign = -1 if offset[0] == '-' else 1
+        result -= sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+    return result
+
+
+def date_bounds(start, end, count):
+    """
+    Splits [start, end] into count consecutive windows and returns their
+    (lower, upper) bounds. The first window has no lower bound and the last one
+    no upper bound, so no record falls between the cracks.
+    """
+    step = (end - start) / count if count else timedelta(0)
+    bounds = [None] + [start + step * i for i in range(1, count)] + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def window_condition(field, lower, upper):
+    """The SOQL condition selecting lower <= field < upper, either bound may be None"""
+    parts = []
+    if lower is not None:
+        parts.append('%s >= %s' % (field, format_datetime(lower)))
+    if upper is not None:
+        parts.append('%s < %s' % (field, format_datetime(upper)))
+    return ' AND '.join(parts)
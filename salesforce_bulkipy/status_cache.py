@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+
+import threading
+import time
+from collections import OrderedDict
+
+from . import bulk_states
+
+
+class StatusCache(object):
+    """Bounded cache of job or batch status dicts, keyed by id.
+
+    Holds at most ``max_size`` entries and evicts the least recently used one
+    when full. Statuses in one of ``terminal_states`` never change anymore so
+    they never expire; any other status is only served for ``ttl`` seconds
+    after it was stored (``ttl=None`` disables expiry).
+
+    The state of an evicted status is kept, until the key is popped, if the
+    key is in ``tracked`` (e.g. the jobs or batches dict of the client), so
+    finished jobs and batches can still be told apart from running ones.
+    """
+
+    def __init__(self, max_size=1000, ttl=10, terminal_states=bulk_states.TERMINAL_STATES,
+                 clock=time.time, tracked=()):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.terminal_states = terminal_states
+        self.clock = clock
+        self.tracked = tracked
+        self._entries = OrderedDict()  # key => (status, stored at)
+        self._evicted_states = {}  # tracked key => state of its evicted status
+        self._lock = threading.Lock()
+
+    def is_terminal(self, status):
+        return status.get('state') in self.terminal_states
+
+    def get(self, key):
+        """Returns the cached status, or None if it is unknown or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            status, stored = entry
+            if (self.ttl is not None and not self.is_terminal(status)
+                    and self.clock() - stored >= self.ttl):
+                return None
+            # mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            return status
+
+    def peek(self, key):
+        """Returns the cached status even if it has expired, without touching the LRU order"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def last_state(self, key):
+        """Returns the state of the last status stored for key, also if it was evicted and is tracked"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0].get('state')
+            return self._evicted_states.get(key)
+
+    def set(self, key, status):
+        with self._lock:
+            self._evicted_states.pop(key, None)
+            self._entries.pop(key, None)
+            self._entries[key] = (status, self.clock())
+            while len(self._entries) > self.max_size:
+                evicted, (evicted_status, _) = self._entries.popitem(last=False)
+                if evicted in self.tracked:
+                    self._evicted_states[evicted] = evicted_status.get('state')
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._evicted_states.pop(key, None)
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._evicted_states.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        status = self.get(key)
+        if status is None:
+            raise KeyError(key)
+        return status
+
+    def __setitem__(self, key, status):
+        self.set(key, status)
+
+    def __len__(self):
+        return len(self._entries)
@@ -47,6 +47,7 @@ setup(
     package_data={'': ['LICENSE']},
     include_package_data=True,
     install_requires=requires,
+    extras_require={'parquet': ['pyarrow'], 'async': ['aiohttp']},
     license=license,
     zip_safe=False,
     classifiers=(
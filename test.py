@@ -1,23 +1,54 @@
 from __future__ import print_function
+import csv
+import gzip
+import itertools
+import json
+import os
 import re
+import tempfile
+import threading
 import time
 import unittest
+from io import BytesIO, StringIO
 
 try:
     raw_input = input
 except NameError:
     pass
 
-from salesforce_bulkipy import SalesforceBulkipy, CsvDictsAdapter
+from salesforce_bulkipy import SalesforceBulkipy, SalesforceBulkipyV2, CsvDictsAdapter, MetricsCollector, SqliteSnapshot
+from salesforce_bulkipy import result_sink, soql as soql_utils
+from salesforce_bulkipy.csv_offsets import iter_record_chunks, last_record_end
+from salesforce_bulkipy.governor import BulkGovernor
+from salesforce_bulkipy.salesforce_bulkipy import BulkBudgetExhausted
+from salesforce_bulkipy.session_cache import FileSessionCache, MemorySessionCache
+from salesforce_bulkipy.status_cache import StatusCache
+from benchmarks.mock_server import MockBulkServer, record_time
+
+try:
+    import asyncio
+    import inspect
+    from salesforce_bulkipy.aio import AsyncSalesforceBulkipy, SYNC_ONLY_METHODS
+except (ImportError, SyntaxError):
+    # needs Python 3.7+ and aiohttp
+    AsyncSalesforceBulkipy = None
+
+
+def multiline_record_factory(fields, n):
+    return ['001%012dAAA' % n, 'line 1 of %d\n"line 2", ok' % n, str(n * 10) if n % 3 else '']
 
 
 class SalesforceBulkTest(unittest.TestCase):
-    def __init__(self, testName, endpoint, sessionId):
+    """Runs against a live org, skipped unless built with an endpoint and a session (see __main__)"""
+
+    def __init__(self, testName='runTest', endpoint=None, sessionId=None):
         super(SalesforceBulkTest, self).__init__(testName)
         self.endpoint = endpoint
         self.sessionId = sessionId
 
     def setUp(self):
+        if not self.endpoint or not self.sessionId:
+            self.skipTest('needs a live Salesforce org')
         self.jobs = []
 
     def tearDown(self):
@@ -59,6 +90,27 @@ class SalesforceBulkTest(unittest.TestCase):
         self.assertTrue(len(results[0]) > 0)
         self.assertIn('"', results[0][0])
 
+    def test_instrumentation(self):
+        metrics = MetricsCollector()
+        bulk = SalesforceBulkipy(self.sessionId, self.endpoint, instrumentation=metrics)
+        self.bulk = bulk
+
+        job_id = bulk.create_query_job("Contact")
+        self.jobs.append(job_id)
+        batch_id = bulk.query(job_id, "Select Id,Name from Contact Limit 100")
+        bulk.wait_for_batch(job_id, batch_id, timeout=120, sleep_interval=2)
+        results = [list(x) for x in bulk.get_all_results_for_batch(batch_id=batch_id, job_id=job_id)]
+        self.assertTrue(len(results) > 0)
+
+        report = metrics.report()
+        self.assertEqual(report['requests']['job']['count'], 1)
+        self.assertEqual(report['requests']['upload']['count'], 1)
+        self.assertTrue(report['requests']['poll']['count'] >= 1)
+        self.assertTrue(report['requests']['download']['bytes_received'] > 0)
+        self.assertTrue(report['polls'][job_id] >= 1)
+        self.assertEqual(report['batches'][batch_id]['state'], 'Completed')
+        self.assertIn(job_id, report['jobs'])
+
     def test_csv_query(self):
         bulk = SalesforceBulkipy(self.sessionId, self.endpoint)
         self.bulk = bulk
@@ -210,6 +262,749 @@ class SalesforceBulkTest(unittest.TestCase):
         # Note: check manually that the items were created in SalesForce
 
 
+class MockServerTest(unittest.TestCase):
+    """Runs against the local mock Bulk API server, no Salesforce org needed"""
+
+    def setUp(self):
+        self.server = MockBulkServer(result_files=3, query_rows=10).start()
+        self.bulk = SalesforceBulkipy(session_id=self.server.session_id, host=self.server.host)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_query(self):
+        job_id = self.bulk.create_query_job("Contact")
+        batch_id = self.bulk.query(job_id, "Select Id,Name from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+        self.bulk.close_job(job_id)
+
+        results = [list(x) for x in self.bulk.get_all_results_for_batch(batch_id, job_id, parse_csv=True)]
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0], ['Id', 'Name'])
+        self.assertEqual(sum(len(r) - 1 for r in results), 10)
+
+    def test_bulk_csv_upload(self):
+        job_id = self.bulk.create_insert_job("Contact")
+        batch_ids = self.bulk.bulk_csv_upload(job_id, 'Name\n"a"\n"b"\n"c"', 2)
+        self.assertEqual(len(batch_ids), 2)
+        for batch_id in batch_ids:
+            self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+            self.assertTrue(self.bulk.get_upload_results(job_id, batch_id))
+
+    def test_json_jobs(self):
+        job_id = self.bulk.create_insert_job("Contact", contentType='JSON')
+        batch_ids = self.bulk.bulk_json_upload(job_id, ({'Name': 'test_name_%d' % i} for i in range(5)), 2)
+        self.assertEqual(len(batch_ids), 3)
+        self.assertEqual(self.server.batches[batch_ids[2]]['records'], 1)
+        self.bulk.wait_for_batch(job_id, batch_ids[0], sleep_interval=0.01)
+
+        self.results = None
+
+        def save_results(rows, failed, remaining):
+            self.results = rows
+        self.assertTrue(self.bulk.get_upload_results(job_id, batch_ids[0], callback=save_results))
+        self.assertEqual(len(self.results), 3)
+        self.assertEqual(self.results[1].success, 'true')
+
+        job_id = self.bulk.create_query_job("Contact", contentType='JSON')
+        batch_id = self.bulk.query(job_id, "Select Id,Name from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+        results = [list(x) for x in self.bulk.get_all_results_for_batch(batch_id, job_id)]
+        self.assertEqual([len(r) for r in results], [4, 4, 2])
+        self.assertEqual(results[0][0], {'Id': '001000000000000AAA', 'Name': 'Name 0'})
+        self.assertEqual(len(list(self.bulk.get_batch_result_iter(job_id, batch_id))), 4)
+
+    def test_extract(self):
+        self.server.query_rows = 100
+        rows = list(self.bulk.extract("Select Id,Name from Contact where CreatedDate >= 2020-01-01T00:10:00Z",
+                                      shards=4, parse_csv=True, sleep_interval=0.01))
+        self.assertEqual(rows[0], ['Id', 'Name'])
+        self.assertEqual(len(rows), 91)
+        self.assertEqual(len(set(row[0] for row in rows[1:])), 90)
+
+        conditions = self.bulk.shard_conditions("Select Id from Contact", 4)
+        self.assertEqual(len(conditions), 4)
+        self.assertEqual(sum(self.bulk.count(soql_utils.add_condition("Select Id from Contact", condition))
+                             for condition in conditions), 100)
+
+    def test_extract_pk_chunking(self):
+        self.server.query_rows = 25
+        rows = list(self.bulk.extract("Select Id from Contact", shards=3, shard_by='Id', sleep_interval=0.01))
+        self.assertEqual(rows[0], '"Id"')
+        self.assertEqual(len(rows), 26)
+        job, = self.server.jobs.values()
+        self.assertEqual(job['pkChunking'], 9)
+        self.assertEqual(len(job['batches']), 4)
+
+    def test_extract_limit(self):
+        self.server.query_rows = 25
+        for shard_by in ('CreatedDate', 'Id'):
+            self.server.jobs.clear()
+            rows = list(self.bulk.extract("Select Id from Contact LIMIT 5", shards=4, shard_by=shard_by,
+                                          sleep_interval=0.01))
+            self.assertEqual(len(rows), 6)
+            job, = self.server.jobs.values()
+            self.assertEqual(len(job['batches']), 1)
+
+    def test_sync(self):
+        snapshot = SqliteSnapshot(':memory:')
+        soql = "Select Id, Name from Contact"
+        result = self.bulk.sync(soql, snapshot, lookback=0, sleep_interval=0.01)
+        self.assertTrue(result['full'])
+        self.assertEqual((result['upserted'], snapshot.count('Contact')), (10, 10))
+
+        self.server.update_record(3)
+        self.server.delete_record(5)
+        result = self.bulk.sync(soql, snapshot, lookback=0, sleep_interval=0.01)
+        self.assertFalse(result['full'])
+        self.assertEqual((result['upserted'], result['deleted']), (1, 1))
+        self.assertEqual(result['watermark'], record_time(10))
+        self.assertEqual(snapshot.count('Contact'), 9)
+        self.assertNotIn('001000000000005AAA', [r['Id'] for r in snapshot.records('Contact')])
+
+        result = self.bulk.sync(soql, snapshot, lookback=0, sleep_interval=0.01)
+        self.assertEqual((result['upserted'], result['deleted']), (0, 0))
+        self.assertEqual(result['watermark'], record_time(10))
+
+    def test_sync_filtered(self):
+        snapshot = SqliteSnapshot(':memory:')
+        soql = "Select Id, Name from Contact where LastModifiedDate < 2020-01-01T01:00:00Z"
+        self.bulk.sync(soql, snapshot, sleep_interval=0.01)
+        self.assertEqual(snapshot.count('Contact'), 10)
+
+        # record 3 changes so it no longer matches the filter, record 4 still matches
+        self.server.update_record(3, record_time(120))
+        self.server.update_record(4, record_time(20))
+        result = self.bulk.sync(soql, snapshot, sleep_interval=0.01)
+        # the default lookback of 5 minutes re-reads records 5 to 9
+        self.assertEqual((result['upserted'], result['deleted']), (6, 1))
+        self.assertEqual(result['watermark'], record_time(20))
+        self.assertEqual(sorted(r['Id'] for r in snapshot.records('Contact')),
+                         ['001%012dAAA' % n for n in range(10) if n != 3])
+
+    def test_download_results_to(self):
+        job_id = self.bulk.create_query_job("Contact")
+        batch_id = self.bulk.query(job_id, "Select Id,Name from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+
+        out = BytesIO()
+        self.bulk.download_results_to(batch_id, out, job_id=job_id)
+        lines = out.getvalue().decode('utf-8').splitlines()
+        self.assertEqual(lines[0], '"Id","Name"')
+        self.assertEqual(len(lines), 11)
+
+        path = os.path.join(tempfile.mkdtemp(), 'contacts.csv.gz')
+        self.bulk.download_results_to(batch_id, path, compression='gzip')
+        with gzip.open(path, 'rb') as f:
+            self.assertEqual(f.read(), out.getvalue())
+
+        job_id = self.bulk.create_query_job("Contact", contentType='JSON')
+        batch_id = self.bulk.query(job_id, "Select Id,Name from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+        out = BytesIO()
+        self.bulk.download_results_to(batch_id, out)
+        records = json.loads(out.getvalue().decode('utf-8'))
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records[9]['Name'], 'Name 9')
+
+    @unittest.skipIf(result_sink.pyarrow is None, 'pyarrow is not installed')
+    def test_download_results_to_parquet(self):
+        import pyarrow.parquet
+        job_id = self.bulk.create_query_job("Contact")
+        batch_id = self.bulk.query(job_id, "Select Id,Name from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+
+        path = os.path.join(tempfile.mkdtemp(), 'contacts.parquet')
+        self.bulk.download_results_to(batch_id, path, format='parquet')
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.column_names, ['Id', 'Name'])
+        self.assertEqual(table.column('Name').to_pylist(), ['Name %d' % i for i in range(10)])
+
+    def test_get_batch_results_parallel(self):
+        self.server.record_factory = multiline_record_factory
+        job_id = self.bulk.create_query_job("Contact")
+        batch_id = self.bulk.query(job_id, "Select Id,Description,NumberOfEmployees from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+
+        rows = list(self.bulk.get_batch_results_parallel(batch_id, job_id, processes=2, chunk_size=64))
+        self.assertEqual(rows[0], ['Id', 'Description', 'NumberOfEmployees'])
+        self.assertEqual(rows[1:], [multiline_record_factory(None, i) for i in range(10)])
+
+        columns = list(self.bulk.get_batch_results_parallel(batch_id, job_id, processes=2, chunk_size=64,
+                                                            converters={'NumberOfEmployees': int},
+                                                            columnar=True))
+        self.assertEqual(list(itertools.chain.from_iterable(c['NumberOfEmployees'] for c in columns)),
+                         [i * 10 if i % 3 else None for i in range(10)])
+
+    def test_get_batch_results_parallel_spans_spool_blocks(self):
+        # every result file is larger than the 1 MB blocks it is spooled in
+        self.server.record_factory = multiline_record_factory
+        self.server.query_rows = 90000
+        job_id = self.bulk.create_query_job("Contact")
+        batch_id = self.bulk.query(job_id, "Select Id,Description,NumberOfEmployees from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+
+        rows = list(self.bulk.get_batch_results_parallel(batch_id, job_id, processes=2))
+        self.assertEqual(rows[0], ['Id', 'Description', 'NumberOfEmployees'])
+        self.assertEqual(len(rows), 90001)
+        self.assertEqual(rows[1:], [multiline_record_factory(None, i) for i in range(90000)])
+
+    def test_bulk_csv_file_upload(self):
+        path = os.path.join(tempfile.mkdtemp(), 'contacts.csv')
+        with open(path, 'wb') as f:
+            f.write(b'"Name","Description"\n')
+            for i in range(7):
+                f.write(b'"name %d","line 1\nline 2"\n' % i)
+
+        job_id = self.bulk.create_insert_job("Contact")
+        batch_ids = self.bulk.bulk_csv_file_upload(job_id, path, batch_size=3)
+        self.assertEqual([self.server.batches[b]['records'] for b in batch_ids], [3, 3, 1])
+        self.assertTrue(os.path.exists(path + '.offsets.json'))
+
+        batch_ids = self.bulk.bulk_csv_file_upload(job_id, path, batch_size=3, batch_numbers=[1])
+        self.assertEqual([self.server.batches[b]['records'] for b in batch_ids], [3])
+        self.bulk.wait_for_batch(job_id, batch_ids[0], sleep_interval=0.01)
+        self.results = None
+
+        def save_results(rows, failed, remaining):
+            self.results = rows
+        self.bulk.get_upload_results(job_id, batch_ids[0], callback=save_results)
+        self.assertEqual(len(self.results), 4)
+
+    def test_session_cache(self):
+        logins = []
+        server = self.server
+
+        class Bulk(SalesforceBulkipy):
+            @staticmethod
+            def login_to_salesforce_using_username_password(username, password, security_token, sandbox):
+                logins.append(username)
+                return server.session_id, server.host
+
+        cache = FileSessionCache(os.path.join(tempfile.mkdtemp(), 'sessions.json'))
+        credentials = dict(username='user', password='password', security_token='token', session_cache=cache)
+        Bulk(**credentials)
+        Bulk(**credentials)
+        self.assertEqual(logins, ['user'])
+
+        # the cached session expires, the next request logs in again and is retried
+        self.server.session_id = 'renewed-session-id'
+        metrics = MetricsCollector()
+        bulk = Bulk(instrumentation=metrics, **credentials)
+        job_id = bulk.create_query_job("Contact")
+        self.assertIn(job_id, self.server.jobs)
+        self.assertEqual(logins, ['user', 'user'])
+        self.assertEqual(cache.get('user', False), ('renewed-session-id', self.server.host))
+        self.assertEqual(metrics.report()['retries'], {'job': 1})
+
+    def test_login_again_threads(self):
+        logins = []
+        server = self.server
+        server.latency = 0.05
+
+        class Bulk(SalesforceBulkipy):
+            @staticmethod
+            def login_to_salesforce_using_username_password(username, password, security_token, sandbox):
+                logins.append(username)
+                time.sleep(0.05)
+                return server.session_id, server.host
+
+        cache = MemorySessionCache()
+        cache.set('user', False, 'expired-session-id', server.host)
+        bulk = Bulk(username='user', password='password', security_token='token', session_cache=cache)
+        job_ids = []
+        threads = [threading.Thread(target=lambda: job_ids.append(bulk.create_query_job("Contact")))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        # the requests rejected together log in once
+        self.assertEqual(len(set(job_ids)), 3)
+        self.assertEqual(logins, ['user'])
+
+    def test_governor(self):
+        self.server.latency = 0.02
+        governor = BulkGovernor(concurrency={'poll': 2}, reserve={'DailyBulkApiBatches': 14497})
+        metrics = MetricsCollector()
+        bulk = SalesforceBulkipy(session_id=self.server.session_id, host=self.server.host,
+                                 instrumentation=metrics, governor=governor)
+        threads = [threading.Thread(target=bulk.create_query_job, args=("Contact",)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.server.jobs), 8)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+        self.server.throttled = 2
+        job_id = bulk.create_query_job("Contact")
+        self.assertEqual(metrics.report()['retries'], {'job': 2})
+
+        self.assertEqual(governor.refresh_limits(bulk)['DailyBulkApiBatches']['Remaining'], 14500)
+        batch_ids = [bulk.query(job_id, "Select Id from Contact") for _ in range(3)]
+        self.assertEqual(governor.budget(self.server.host)['DailyBulkApiBatches']['Remaining'], 14497)
+        self.assertRaises(BulkBudgetExhausted, bulk.query, job_id, "Select Id from Contact")
+
+        bulk.wait_for_batch(job_id, batch_ids[0], sleep_interval=0.01)
+        result_id = bulk.get_batch_result_ids(batch_ids[0], job_id)[0]
+        rows = bulk.get_batch_results(batch_ids[0], result_id, job_id)
+        next(rows)
+        self.assertEqual(governor.report()[self.server.host]['in_flight'], {'download': 1})
+        list(rows)
+        self.assertEqual(governor.report()[self.server.host]['in_flight'], {})
+
+    def test_forget_finished_jobs(self):
+        job_id = self.bulk.create_query_job("Contact")
+        batch_id = self.bulk.query(job_id, "Select Id from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+        open_job_id = self.bulk.create_query_job("Contact")
+        self.assertEqual(self.bulk.forget_finished_jobs(), [])
+
+        self.bulk.close_job(job_id)
+        self.assertEqual(self.bulk.forget_finished_jobs(), [job_id])
+        self.assertNotIn(batch_id, self.bulk.batches)
+        self.assertNotIn(batch_id, self.bulk.batch_statuses)
+        self.assertEqual(list(self.bulk.jobs), [open_job_id])
+
+        # finished jobs are forgotten after their statuses were evicted
+        bulk = SalesforceBulkipy(session_id=self.server.session_id, host=self.server.host, status_cache_size=1)
+        job_ids = [bulk.create_query_job("Contact") for _ in range(3)]
+        for job_id in job_ids:
+            batch_id = bulk.query(job_id, "Select Id from Contact")
+            bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+            bulk.close_job(job_id)
+        self.assertEqual(len(bulk.batch_statuses), 1)
+        self.assertEqual(sorted(bulk.forget_finished_jobs()), sorted(job_ids))
+        self.assertEqual(bulk.batches, {})
+        self.assertEqual(bulk.batch_statuses._evicted_states, {})
+        self.assertEqual(bulk.job_statuses._evicted_states, {})
+
+    def test_instrumentation(self):
+        metrics = MetricsCollector()
+        self.server.queued_delay = self.server.processing_delay = 0.05
+        bulk = SalesforceBulkipy(session_id=self.server.session_id, host=self.server.host,
+                                 instrumentation=metrics)
+        job_id = bulk.create_query_job("Contact")
+        batch_id = bulk.query(job_id, "Select Id,Name from Contact")
+        bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+        for result in bulk.get_all_results_for_batch(batch_id, job_id):
+            list(result)
+
+        report = metrics.report()
+        self.assertEqual(report['requests']['job']['count'], 1)
+        self.assertEqual(report['requests']['download']['count'], 3)
+        self.assertTrue(report['requests']['download']['bytes_received'] > 0)
+        self.assertTrue(report['polls'][job_id] > 2)
+        batch = report['batches'][batch_id]
+        self.assertEqual(batch['state'], 'Completed')
+        self.assertEqual(batch['records'], 10)
+        self.assertTrue(batch['queued_time'] > 0)
+        self.assertTrue(report['jobs'][job_id]['records_per_second'] > 0)
+
+
+class MockServerV2Test(unittest.TestCase):
+    """Bulk API 2.0 client against the local mock server"""
+
+    def setUp(self):
+        self.server = MockBulkServer(query_rows=25, processing_delay=0.05).start()
+        self.bulk = SalesforceBulkipyV2(session_id=self.server.session_id, host=self.server.host,
+                                        max_records=10)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_query_pages(self):
+        job_id = self.bulk.create_query_job("Contact")
+        batch_id = self.bulk.query(job_id, "Select Id,Name from Contact")
+        self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+        self.bulk.close_job(job_id)
+
+        pages = [list(x) for x in self.bulk.get_all_results_for_batch(batch_id, job_id, parse_csv=True)]
+        self.assertEqual([len(page) for page in pages], [11, 11, 6])
+        self.assertEqual(pages[2][0], ['Id', 'Name'])
+
+        rows = list(self.bulk.get_batch_result_iter(job_id, batch_id, parse_csv=True))
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[-1]['Name'], 'Name 24')
+
+    def test_governor_pages(self):
+        governor = BulkGovernor(concurrency={'download': 1})
+        bulk = SalesforceBulkipyV2(session_id=self.server.session_id, host=self.server.host,
+                                   max_records=10, governor=governor)
+        job_id = bulk.create_query_job("Contact")
+        batch_id = bulk.query(job_id, "Select Id from Contact")
+        bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+
+        def read_pages():
+            # pages collected before they are read, and pages read partly
+            pages.extend(bulk.get_all_results_for_batch(batch_id, job_id))
+            first_rows.extend(next(page) for page in bulk.get_all_results_for_batch(batch_id, job_id))
+
+        pages, first_rows = [], []
+        thread = threading.Thread(target=read_pages)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([len(list(page)) for page in pages], [11, 11, 6])
+        self.assertEqual(first_rows, ['"Id"'] * 3)
+        self.assertEqual(governor.report()[self.server.host]['in_flight'], {})
+
+    def test_extract_pk_chunking(self):
+        with self.assertRaises(ValueError):
+            next(self.bulk.extract("Select Id from Contact", shard_by='Id'))
+        self.assertEqual(self.server.jobs, {})
+
+    def test_download_results_to(self):
+        batch_id = self.bulk.query(None, "Select Id,Name from Contact")
+        self.bulk.wait_for_batch(self.bulk.lookup_job_id(batch_id), batch_id, sleep_interval=0.01)
+        out = BytesIO()
+        self.bulk.download_results_to(batch_id, out)
+        lines = out.getvalue().decode('utf-8').splitlines()
+        self.assertEqual(lines[0], '"Id","Name"')
+        self.assertEqual(len(lines), 26)
+
+    def test_bulk_csv_file_upload(self):
+        path = os.path.join(tempfile.mkdtemp(), 'contacts.csv')
+        with open(path, 'wb') as f:
+            f.write(b'Name\n"a"\n"b"\n"c"\n')
+        job_id = self.bulk.create_insert_job("Contact")
+        self.assertEqual(self.bulk.bulk_csv_file_upload(job_id, path), [job_id])
+        self.bulk.wait_for_batch(job_id, job_id, sleep_interval=0.01)
+        self.assertEqual(self.bulk.batch_status(job_id, job_id)['numberRecordsProcessed'], 3)
+
+    def test_bulk_csv_upload(self):
+        job_id = self.bulk.create_insert_job("Contact")
+        batch_ids = self.bulk.bulk_csv_upload(job_id, 'Name\n"a"\n"b"\n"c"')
+        self.assertEqual(batch_ids, [job_id])
+        self.bulk.close_job(job_id)
+        self.bulk.wait_for_batch(job_id, job_id, sleep_interval=0.01)
+        self.assertEqual(self.bulk.batch_status(job_id, job_id)['numberRecordsProcessed'], 3)
+
+        self.results = None
+
+        def save_results(rows, failed, remaining):
+            self.results = rows
+        self.assertTrue(self.bulk.get_upload_results(job_id, job_id, callback=save_results))
+        self.assertEqual(len(self.results), 4)
+        self.assertEqual(self.results[1].success, 'true')
+
+    def test_forget_finished_jobs(self):
+        bulk = SalesforceBulkipyV2(session_id=self.server.session_id, host=self.server.host, status_cache_size=2)
+        handles = [bulk.create_query_job("Contact") for _ in range(3)]
+        query_job_ids = [bulk.query(handle, "Select Id from Contact") for handle in handles]
+        ingest_job_ids = [bulk.create_insert_job("Contact") for _ in range(3)]
+        for job_id in ingest_job_ids:
+            bulk.bulk_csv_upload(job_id, 'Name\n"a"')
+        open_handle = bulk.create_query_job("Contact")
+        open_query_job_id = bulk.query(open_handle, "Select Id from Contact")
+        self.assertEqual(bulk.forget_finished_jobs(), [])
+
+        for handle, batch_id in zip(handles + ingest_job_ids, query_job_ids + ingest_job_ids):
+            bulk.wait_for_batch(handle, batch_id, sleep_interval=0.01)
+        self.assertEqual(bulk.job_status(handles[0])['state'], 'Closed')
+        self.assertEqual(sorted(bulk.forget_finished_jobs()), sorted(handles + ingest_job_ids))
+
+        self.assertEqual(bulk.jobs, {open_handle: open_handle})
+        self.assertEqual(bulk.batches, {open_query_job_id: open_handle})
+        self.assertEqual(list(bulk.query_handles), [open_handle])
+        self.assertEqual(bulk.job_types, {open_query_job_id: 'query'})
+        self.assertEqual(bulk.uploaded_jobs, set())
+        self.assertEqual(bulk.batch_statuses._evicted_states, {})
+
+        bulk.abort_job(open_handle)
+        self.assertEqual(bulk.forget_finished_jobs(), [open_handle])
+        self.assertEqual(bulk.job_types, {})
+
+
+class AsyncChunks(object):
+    """An async iterator over chunks, without async def"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+        return asyncio.sleep(0, result=chunk)
+
+
+@unittest.skipIf(AsyncSalesforceBulkipy is None, 'aiohttp is not installed')
+class AsyncMockServerTest(unittest.TestCase):
+    """AsyncSalesforceBulkipy against the local mock server"""
+
+    def setUp(self):
+        self.server = MockBulkServer(result_files=3, query_rows=10).start()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.bulk = AsyncSalesforceBulkipy(session_id=self.server.session_id, host=self.server.host)
+
+    def tearDown(self):
+        self.complete(self.bulk.close())
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        self.server.stop()
+
+    def complete(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def collect(self, aiterator):
+        items = []
+        while True:
+            try:
+                items.append(self.complete(aiterator.__anext__()))
+            except StopAsyncIteration:
+                return items
+
+    def test_query(self):
+        job_id = self.complete(self.bulk.create_query_job("Contact"))
+        batch_id = self.complete(self.bulk.query(job_id, "Select Id,Name from Contact"))
+        self.complete(self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01))
+        self.complete(self.bulk.close_job(job_id))
+        self.assertEqual(self.bulk.job_statuses[job_id]['state'], 'Closed')
+
+        results = [self.collect(result) for result in
+                   self.collect(self.bulk.get_all_results_for_batch(batch_id, job_id, parse_csv=True))]
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0], ['Id', 'Name'])
+        self.assertEqual(sum(len(r) - 1 for r in results), 10)
+
+        bulk = SalesforceBulkipy(session_id=self.server.session_id, host=self.server.host)
+        result_id = self.complete(self.bulk.get_batch_result_ids(batch_id, job_id))[0]
+        self.assertEqual(self.collect(self.bulk.get_batch_results(batch_id, result_id, job_id)),
+                         list(bulk.get_batch_results(batch_id, result_id, job_id)))
+
+    def test_multiline_results(self):
+        self.server.record_factory = multiline_record_factory
+        job_id = self.complete(self.bulk.create_query_job("Contact"))
+        batch_id = self.complete(self.bulk.query(job_id, "Select Id,Description,Amount from Contact"))
+        self.assertEqual(self.collect(self.bulk.iter_completed_batches(job_id, [batch_id], sleep_interval=0.01)),
+                         [batch_id])
+        rows = [row for result in self.collect(self.bulk.get_all_results_for_batch(batch_id, job_id, parse_csv=True))
+                for row in self.collect(result) if row[0] != 'Id']
+        self.assertEqual(rows, [multiline_record_factory(None, n) for n in range(10)])
+
+    def test_concurrent_jobs(self):
+        self.server.latency = 0.05
+        bulk = AsyncSalesforceBulkipy(session_id=self.server.session_id, host=self.server.host,
+                                      concurrency={'poll': 3})
+        try:
+            job_ids = self.complete(asyncio.gather(*[bulk.create_query_job("Contact") for _ in range(12)]))
+            self.assertEqual(len(set(job_ids)), 12)
+            self.assertEqual(self.server.max_in_flight, 3)
+
+            batch_ids = self.complete(asyncio.gather(*[bulk.query(job_id, "Select Id from Contact")
+                                                  for job_id in job_ids]))
+            self.complete(asyncio.gather(*[bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01)
+                                      for job_id, batch_id in zip(job_ids, batch_ids)]))
+            self.assertEqual(set(bulk.batch_statuses[batch_id]['state'] for batch_id in batch_ids),
+                             set(['Completed']))
+        finally:
+            self.complete(bulk.close())
+
+    def test_uploads(self):
+        job_id = self.complete(self.bulk.create_insert_job("Contact"))
+        batch_id = self.complete(self.bulk.post_bulk_batch(job_id, AsyncChunks([b'Name\n', b'"a"\n', b'"b"\n'])))
+        self.assertEqual(self.server.batches[batch_id]['records'], 2)
+        batch_ids = self.complete(self.bulk.bulk_csv_upload(job_id, 'Name\n"a"\n"b"\n"c"', 2))
+        self.assertEqual([self.server.batches[b]['records'] for b in batch_ids], [1, 2])
+
+        job_id = self.complete(self.bulk.create_insert_job("Contact", contentType='JSON'))
+        batch_ids = self.complete(self.bulk.bulk_json_upload(
+            job_id, AsyncChunks({'Name': 'test_name_%d' % i} for i in range(5)), 2))
+        self.assertEqual([self.server.batches[b]['records'] for b in batch_ids], [2, 2, 1])
+
+        job_id = self.complete(self.bulk.create_query_job("Contact", contentType='JSON'))
+        batch_id = self.complete(self.bulk.query(job_id, "Select Id,Name from Contact"))
+        self.complete(self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01))
+        results = [self.collect(result) for result in self.collect(self.bulk.get_all_results_for_batch(batch_id))]
+        self.assertEqual([len(r) for r in results], [4, 4, 2])
+        self.assertEqual(results[0][0], {'Id': '001000000000000AAA', 'Name': 'Name 0'})
+
+    def test_upload_results(self):
+        job_id = self.complete(self.bulk.create_insert_job("Contact"))
+        batch_id = self.complete(self.bulk.post_bulk_batch(job_id, 'Name\n"a"\n"b"\n'))
+        self.complete(self.bulk.wait_for_batch(job_id, batch_id, sleep_interval=0.01))
+        self.assertEqual(self.complete(self.bulk.job_state(job_id)), 'Open')
+
+        results = []
+        self.assertTrue(self.complete(self.bulk.get_upload_results(
+            job_id, batch_id, callback=lambda rows, remaining, line: results.extend(rows))))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[1].success, 'true')
+        self.assertEqual(self.complete(self.bulk.count("Select Id from Contact")), 10)
+
+    def test_sync_only_methods(self):
+        blocking = []
+        for name in dir(AsyncSalesforceBulkipy):
+            method = getattr(AsyncSalesforceBulkipy, name)
+            if (name.startswith('_') or not callable(method) or name in SYNC_ONLY_METHODS
+                    or inspect.iscoroutinefunction(method) or inspect.isasyncgenfunction(method)):
+                continue
+            blocking.append(name)
+        # the methods left do not send requests, or return the coroutine of create_job
+        self.assertEqual(sorted(blocking), [
+            'batch_headers', 'check_status', 'count_file_lines', 'create_abort_job_doc',
+            'create_close_job_doc', 'create_delete_job', 'create_insert_job', 'create_job_doc',
+            'create_query_job', 'create_update_job', 'create_upsert_job', 'csv_file_index',
+            'forget_finished_jobs', 'forget_job', 'headers', 'login_to_salesforce_using_username_password',
+            'lookup_job_id', 'parse_csv', 'raise_error', 'split_csv'])
+
+        with self.assertRaises(TypeError):
+            list(self.bulk.extract("Select Id from Contact"))
+        self.assertEqual(self.server.jobs, {})
+
+    def test_login_again(self):
+        logins = []
+        server = self.server
+
+        class Bulk(AsyncSalesforceBulkipy):
+            @staticmethod
+            def login_to_salesforce_using_username_password(username, password, security_token, sandbox):
+                logins.append(username)
+                return server.session_id, server.host
+
+        cache = MemorySessionCache()
+        cache.set('user', False, 'expired-session-id', server.host)
+        bulk = Bulk(username='user', password='password', security_token='token', session_cache=cache)
+        try:
+            # the requests rejected together log in once
+            job_ids = self.complete(asyncio.gather(*[bulk.create_query_job("Contact") for _ in range(3)]))
+            self.assertEqual(len(set(job_ids)), 3)
+            self.assertEqual(logins, ['user'])
+        finally:
+            self.complete(bulk.close())
+
+
+class GovernorTest(unittest.TestCase):
+    def test_round_robin(self):
+        governor = BulkGovernor(concurrency={'upload': 1})
+        granted = []
+        slots = []
+
+        def upload(job_id):
+            slots.append(governor.acquire('org', 'upload', job_id))
+            granted.append(job_id)
+
+        slots.append(governor.acquire('org', 'upload', 'a'))
+        threads = []
+        for job_id in ('a', 'a', 'b'):
+            threads.append(threading.Thread(target=upload, args=(job_id,)))
+            threads[-1].start()
+            while governor.report()['org']['waiting'].get('upload', 0) < len(threads):
+                time.sleep(0.001)
+        for n in range(3):
+            slots[n].release()
+            while len(granted) < n + 1:
+                time.sleep(0.001)
+        self.assertEqual(granted, ['a', 'b', 'a'])
+        slots[3].release()
+        self.assertEqual(governor.report()['org']['in_flight'], {})
+
+
+class SessionCacheTest(unittest.TestCase):
+    def test_ttl(self):
+        self.now = 0
+        cache = MemorySessionCache(ttl=60, clock=lambda: self.now)
+        cache.set('user', True, 'session', 'host')
+        self.assertIsNone(cache.get('user', False))
+        self.now = 59
+        self.assertEqual(cache.get('user', True), ('session', 'host'))
+        self.now = 60
+        self.assertIsNone(cache.get('user', True))
+
+
+class ResultSinkTest(unittest.TestCase):
+    def test_write_csv(self):
+        out = BytesIO()
+        result_sink.write_csv([[b'"Id"\n"1"'], [b'"Id"\n', b'"2"\n'], [b'"Id"\n"3"']], out)
+        self.assertEqual(out.getvalue(), b'"Id"\n"1"\n"2"\n"3"')
+
+        # chunks cut records anywhere
+        out = BytesIO()
+        result_sink.write_csv([[b'"Id","Name"\n"1","ab', b'cd"\n"2",', b'"ef"'], [b'"Id","Na', b'me"\n"3","gh"\n']], out)
+        self.assertEqual(out.getvalue(), b'"Id","Name"\n"1","abcd"\n"2","ef"\n"3","gh"\n')
+
+    @unittest.skipIf(result_sink.pyarrow is None, 'pyarrow is not installed')
+    def test_write_parquet(self):
+        import pyarrow.parquet
+        rows = [['%d' % i, 'line 1\nline 2 ' + 'x' * (i % 50)] for i in range(2000)]
+        data = ''.join('"%s","%s"\n' % tuple(row) for row in rows).encode('ascii')
+        # the values span lines across many blocks
+        out = BytesIO()
+        result_sink.write_parquet([[b'"Id","Description"\n', data[:5000], data[5000:]]], out, block_size=1024)
+        table = pyarrow.parquet.read_table(BytesIO(out.getvalue()))
+        self.assertEqual(table.column('Description').to_pylist(), [row[1] for row in rows])
+
+        out = BytesIO()
+        result_sink.write_parquet([[b'"Id","Name"\n'], [result_sink.NO_RESULTS.encode('ascii')]], out)
+        table = pyarrow.parquet.read_table(BytesIO(out.getvalue()))
+        self.assertEqual((table.column_names, table.num_rows), (['Id', 'Name'], 0))
+
+
+class CsvOffsetsTest(unittest.TestCase):
+    def test_last_record_end(self):
+        data = b'"a","b\nc"\n"d","e"\n"f","g\n'
+        self.assertEqual(last_record_end(data), data.index(b'"f"'))
+        self.assertEqual(last_record_end(data, 0, 9), -1)
+
+    def test_iter_record_chunks(self):
+        data = b''.join(b'"%d","x\ny",%d\n' % (i, i) for i in range(100))
+        chunks = list(iter_record_chunks(BytesIO(data), 16))
+        self.assertEqual(b''.join(chunks), data)
+        for chunk in chunks:
+            rows = list(csv.reader(StringIO(chunk.decode('ascii'), newline='')))
+            self.assertTrue(rows and all(row[1] == 'x\ny' for row in rows))
+
+
+class StatusCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = StatusCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_ttl(self):
+        self.cache['queued'] = {'state': 'Queued'}
+        self.cache['done'] = {'state': 'Completed'}
+        self.now = 9
+        self.assertIn('queued', self.cache)
+        self.now = 10
+        self.assertNotIn('queued', self.cache)
+        self.assertEqual(self.cache.peek('queued'), {'state': 'Queued'})
+        self.now = 10000
+        self.assertEqual(self.cache['done'], {'state': 'Completed'})
+
+    def test_lru_eviction(self):
+        self.cache['a'] = {'state': 'Completed'}
+        self.cache['b'] = {'state': 'Completed'}
+        self.cache.get('a')
+        self.cache['c'] = {'state': 'Completed'}
+        self.assertEqual(len(self.cache), 2)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertEqual(self.cache.last_state('a'), 'Completed')
+        # the states of untracked keys are not kept after eviction
+        self.assertIsNone(self.cache.last_state('b'))
+
+    def test_tracked_states(self):
+        tracked = {'a': 'job'}
+        cache = StatusCache(max_size=1, ttl=10, tracked=tracked)
+        for key in ('a', 'b', 'c'):
+            cache[key] = {'state': 'Completed'}
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.last_state('a'), 'Completed')
+        self.assertIsNone(cache.last_state('b'))
+        self.assertEqual(len(cache._evicted_states), 1)
+        cache.pop('a')
+        self.assertIsNone(cache.last_state('a'))
+        self.assertEqual(cache._evicted_states, {})
+
+
 if __name__ == '__main__':
     username = raw_input("Salesforce username: ")
     password = raw_input("Salesforce password: ")